@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+授課時數與使用率統計
+事件索引轉換為欄位陣列（開始時間、時長、講師代碼、地點代碼、課程類型代碼、代課旗標），
+以分組加總一次算出授課時數、代課比例、地點使用率與尖峰時段；
+有安裝 NumPy 時使用向量化運算，否則改用純 Python 計算，結果相同
+"""
+
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from availability import BUSINESS_END, BUSINESS_START
+from event_index import EPOCH, SECONDS_PER_DAY, EventIndex
+from title_parser import UNKNOWN_INSTRUCTOR
+
+try:
+    import numpy as np
+except ImportError:  # 未安裝 NumPy 時使用純 Python 計算
+    np = None
+
+PERIODS = ('week', 'month')
+UNKNOWN_LOCATION = '未知地點'
+UNKNOWN_COURSE_TYPE = '未分類'
+
+
+def _encode(values: List[str]):
+    """字典編碼：回傳 (代碼陣列, 類別列表)"""
+    codes = {}
+    encoded = array('i', [codes.setdefault(value, len(codes)) for value in values])
+    return encoded, list(codes)
+
+
+def period_label(day: int, period: str) -> str:
+    """天數（自 1970-01-01 起算）所屬的週（週一日期）或月份"""
+    date = EPOCH + timedelta(days=day)
+    if period == 'week':
+        return (date - timedelta(days=date.weekday())).strftime('%Y-%m-%d')
+    return date.strftime('%Y-%m')
+
+
+class EventColumns:
+    """
+    事件欄位陣列（依開始時間排序，與 EventIndex.events 順序相同）
+
+    類別欄位以整數代碼保存，instructors / locations / course_types 為代碼對應的名稱；
+    各欄位為固定寬度的 array（不建立每個事件的 int 物件），starts 直接使用索引的開始時間
+    """
+
+    def __init__(self, index: EventIndex):
+        self.starts = index.starts
+        self.durations = array('q', [end - start for start, end in zip(index.starts, index.ends)])
+        self.instructor_codes, self.instructors = _encode(
+            [instructor or UNKNOWN_INSTRUCTOR for instructor in index.column('instructor')])
+        self.location_codes, self.locations = _encode(
+            [course_location or location or UNKNOWN_LOCATION
+             for course_location, location in zip(index.column('course_location'), index.column('location'))])
+        self.course_type_codes, self.course_types = _encode(
+            [course_type or UNKNOWN_COURSE_TYPE for course_type in index.column('course_type')])
+        self.substitutes = array('b', [1 if substitute else 0 for substitute in index.column('substitute_type')])
+
+        if np is not None:
+            self.arrays = {
+                'starts': np.array(self.starts, dtype=np.int64),
+                'durations': np.array(self.durations, dtype=np.int64),
+                'instructor_codes': np.array(self.instructor_codes, dtype=np.int32),
+                'location_codes': np.array(self.location_codes, dtype=np.int32),
+                'course_type_codes': np.array(self.course_type_codes, dtype=np.int32),
+                'substitutes': np.array(self.substitutes, dtype=np.int8),
+            }
+        else:
+            self.arrays = None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def report(self, start: Optional[int] = None, end: Optional[int] = None, period: str = 'month',
+               day_start: int = BUSINESS_START, day_end: int = BUSINESS_END,
+               vectorized: Optional[bool] = None) -> Dict:
+        """
+        統計 [start, end) 內開始的事件
+
+        Args:
+            start, end: 範圍（秒數，None 表示不限）
+            period: 'week' 或 'month'
+            day_start, day_end: 每天營業時間（計算地點使用率）
+            vectorized: 是否使用 NumPy（None 表示有安裝就使用）
+        """
+        lo = 0 if start is None else bisect_left(self.starts, start)
+        hi = len(self.starts) if end is None else bisect_left(self.starts, end)
+        hi = max(lo, hi)
+        if vectorized is None:
+            vectorized = self.arrays is not None
+        sums = self._sums_numpy(lo, hi, period) if vectorized else self._sums_python(lo, hi, period)
+
+        # 營業時數：範圍內的天數 × 每天營業時數（未指定範圍時以事件涵蓋的天數計算）
+        first_day = (start if start is not None else (self.starts[lo] if hi > lo else 0)) // SECONDS_PER_DAY
+        last_day = ((end - 1) if end is not None else (self.starts[hi - 1] if hi > lo else 0)) // SECONDS_PER_DAY
+        business_hours = max(0, last_day - first_day + 1) * (day_end - day_start) / 3600
+
+        teaching_hours = {}
+        for code, name in enumerate(self.instructors):
+            by_period = {label: round(seconds / 3600, 2)
+                         for label, seconds in zip(sums['periods'], sums['instructor_period'][code]) if seconds}
+            if by_period:
+                teaching_hours[name] = {'total': round(sum(by_period.values()), 2), 'by_period': by_period}
+
+        substitutes = {}
+        for code, name in enumerate(self.instructors):
+            count = sums['instructor_events'][code]
+            if count:
+                substitute_count = sums['instructor_substitutes'][code]
+                substitutes[name] = {
+                    'events': count,
+                    'substitute_events': substitute_count,
+                    'ratio': round(substitute_count / count, 4)
+                }
+
+        locations = {}
+        for code, name in enumerate(self.locations):
+            count = sums['location_events'][code]
+            if count:
+                hours = sums['location_seconds'][code] / 3600
+                locations[name] = {
+                    'events': count,
+                    'hours': round(hours, 2),
+                    'utilization': round(hours / business_hours, 4) if business_hours else None
+                }
+
+        course_types = {name: sums['course_type_events'][code]
+                        for code, name in enumerate(self.course_types) if sums['course_type_events'][code]}
+
+        by_hour = sums['by_hour']
+        total = hi - lo
+        return {
+            'engine': 'numpy' if vectorized else 'python',
+            'events': total,
+            'period': period,
+            'periods': sums['periods'],
+            'business_hours': round(business_hours, 2),
+            'teaching_hours': teaching_hours,
+            'substitutes': substitutes,
+            'locations': locations,
+            'course_types': course_types,
+            'peak_hours': {
+                'by_hour': by_hour,
+                'by_weekday': sums['by_weekday'],
+                'busiest_hour': by_hour.index(max(by_hour)) if total else None
+            }
+        }
+
+    def _period_codes(self, days: List[int], period: str):
+        """不重複的天數轉換為期間代碼：回傳 ({天數: 代碼}, 期間標籤)"""
+        labels = {}
+        day_codes = {}
+        for day in sorted(set(days)):
+            label = period_label(day, period)
+            day_codes[day] = labels.setdefault(label, len(labels))
+        return day_codes, list(labels)
+
+    def _sums_python(self, lo: int, hi: int, period: str) -> Dict:
+        starts = self.starts[lo:hi]
+        durations = self.durations[lo:hi]
+        instructors = self.instructor_codes[lo:hi]
+        locations = self.location_codes[lo:hi]
+        days = [start // SECONDS_PER_DAY for start in starts]
+        day_codes, periods = self._period_codes(days, period)
+
+        instructor_period = [[0] * len(periods) for _ in self.instructors]
+        instructor_events = [0] * len(self.instructors)
+        instructor_substitutes = [0] * len(self.instructors)
+        location_events = [0] * len(self.locations)
+        location_seconds = [0] * len(self.locations)
+        course_type_events = [0] * len(self.course_types)
+        by_hour = [0] * 24
+        by_weekday = [0] * 7
+
+        for i, (start, duration, instructor, location, day) in enumerate(
+                zip(starts, durations, instructors, locations, days)):
+            instructor_period[instructor][day_codes[day]] += duration
+            instructor_events[instructor] += 1
+            instructor_substitutes[instructor] += self.substitutes[lo + i]
+            location_events[location] += 1
+            location_seconds[location] += duration
+            course_type_events[self.course_type_codes[lo + i]] += 1
+            by_hour[start % SECONDS_PER_DAY // 3600] += 1
+            # 1970-01-01 為週四，(day + 3) % 7 == 0 為週一
+            by_weekday[(day + 3) % 7] += 1
+
+        return {
+            'periods': periods,
+            'instructor_period': instructor_period,
+            'instructor_events': instructor_events,
+            'instructor_substitutes': instructor_substitutes,
+            'location_events': location_events,
+            'location_seconds': location_seconds,
+            'course_type_events': course_type_events,
+            'by_hour': by_hour,
+            'by_weekday': by_weekday,
+        }
+
+    def _sums_numpy(self, lo: int, hi: int, period: str) -> Dict:
+        arrays = {name: values[lo:hi] for name, values in self.arrays.items()}
+        starts = arrays['starts']
+        durations = arrays['durations']
+        instructors = arrays['instructor_codes']
+        days = starts // SECONDS_PER_DAY
+
+        unique_days, day_positions = np.unique(days, return_inverse=True)
+        day_codes, periods = self._period_codes(unique_days.tolist(), period)
+        period_codes = np.array([day_codes[day] for day in unique_days.tolist()], dtype=np.int64)[day_positions]
+
+        instructor_count = len(self.instructors)
+        location_count = len(self.locations)
+        period_count = len(periods)
+        instructor_period = np.bincount(instructors.astype(np.int64) * period_count + period_codes,
+                                        weights=durations, minlength=instructor_count * period_count)
+
+        def counts(codes, size, weights=None):
+            return np.bincount(codes, weights=weights, minlength=size).astype(np.int64).tolist()
+
+        return {
+            'periods': periods,
+            'instructor_period': instructor_period.astype(np.int64).reshape(instructor_count, period_count).tolist()
+            if period_count else [[] for _ in self.instructors],
+            'instructor_events': counts(instructors, instructor_count),
+            'instructor_substitutes': counts(instructors, instructor_count, arrays['substitutes']),
+            'location_events': counts(arrays['location_codes'], location_count),
+            'location_seconds': counts(arrays['location_codes'], location_count, durations),
+            'course_type_events': counts(arrays['course_type_codes'], len(self.course_types)),
+            'by_hour': counts(starts % SECONDS_PER_DAY // 3600, 24),
+            'by_weekday': counts((days + 3) % 7, 7),
+        }
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+講師空檔計算
+每位講師的事件合併為互不重疊、依時間排序的忙碌區間，以二分搜尋查詢任一時段的空檔，
+用於找代課講師
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from event_index import SECONDS_PER_DAY, EventIndex, event_span
+from title_parser import UNKNOWN_INSTRUCTOR
+
+# 預設營業時間（自午夜起算的秒數）
+BUSINESS_START = 8 * 3600
+BUSINESS_END = 22 * 3600
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """合併重疊或相接的區間"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def business_windows(start: int, end: int, day_start: int = BUSINESS_START,
+                     day_end: int = BUSINESS_END) -> List[Tuple[int, int]]:
+    """[start, end) 範圍內每天的營業時段"""
+    windows = []
+    day = start - start % SECONDS_PER_DAY
+    while day < end:
+        window_start = max(start, day + day_start)
+        window_end = min(end, day + day_end)
+        if window_start < window_end:
+            windows.append((window_start, window_end))
+        day += SECONDS_PER_DAY
+    return windows
+
+
+class BusySchedule:
+    """單一講師的忙碌區間（已合併，starts 與 ends 皆為遞增）"""
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]]):
+        merged = merge_intervals(intervals)
+        self.starts = array('q', [start for start, _ in merged])
+        self.ends = array('q', [end for _, end in merged])
+
+    def overlapping(self, start: int, end: int) -> range:
+        """與 [start, end) 重疊的忙碌區間位置"""
+        return range(bisect_right(self.ends, start), bisect_left(self.starts, end))
+
+    def busy(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """[start, end) 內的忙碌區間（裁切到範圍內）"""
+        return [(max(self.starts[i], start), min(self.ends[i], end)) for i in self.overlapping(start, end)]
+
+    def busy_seconds(self, start: int, end: int) -> int:
+        return sum(busy_end - busy_start for busy_start, busy_end in self.busy(start, end))
+
+    def free(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """[start, end) 內的空檔"""
+        slots = []
+        cursor = start
+        for busy_start, busy_end in self.busy(start, end):
+            if busy_start > cursor:
+                slots.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if cursor < end:
+            slots.append((cursor, end))
+        return slots
+
+    def gaps(self, start: int, end: int) -> Tuple[Optional[int], Optional[int]]:
+        """[start, end) 與前一個、後一個忙碌區間的間隔秒數（沒有時為 None）"""
+        before = bisect_right(self.ends, start) - 1
+        after = bisect_left(self.starts, end)
+        return (start - self.ends[before] if before >= 0 else None,
+                self.starts[after] - end if after < len(self.starts) else None)
+
+
+class AvailabilityIndex:
+    """
+    所有講師的忙碌區間
+
+    由 EventIndex 建立（事件集合變更時隨索引整體重建），
+    另記錄每位講師替其他講師代課的次數，作為排序候選人的參考
+    """
+
+    def __init__(self, index: EventIndex, instructors: Iterable[str] = ()):
+        intervals = {name: [] for name in instructors if name and name != UNKNOWN_INSTRUCTOR}
+        self.substitute_counts = {}
+        for start, end, instructor, substitute, original in zip(
+                index.starts, index.ends, index.column('instructor'), index.column('substitute_type'),
+                index.column('original_instructor')):
+            if not instructor or instructor == UNKNOWN_INSTRUCTOR:
+                continue
+            intervals.setdefault(instructor, []).append((start, end))
+            if substitute and original:
+                key = (instructor, original.upper())
+                self.substitute_counts[key] = self.substitute_counts.get(key, 0) + 1
+
+        self.schedules = {name: BusySchedule(items) for name, items in intervals.items()}
+
+    def with_events(self, events: Iterable) -> 'AvailabilityIndex':
+        """
+        加入額外事件後的新索引（例如超出預先展開時間窗、即時展開的重複事件；與既有區間重疊時合併）
+
+        只重建有額外事件的講師，其他講師與代課次數沿用原索引
+        """
+        extra = {}
+        for event in events:
+            instructor = event.get('instructor')
+            start, end = event_span(event)
+            if start is None or not instructor or instructor == UNKNOWN_INSTRUCTOR:
+                continue
+            extra.setdefault(instructor, []).append((start, end if end is not None else start))
+
+        extended = AvailabilityIndex.__new__(AvailabilityIndex)
+        extended.substitute_counts = self.substitute_counts
+        extended.schedules = dict(self.schedules)
+        for name, items in extra.items():
+            schedule = self.schedules.get(name)
+            if schedule is not None:
+                items.extend(zip(schedule.starts, schedule.ends))
+            extended.schedules[name] = BusySchedule(items)
+        return extended
+
+    def free_slots(self, start: int, end: int, instructors: Optional[List[str]] = None,
+                   day_start: int = BUSINESS_START, day_end: int = BUSINESS_END) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        營業時間內的空檔
+
+        Args:
+            start, end: 查詢範圍（秒數）
+            instructors: 指定講師（None 表示全部）
+            day_start, day_end: 每天營業時間（自午夜起算的秒數）
+        """
+        windows = business_windows(start, end, day_start, day_end)
+        names = self.schedules if instructors is None else [name for name in instructors if name in self.schedules]
+        return {name: [slot for window in windows for slot in self.schedules[name].free(*window)]
+                for name in names}
+
+    def candidates(self, start: int, end: int, exclude: Optional[str] = None) -> List[Dict]:
+        """
+        [start, end) 時段的代課候選講師排序
+
+        排序依據：衝突時間少者優先、當天已排課時間少者優先、
+        曾替 exclude 代課次數多者優先、與前後課程間隔較寬裕者優先
+        """
+        day = start - start % SECONDS_PER_DAY
+        ranked = []
+        for name, schedule in self.schedules.items():
+            if exclude and name.upper() == exclude.upper():
+                continue
+            conflict = schedule.busy_seconds(start, end)
+            load = schedule.busy_seconds(day, day + SECONDS_PER_DAY)
+            before, after = schedule.gaps(start, end)
+            margin = min(gap for gap in (before, after, SECONDS_PER_DAY) if gap is not None)
+            substitutes = self.substitute_counts.get((name, exclude.upper()), 0) if exclude else 0
+            ranked.append({
+                'instructor': name,
+                'available': conflict == 0,
+                'conflict_minutes': conflict // 60,
+                'day_load_minutes': load // 60,
+                'substitute_count': substitutes,
+                'gap_before_minutes': before // 60 if before is not None else None,
+                'gap_after_minutes': after // 60 if after is not None else None,
+                '_sort': (conflict, load, -substitutes, -margin, name)
+            })
+        ranked.sort(key=lambda item: item['_sort'])
+        for item in ranked:
+            del item['_sort']
+        return ranked
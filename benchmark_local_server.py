@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地伺服器效能基準測試
+以合成資料量測 local_server 後端各階段的吞吐量
+
+使用方式:
+    python3 benchmark_local_server.py            # 執行全部測試
+    python3 benchmark_local_server.py ical       # 只執行指定項目
+
+startup 項目設有冷啟動時間目標，超過目標時以非零狀態碼結束，可作為自動化檢查
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from event_index import EPOCH
+from event_snapshot import EventSnapshot
+from event_store import EventRecord
+from snapshot_file import SnapshotFileWriter
+from ical_parser import get_timezone, parse_calendar, parse_ical_datetime, to_display_time
+from response_cache import ENCODINGS, compress, decompress
+from title_parser import InstructorMatcher, parse_course_title
+
+INSTRUCTORS = [
+    "TIM", "ALICE", "BOB", "YOKI", "XIAN", "TED", "GILLIAN",
+    "BELLA", "JAMES", "HANSEN", "DANIEL", "EASON", "AGNES", "IVAN", "Dirty"
+]
+COURSE_TYPES = ["SPIKE", "ESM", "SPM", "BOOST"]
+LOCATIONS = ["樂程坊 Funlearnbar", "松山", "信義", "台北", "新北"]
+WEEKDAY_NAMES = ['一', '二', '三', '四', '五', '六', '日']
+
+
+def generate_synthetic_calendar(num_events, seed=42, tzid=None):
+    """生成含 num_events 個 VEVENT 的合成 iCal（描述欄位為折疊行）"""
+    rng = random.Random(seed)
+    base_date = datetime(2025, 9, 1)
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//FLB//Benchmark//ZH']
+
+    for i in range(num_events):
+        instructor = rng.choice(INSTRUCTORS)
+        course_type = rng.choice(COURSE_TYPES)
+        location = rng.choice(LOCATIONS)
+        start = base_date + timedelta(days=rng.randint(0, 365), hours=rng.randint(8, 17), minutes=rng.choice([0, 30]))
+        end = start + timedelta(hours=1, minutes=30)
+        weekday = WEEKDAY_NAMES[start.weekday()]
+        dt_param = f';TZID={tzid}' if tzid else ''
+
+        lines.extend([
+            'BEGIN:VEVENT',
+            f'UID:bench-{i}@funlearnbar',
+            f'DTSTAMP:{start:%Y%m%dT%H%M%S}Z',
+            f'DTSTART{dt_param}:{start:%Y%m%dT%H%M%S}',
+            f'DTEND{dt_param}:{end:%Y%m%dT%H%M%S}',
+            f'SUMMARY:{course_type} {weekday} {start:%H:%M}-{end:%H:%M} {location} 第{rng.randint(1, 4)}週',
+            f'DESCRIPTION:{instructor} 助教:無 教案:{course_type}教案:範例課程\\n請提前十分鐘到教室準備教',
+            ' 具與點名表',
+            f'LOCATION:{location}',
+            'END:VEVENT'
+        ])
+
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+# ---------------------------------------------------------------------------
+# 舊版解析器（改版前 local_server.py 的實作，僅供比較）
+# ---------------------------------------------------------------------------
+
+def legacy_parse_ical_datetime(dt_str):
+    """舊版 parse_ical_datetime：切除時區後依序嘗試多種格式"""
+    try:
+        if not dt_str:
+            return None
+        if 'T' in dt_str:
+            dt_str = dt_str.split('T')[0] + 'T' + dt_str.split('T')[1].split('Z')[0]
+        formats = ['%Y%m%dT%H%M%S', '%Y%m%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+        for fmt in formats:
+            try:
+                return datetime.strptime(dt_str, fmt)
+            except ValueError:
+                continue
+        return None
+    except Exception:
+        return None
+
+
+def legacy_parse_ical_content(ical_content):
+    """舊版 parse_ical_content（不含講師比對）"""
+    events = []
+    lines = ical_content.split('\n')
+    current_event = {}
+    in_event = False
+
+    for line in lines:
+        line = line.strip()
+        if line == 'BEGIN:VEVENT':
+            in_event = True
+            current_event = {}
+        elif line == 'END:VEVENT':
+            if in_event and current_event:
+                start_time = legacy_parse_ical_datetime(current_event.get('DTSTART', ''))
+                end_time = legacy_parse_ical_datetime(current_event.get('DTEND', ''))
+                if start_time and end_time:
+                    events.append({
+                        'title': current_event.get('SUMMARY', '無標題'),
+                        'start': start_time,
+                        'end': end_time,
+                        'location': current_event.get('LOCATION', '樂程坊 Funlearnbar'),
+                        'description': current_event.get('DESCRIPTION', '')
+                    })
+            in_event = False
+            current_event = {}
+        elif in_event and ':' in line:
+            key, value = line.split(':', 1)
+            current_event[key] = value
+
+    return events
+
+
+def _best_of(func, repeat):
+    """執行多次取最短時間"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_ical(sizes=(1000, 10000, 100000)):
+    """iCal 解析吞吐量（events/sec）：新版 parse_calendar 與舊版解析器比較"""
+    print("📊 iCal 解析吞吐量")
+    print(f"{'事件數':>8} | {'舊版 ev/s':>12} | {'新版 ev/s':>12} | {'加速':>6}")
+    print("-" * 50)
+
+    for size in sizes:
+        ical = generate_synthetic_calendar(size)
+        repeat = 3 if size <= 10000 else 1
+        legacy_time, legacy_events = _best_of(lambda: legacy_parse_ical_content(ical), repeat)
+        new_time, new_events = _best_of(lambda: parse_calendar(ical), repeat)
+        assert len(new_events) == size
+        assert len(legacy_events) == size
+        print(f"{size:>8} | {size / legacy_time:>12,.0f} | {size / new_time:>12,.0f} | {legacy_time / new_time:>5.2f}x")
+
+    # 正確性：TZID 參數與折疊行
+    ical = generate_synthetic_calendar(1000, tzid='Asia/Taipei')
+    legacy_events = legacy_parse_ical_content(ical)
+    new_events = parse_calendar(ical)
+    folded = sum(1 for event in new_events if event.description.endswith('教具與點名表'))
+    print(f"\n✅ TZID 事件: 舊版解析出 {len(legacy_events)} 個，新版解析出 {len(new_events)} 個")
+    print(f"✅ 折疊行還原: {folded}/{len(new_events)} 個描述完整")
+
+
+def bench_datetime(count=200000):
+    """DTSTART / DTEND 解析（ns/次）：新版 parse_ical_datetime 與舊版比較"""
+    print("📊 iCal 日期時間解析")
+    rng = random.Random(7)
+    base_date = datetime(2025, 9, 1)
+    # 每週重複的課程：少數開始時間在整個學期中重複出現
+    slots = [base_date + timedelta(days=rng.randint(0, 6), hours=rng.randint(8, 17), minutes=rng.choice([0, 30]))
+             for _ in range(40)]
+    repeated = [(rng.choice(slots) + timedelta(weeks=rng.randint(0, 17))).strftime('%Y%m%dT%H%M%S')
+                for _ in range(count)]
+    unique = [(base_date + timedelta(minutes=i)).strftime('%Y%m%dT%H%M%S') for i in range(count)]
+    taipei = get_timezone('Asia/Taipei')
+
+    # 不重複值每次都無法命中快取，量測的是快取外的解析速度
+    cases = [
+        ('重複值（浮動時間）', repeated, None),
+        ('重複值（TZID）', repeated, taipei),
+        ('不重複值', unique, None),
+    ]
+    print(f"{'情境':<12} | {'舊版 ns':>9} | {'新版 ns':>9} | {'加速':>6}")
+    print("-" * 48)
+    for label, values, tz in cases:
+        legacy_time, _ = _best_of(lambda: [legacy_parse_ical_datetime(value) for value in values], 3)
+        new_time, _ = _best_of(lambda: [parse_ical_datetime(value, tz) for value in values], 1)
+        print(f"{label:<12} | {legacy_time / count * 1e9:>9,.0f} | {new_time / count * 1e9:>9,.0f} | "
+              f"{legacy_time / new_time:>5.2f}x")
+
+    # 正確性：UTC 與 TZID 不再被捨棄
+    print(f"\n✅ 20250901T010000Z → 舊版 {legacy_parse_ical_datetime('20250901T010000Z')}，"
+          f"新版 {to_display_time(parse_ical_datetime('20250901T010000Z'))}（台灣時間）")
+
+
+def _legacy_event_dict(ical_event, instructor):
+    """改版前的事件字典格式（時間為附加 .000 的 ISO 字串）"""
+    event = {
+        'uid': ical_event.uid,
+        'title': ical_event.summary,
+        'instructor': instructor,
+        'start': to_display_time(ical_event.start).isoformat() + '.000',
+        'end': to_display_time(ical_event.end).isoformat() + '.000',
+        'location': ical_event.location,
+        'description': ical_event.description,
+        'recurring': False
+    }
+    event.update(parse_course_title(ical_event.summary))
+    return event
+
+
+def _compact_event_record(ical_event, instructor):
+    """精簡事件紀錄"""
+    return EventRecord(
+        ical_event.uid, ical_event.summary, instructor,
+        int((to_display_time(ical_event.start) - EPOCH).total_seconds()),
+        int((to_display_time(ical_event.end) - EPOCH).total_seconds()),
+        ical_event.location, ical_event.description, False, parse_course_title(ical_event.summary)
+    )
+
+
+def _traced_size(build):
+    """建立物件時新配置的記憶體（bytes），物件保留到量測結束"""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def bench_memory(sizes=(10000, 100000)):
+    """事件儲存的記憶體用量：事件字典與精簡事件紀錄比較（換算為每 1 萬個事件）"""
+    print("📊 事件儲存記憶體用量")
+    print(f"{'事件數':>8} | {'字典 KiB/萬筆':>13} | {'精簡 KiB/萬筆':>13} | {'節省 KiB/萬筆':>13} | {'節省':>6}")
+    print("-" * 68)
+
+    matcher = InstructorMatcher(tuple(INSTRUCTORS))
+    for size in sizes:
+        ical_events = parse_calendar(generate_synthetic_calendar(size))
+        instructors = [matcher.match(event.summary, event.description) for event in ical_events]
+
+        # 先建立標題快取，兩種格式量測時都直接取用
+        for event in ical_events:
+            parse_course_title(event.summary)
+        legacy_size, legacy = _traced_size(
+            lambda: [_legacy_event_dict(event, name) for event, name in zip(ical_events, instructors)])
+        compact_size, compact = _traced_size(
+            lambda: [_compact_event_record(event, name) for event, name in zip(ical_events, instructors)])
+        assert [record.to_dict() for record in compact[:100]] == legacy[:100]
+
+        scale = 10000 / size
+        legacy_kib = legacy_size * scale / 1024
+        compact_kib = compact_size * scale / 1024
+        print(f"{size:>8} | {legacy_kib:>13,.0f} | {compact_kib:>13,.0f} | {legacy_kib - compact_kib:>13,.0f} | "
+              f"{1 - compact_size / legacy_size:>6.1%}")
+
+
+def bench_compression(sizes=(100, 1000, 10000)):
+    """事件列表回應的壓縮率與壓縮 CPU 時間（快取命中時直接回傳已壓縮內容，不再付出此成本）"""
+    print("📊 事件回應壓縮")
+    print(f"{'事件數':>8} | {'原始 KiB':>9} | {'編碼':>5} | {'壓縮後 KiB':>10} | {'壓縮率':>6} | {'壓縮 ms':>8} | {'解壓 ms':>8}")
+    print("-" * 78)
+
+    matcher = InstructorMatcher(tuple(INSTRUCTORS))
+    for size in sizes:
+        records = [_compact_event_record(event, matcher.match(event.summary, event.description))
+                   for event in parse_calendar(generate_synthetic_calendar(size))]
+        payload = {'success': True, 'data': [record.to_dict() for record in records], 'total': size}
+        body = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+        for encoding in ENCODINGS:
+            repeat = 5 if size <= 1000 else 1
+            compress_time, data = _best_of(lambda: compress(body, encoding), repeat)
+            decompress_time, restored = _best_of(lambda: decompress(data, encoding), repeat)
+            assert restored == body
+            print(f"{size:>8} | {len(body) / 1024:>9,.1f} | {encoding:>5} | {len(data) / 1024:>10,.1f} | "
+                  f"{len(data) / len(body):>6.1%} | {compress_time * 1000:>8,.1f} | {decompress_time * 1000:>8,.2f}")
+
+
+# 冷啟動目標：匯入 local_server 到第一個請求回應完成（不含背景 CalDAV 同步）
+COLD_START_TARGET_SECONDS = 2.0
+
+# 在新的 Python 程序中量測，避免已匯入的模組影響結果
+# （結果寫到 stderr，背景同步的訊息寫到 stdout，兩者不會交錯）
+_STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import local_server
+imported = time.perf_counter()
+response = local_server.app.test_client().get('/api/health')
+responded = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'first_response': responded - started,
+    'status': response.status_code,
+    'readiness': response.get_json()['readiness'],
+}), file=sys.stderr)
+"""
+
+
+def bench_startup(runs=3):
+    """冷啟動時間：匯入伺服器模組並回應第一個請求（第一次同步在背景進行，不應等待 CalDAV）"""
+    print("📊 冷啟動時間")
+    print(f"{'次數':>4} | {'匯入 ms':>9} | {'第一個回應 ms':>13} | {'狀態碼':>6} | {'readiness':>9}")
+    print("-" * 54)
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    # 不使用本機儲存，量測沒有任何已保存資料時的啟動時間
+    env = dict(os.environ, CALDAV_STORE_PATH='')
+    slowest = 0.0
+    for run in range(1, runs + 1):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], cwd=directory, env=env,
+                                capture_output=True, text=True, check=True).stderr
+        result = json.loads(output.strip().splitlines()[-1])
+        slowest = max(slowest, result['first_response'])
+        print(f"{run:>4} | {result['import'] * 1000:>9,.0f} | {result['first_response'] * 1000:>13,.0f} | "
+              f"{result['status']:>6} | {result['readiness']:>9}")
+
+    passed = slowest <= COLD_START_TARGET_SECONDS
+    print(f"{'✅' if passed else '❌'} 最慢 {slowest:.2f} 秒（目標 {COLD_START_TARGET_SECONDS:.1f} 秒）")
+    return passed
+
+
+# 寫入合成事件到本機儲存（與伺服器使用相同的日曆來源識別，重新啟動時才會載入）
+_SEED_SCRIPT = """
+import sys, time
+import local_server
+from benchmark_local_server import INSTRUCTORS, _compact_event_record, generate_synthetic_calendar
+from ical_parser import parse_calendar
+from title_parser import InstructorMatcher
+size = int(sys.argv[1])
+matcher = InstructorMatcher(tuple(INSTRUCTORS))
+records = [_compact_event_record(event, matcher.match(event.summary, event.description))
+           for event in parse_calendar(generate_synthetic_calendar(size))]
+started = time.perf_counter()
+local_server.open_persistent_store().save(
+    [(f'/caldav/bench/{i}.ics', f'"{i}"', record.uid, [record], None) for i, record in enumerate(records)],
+    [], None, local_server.caldav_engine.default_collection_url)
+print(time.perf_counter() - started, file=sys.stderr)
+"""
+
+# 重新啟動到第一個回應（含載入本機儲存）；同時量測不使用儲存時重新解析相同資料所需的時間
+_RESTART_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import local_server
+imported = time.perf_counter()
+response = local_server.app.test_client().get('/api/events?limit=50')
+responded = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'first_response': responded - started,
+    'total': response.get_json()['total'],
+    'readiness': local_server.current_snapshot.readiness,
+}), file=sys.stderr)
+"""
+
+
+def bench_restart(size=50000, runs=3):
+    """重新啟動時間：本機儲存有 size 個事件時，從啟動到第一個回應（含完整事件資料）"""
+    print(f"📊 重新啟動時間（本機儲存 {size:,} 個事件）")
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, CALDAV_STORE_PATH=os.path.join(tmp, 'caldav_store.sqlite3'))
+        seed = subprocess.run([sys.executable, '-c', _SEED_SCRIPT, str(size)], cwd=directory, env=env,
+                              capture_output=True, text=True, check=True).stderr
+        size_kib = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)) / 1024
+        print(f"寫入儲存: {float(seed.strip().splitlines()[-1]) * 1000:,.0f} ms，檔案 {size_kib:,.0f} KiB")
+
+        print(f"{'次數':>4} | {'匯入 ms':>9} | {'第一個回應 ms':>13} | {'事件數':>8} | {'readiness':>9}")
+        print("-" * 56)
+        for run in range(1, runs + 1):
+            output = subprocess.run([sys.executable, '-c', _RESTART_SCRIPT], cwd=directory, env=env,
+                                    capture_output=True, text=True, check=True).stderr
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{run:>4} | {result['import'] * 1000:>9,.0f} | {result['first_response'] * 1000:>13,.0f} | "
+                  f"{result['total']:>8,} | {result['readiness']:>9}")
+
+    # 沒有本機儲存時，即使 CalDAV 立即回應，也需要重新解析全部事件並建立索引
+    matcher = InstructorMatcher(tuple(INSTRUCTORS))
+    calendar = generate_synthetic_calendar(size)
+    parse_time, records = _best_of(lambda: [_compact_event_record(event, matcher.match(event.summary, event.description))
+                                            for event in parse_calendar(calendar)], 1)
+    build_time, _ = _best_of(lambda: EventSnapshot.build(1, records, [], 'caldav', 'ready'), 1)
+    print(f"對照：重新解析 {size:,} 個事件 {parse_time * 1000:,.0f} ms + 建立索引 {build_time * 1000:,.0f} ms（不含下載）")
+
+
+# 載入共用快照並執行幾個查詢後，回報行程新增的匿名記憶體（heap；mmap 的檔案頁面由頁面快取共用，不計入）
+_WORKER_SCRIPT = """
+import json, sys, time
+def memory_kib():
+    with open('/proc/self/smaps_rollup') as f:
+        fields = {name: int(value.split()[0]) for name, value in (line.split(':', 1) for line in list(f)[1:])}
+    return fields['Anonymous'], fields['Rss']
+import local_server
+from event_snapshot import EventSnapshot
+from snapshot_file import MappedEvents, MappedSnapshotFile
+anonymous, _ = memory_kib()
+started = time.perf_counter()
+if sys.argv[1] == 'worker':
+    local_server.create_app('worker')
+    snapshot = local_server.current_snapshot
+else:
+    # 對照：每個行程各自保存全部事件與索引（與每個行程各自同步或載入本機儲存相同）
+    mapped = MappedSnapshotFile(local_server.SERVER_CONFIG['snapshot_file'])
+    snapshot = EventSnapshot.build(mapped.data_version, list(MappedEvents(mapped)), mapped.meta['teachers'],
+                                   mapped.meta['data_source'], mapped.meta['readiness'])
+    del mapped
+loaded = time.perf_counter()
+index = snapshot.index
+dumps = local_server.app.json.dumps
+dumps(index.events[:50])
+dumps(index.instructor_events('TIM')[:50])
+dumps(index.facets.select(index.events, index.facets.search({'instructor': ['TIM']})[0])[:50])
+snapshot.columns.report()
+queried = time.perf_counter()
+after, rss = memory_kib()
+print(json.dumps({'load': loaded - started, 'query': queried - loaded, 'anonymous_kib': after - anonymous,
+                  'rss_kib': rss, 'events': len(snapshot.events)}), file=sys.stderr)
+"""
+
+
+def bench_workers(size=50000, workers=4):
+    """多個 worker 行程同時載入 size 個事件：共用快照檔（mmap）與各自保存事件的記憶體比較"""
+    print(f"📊 多行程記憶體（{size:,} 個事件，{workers} 個行程）")
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print("⚠️ 需要 /proc/self/smaps_rollup（Linux），略過")
+        return None
+
+    matcher = InstructorMatcher(tuple(INSTRUCTORS))
+    records = [_compact_event_record(event, matcher.match(event.summary, event.description))
+               for event in parse_calendar(generate_synthetic_calendar(size))]
+    snapshot = EventSnapshot.build(1, records, [{'name': name} for name in INSTRUCTORS], 'caldav', 'ready')
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'event_snapshot.bin')
+        writer = SnapshotFileWriter(path)
+        writer.write(snapshot)
+        file_mib = writer.bytes / 1024 / 1024
+        print(f"寫入快照檔: {writer.duration * 1000:,.0f} ms，{file_mib:,.1f} MiB")
+
+        env = dict(os.environ, CALDAV_STORE_PATH='', SNAPSHOT_FILE=path)
+        print(f"{'模式':>8} | {'行程':>4} | {'載入 ms':>8} | {'查詢 ms':>8} | {'heap MiB':>9} | {'RSS MiB':>8}")
+        print("-" * 60)
+        for mode in ('copy', 'worker'):
+            processes = [subprocess.Popen([sys.executable, '-c', _WORKER_SCRIPT, mode], cwd=directory, env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                         for _ in range(workers)]
+            heap = 0.0
+            for number, process in enumerate(processes, 1):
+                output = process.communicate()[1]
+                if process.returncode:
+                    raise RuntimeError(output)
+                result = json.loads(output.strip().splitlines()[-1])
+                assert result['events'] == size
+                heap += result['anonymous_kib'] / 1024
+                print(f"{mode:>8} | {number:>4} | {result['load'] * 1000:>8,.0f} | {result['query'] * 1000:>8,.0f} | "
+                      f"{result['anonymous_kib'] / 1024:>9,.1f} | {result['rss_kib'] / 1024:>8,.1f}")
+            # 共用快照檔的頁面只在頁面快取中保存一份
+            total = heap + file_mib if mode == 'worker' else heap
+            print(f"{mode:>8} 合計: {total:,.1f} MiB" + ("（含共用快照檔）" if mode == 'worker' else ''))
+
+
+BENCHMARKS = {
+    'ical': bench_ical,
+    'datetime': bench_datetime,
+    'memory': bench_memory,
+    'compression': bench_compression,
+    'startup': bench_startup,
+    'restart': bench_restart,
+    'workers': bench_workers,
+}
+
+
+def main():
+    """主函數"""
+    names = sys.argv[1:] or list(BENCHMARKS)
+    failed = []
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ 未知的測試項目: {name}（可用: {', '.join(BENCHMARKS)}）")
+            sys.exit(1)
+        if BENCHMARKS[name]() is False:
+            failed.append(name)
+        print()
+    if failed:
+        print(f"❌ 未達目標: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalDAV 日曆探索與多日曆並行同步
+依 RFC 6764 / RFC 4791 的探索流程：current-user-principal → calendar-home-set → 列出家目錄下的日曆，
+探索結果依 TTL 快取；每個日曆各有一個增量同步引擎，以有上限的執行緒池並行同步，
+所有請求共用同一個 keep-alive 連線池（requests.Session），再合併成單一事件集合
+"""
+
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+
+from caldav_sync import (CalDAVError, CalDAVSyncEngine, NAMESPACES, SyncResult, _parse_status, create_session,
+                         window_bounds)
+
+PRINCIPAL_PROPFIND_BODY = '''<?xml version="1.0" encoding="utf-8"?>
+<D:propfind xmlns:D="DAV:">
+    <D:prop>
+        <D:current-user-principal/>
+    </D:prop>
+</D:propfind>'''
+
+HOME_SET_PROPFIND_BODY = '''<?xml version="1.0" encoding="utf-8"?>
+<D:propfind xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+    <D:prop>
+        <C:calendar-home-set/>
+    </D:prop>
+</D:propfind>'''
+
+CALENDARS_PROPFIND_BODY = '''<?xml version="1.0" encoding="utf-8"?>
+<D:propfind xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+    <D:prop>
+        <D:resourcetype/>
+        <D:displayname/>
+        <C:supported-calendar-component-set/>
+    </D:prop>
+</D:propfind>'''
+
+# 伺服器不支援探索（或帳號沒有權限）時改用設定的日曆路徑
+DISCOVERY_FALLBACK_STATUSES = (400, 403, 404, 405, 501)
+
+
+class CalendarInfo:
+    """探索到的日曆集合"""
+
+    __slots__ = ('url', 'name')
+
+    def __init__(self, url: str, name: str = ''):
+        self.url = url
+        self.name = name
+
+    def to_dict(self) -> Dict:
+        return {'url': self.url, 'name': self.name}
+
+
+def _propstat_props(response_elem: ET.Element) -> List[ET.Element]:
+    """<D:response> 中狀態為 200 的 <D:prop> 元素"""
+    return [propstat.find('D:prop', NAMESPACES)
+            for propstat in response_elem.findall('D:propstat', NAMESPACES)
+            if _parse_status(propstat.findtext('D:status', '', NAMESPACES)) == 200
+            and propstat.find('D:prop', NAMESPACES) is not None]
+
+
+def _is_event_calendar(prop: ET.Element) -> bool:
+    """集合是否為可存放 VEVENT 的日曆（未提供 supported-calendar-component-set 時視為可以）"""
+    if prop.find('D:resourcetype/C:calendar', NAMESPACES) is None:
+        return False
+    components = prop.find('C:supported-calendar-component-set', NAMESPACES)
+    if components is None:
+        return True
+    return any(comp.get('name', '').upper() == 'VEVENT' for comp in components.findall('C:comp', NAMESPACES))
+
+
+class CalendarDiscovery:
+    """
+    探索帳號的所有事件日曆
+
+    結果快取 ttl 秒；伺服器不支援探索時使用設定的日曆路徑，
+    網路錯誤時沿用上次的結果（沒有結果時拋出例外）
+    """
+
+    def __init__(self, session: requests.Session, config: Dict, ttl: float = 3600, timeout: int = 30):
+        """
+        Args:
+            session: 共用的 requests.Session
+            config: CALDAV_CONFIG 設定（url、calendar_path）
+            ttl: 探索結果的快取秒數
+            timeout: 請求超時時間（秒）
+        """
+        self.session = session
+        self.config = config
+        self.ttl = ttl
+        self.timeout = timeout
+        self.discovered_at = None
+        self.method = None
+        self.discoveries = 0
+        self._calendars = None
+        self._lock = threading.Lock()
+
+    @property
+    def default_url(self) -> str:
+        """設定的日曆集合 URL（url + calendar_path）"""
+        return f"{self.config['url']}{self.config.get('calendar_path') or ''}"
+
+    def calendars(self, force: bool = False) -> List[CalendarInfo]:
+        """
+        取得日曆列表（快取未過期時不發送請求）
+
+        Args:
+            force: 忽略快取重新探索
+
+        Raises:
+            CalDAVError / requests.RequestException: 從未探索成功且請求失敗
+        """
+        with self._lock:
+            if (not force and self._calendars is not None
+                    and time.monotonic() - self.discovered_at < self.ttl):
+                return self._calendars
+            try:
+                calendars, self.method = self._discover()
+            except (CalDAVError, requests.RequestException, ET.ParseError) as e:
+                if self._calendars is None:
+                    raise
+                print(f"⚠️ 日曆探索失敗，沿用上次的 {len(self._calendars)} 個日曆: {str(e)}")
+                # 下次同步再重試，不等到 TTL 到期
+                return self._calendars
+            self._calendars = calendars
+            self.discovered_at = time.monotonic()
+            self.discoveries += 1
+            return calendars
+
+    def _discover(self) -> Tuple[List[CalendarInfo], str]:
+        """依序查詢 principal、calendar-home-set 與日曆列表，回傳 (日曆列表, 探索方式)"""
+        try:
+            principal = self._find_href(self.config['url'], PRINCIPAL_PROPFIND_BODY, 'D:current-user-principal')
+            home = principal and self._find_href(principal, HOME_SET_PROPFIND_BODY, 'C:calendar-home-set')
+            if not home:
+                return [CalendarInfo(self.default_url)], 'configured'
+
+            calendars = []
+            for href, props in self._propfind(home, CALENDARS_PROPFIND_BODY, '1'):
+                for prop in props:
+                    if _is_event_calendar(prop):
+                        calendars.append(CalendarInfo(urljoin(home, href),
+                                                      (prop.findtext('D:displayname', '', NAMESPACES) or '').strip()))
+                        break
+        except CalDAVError as e:
+            if e.status_code not in DISCOVERY_FALLBACK_STATUSES:
+                raise
+            print(f"⚠️ 伺服器不支援日曆探索 ({e.status_code})，使用設定的日曆路徑")
+            return [CalendarInfo(self.default_url)], 'configured'
+
+        if not calendars:
+            return [CalendarInfo(self.default_url)], 'configured'
+        calendars.sort(key=lambda calendar: calendar.url)
+        return calendars, 'discovered'
+
+    def _find_href(self, url: str, body: str, path: str) -> Optional[str]:
+        """PROPFIND Depth 0 取得指向其他資源的屬性（例如 principal），回傳完整 URL"""
+        for _, props in self._propfind(url, body, '0'):
+            for prop in props:
+                href = prop.findtext(f'{path}/D:href', None, NAMESPACES)
+                if href and href.strip():
+                    return urljoin(url, href.strip())
+        return None
+
+    def _propfind(self, url: str, body: str, depth: str) -> List[Tuple[str, List[ET.Element]]]:
+        """發送 PROPFIND 並解析回應（探索的回應很小，整份解析）"""
+        response = self.session.request('PROPFIND', url, data=body.encode('utf-8'),
+                                        headers={'Depth': depth}, timeout=self.timeout)
+        CalDAVSyncEngine._check_status(response)
+        root = ET.fromstring(response.content)
+        return [(response_elem.findtext('D:href', '', NAMESPACES).strip(), _propstat_props(response_elem))
+                for response_elem in root.findall('D:response', NAMESPACES)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            calendars = self._calendars
+            discovered_at = self.discovered_at
+        return {
+            'ttl_seconds': self.ttl,
+            'method': self.method,
+            'discoveries': self.discoveries,
+            'age_seconds': round(time.monotonic() - discovered_at, 1) if discovered_at is not None else None,
+            'calendars': [calendar.to_dict() for calendar in calendars] if calendars is not None else None
+        }
+
+
+class MultiCalendarSync:
+    """
+    多個日曆的增量同步
+
+    提供與 CalDAVSyncEngine 相同的介面（sync、restore、iter_events、window_bounds、store、source），
+    每個日曆各有一個同步引擎，共用同一個 Session、本機儲存與設定；
+    discover_calendars 為 False 時只同步設定的日曆路徑
+    """
+
+    def __init__(self, config: Dict, parse_ical: Callable[[str], List[Dict]], store=None):
+        """
+        Args:
+            config: CALDAV_CONFIG 設定（另含選用的 discover_calendars、discovery_ttl_seconds、max_concurrent_fetches）
+            parse_ical: 將 iCal 文字解析成事件列表的函數
+            store: 本機儲存（PersistentStore，None 表示不保存）
+        """
+        self.config = config
+        self.parse_ical = parse_ical
+        self.discover = config.get('discover_calendars', False)
+        self.max_workers = max(1, config.get('max_concurrent_fetches', 4))
+        self.fetch_mode = config.get('fetch_mode', 'sync')
+        self.window_past_days = config.get('window_past_days', 7)
+        self.window_future_days = config.get('window_future_days', 60)
+        self.summary_filter = config.get('summary_filter')
+        self.engines = {}  # 日曆 URL -> CalDAVSyncEngine
+        self.last_failures = {}  # 日曆 URL -> 最近一次同步的錯誤訊息
+        self.version = 0  # 任一日曆的資料變更時遞增（包含同步失敗前已套用的部分變更）
+        self._store = store
+        self._session = create_session(config, pool_size=self.max_workers)
+        self.discovery = CalendarDiscovery(self._session, config, config.get('discovery_ttl_seconds', 3600))
+        self._lock = threading.Lock()
+        # 只保護 engines 的增刪與複製（sync() 持有 _lock 的時間很長，stats() 等讀取不等待同步完成）
+        self._engines_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session
+
+    @session.setter
+    def session(self, session: requests.Session):
+        """替換共用的 Session（同時套用到探索與所有日曆的同步引擎）"""
+        self._session = session
+        self.discovery.session = session
+        for engine in self._engine_list():
+            engine.session = session
+
+    @property
+    def store(self):
+        return self._store
+
+    @store.setter
+    def store(self, store):
+        self._store = store
+        for engine in self._engine_list():
+            engine.store = store
+
+    @property
+    def default_collection_url(self) -> str:
+        """設定的日曆集合 URL（不探索或伺服器不支援探索時同步的日曆）"""
+        return self.discovery.default_url
+
+    @property
+    def source(self) -> str:
+        """日曆來源識別字串（帳號、探索方式或日曆路徑、同步範圍變更時，本機儲存的資料不可沿用）"""
+        collections = 'discover' if self.discover else self.default_collection_url
+        return (f"{self.config['url']}|{self.config['username']}|{collections}|"
+                f"{self.fetch_mode}|{self.summary_filter or ''}")
+
+    def window_bounds(self, now=None):
+        """目前時間窗的起訖（本地時間，含時區）"""
+        return window_bounds(self.window_past_days, self.window_future_days, now)
+
+    def _engine(self, url: str) -> CalDAVSyncEngine:
+        with self._engines_lock:
+            engine = self.engines.get(url)
+            if engine is None:
+                engine = self.engines[url] = CalDAVSyncEngine(self.config, self.parse_ical, store=self._store,
+                                                              session=self._session, collection_url=url)
+            return engine
+
+    def _engine_list(self) -> List[CalDAVSyncEngine]:
+        """目前所有日曆的同步引擎（依日曆 URL 排序的複本，同步期間增刪日曆不影響走訪）"""
+        with self._engines_lock:
+            return [self.engines[url] for url in sorted(self.engines)]
+
+    def restore(self) -> int:
+        """
+        從本機儲存載入所有日曆上次同步的資源（不連線 CalDAV）
+
+        Returns:
+            載入的資源數量
+        """
+        if self._store is None:
+            return 0
+        with self._lock:
+            urls = self._store.collections() if self.discover else [self.default_collection_url]
+            count = sum(self._engine(url).restore() for url in urls)
+            if count:
+                self.version += 1
+            return count
+
+    def iter_events(self) -> Iterator[Dict]:
+        """逐一產出所有日曆目前儲存的事件（依日曆 URL 排序，順序固定）"""
+        return chain.from_iterable(engine.iter_events() for engine in self._engine_list())
+
+    def events(self) -> List[Dict]:
+        return list(self.iter_events())
+
+    def sync(self) -> SyncResult:
+        """
+        探索日曆後並行同步所有日曆並合併統計
+
+        部分日曆失敗時保留該日曆先前的資料並回傳其他日曆的結果；失敗的日曆在中斷前已套用的部分變更
+        （engine.partial）也計入結果。全部失敗時拋出第一個錯誤，已套用的部分變更仍會使 version 遞增
+
+        Raises:
+            CalDAVError: 探索失敗或所有日曆都同步失敗
+        """
+        with self._lock:
+            if self.discover:
+                urls = [calendar.url for calendar in self.discovery.calendars()]
+            else:
+                urls = [self.default_collection_url]
+
+            # 已不存在的日曆：移除資源與本機儲存中的資料
+            dropped = 0
+            for url in set(self.engines) - set(urls):
+                with self._engines_lock:
+                    engine = self.engines.pop(url)
+                dropped += len(engine.resources)
+                if self._store is not None:
+                    self._store.drop_collection(url)
+                print(f"🗑️ 日曆已移除: {url}")
+            engines = [self._engine(url) for url in urls]
+            versions = [engine.version for engine in engines]
+
+            if len(engines) == 1:
+                outcomes = [self._sync_one(engines[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(engines)),
+                                        thread_name_prefix='caldav-fetch') as pool:
+                    outcomes = list(pool.map(self._sync_one, engines))
+
+            if dropped or any(engine.version != version for engine, version in zip(engines, versions)):
+                self.version += 1
+
+            results = [result for result, _ in outcomes if result is not None]
+            errors = [error for _, error in outcomes if error is not None]
+            self.last_failures = {engine.collection_url: str(error)
+                                  for engine, (_, error) in zip(engines, outcomes) if error is not None}
+            if not results:
+                raise errors[0]
+            partials = [engine.partial for engine, (_, error) in zip(engines, outcomes)
+                        if error is not None and engine.partial is not None]
+            if errors:
+                print(f"⚠️ {len(errors)}/{len(engines)} 個日曆同步失敗，沿用這些日曆先前的資料"
+                      + (f"（{len(partials)} 個日曆已套用部分變更）" if partials else ""))
+
+            return SyncResult(
+                '+'.join(sorted({result.mode for result in results})),
+                sum(result.listed for result in results),
+                sum(result.changed for result in results + partials),
+                sum(result.removed for result in results + partials) + dropped,
+                all(result.full for result in results),
+                calendars=len(engines),
+                failed=len(errors)
+            )
+
+    @staticmethod
+    def _sync_one(engine: CalDAVSyncEngine) -> Tuple[Optional[SyncResult], Optional[Exception]]:
+        try:
+            return engine.sync(), None
+        except Exception as e:
+            return None, e
+
+    def stats(self) -> Dict:
+        return {
+            'discover_calendars': self.discover,
+            'max_concurrent_fetches': self.max_workers,
+            'discovery': self.discovery.stats() if self.discover else None,
+            'calendars': {engine.collection_url: len(engine.resources) for engine in self._engine_list()},
+            'failures': dict(self.last_failures)
+        }
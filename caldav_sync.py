@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalDAV 增量同步引擎
+使用 RFC 6578 sync-collection REPORT 取得變更清單，
+不支援時改用只含 ETag 的 PROPFIND 比對，再以 calendar-multiget 只下載有變更的事件；
+時間窗模式則以 calendar-query time-range 只列出行事曆需要顯示的事件
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+from xml.sax.saxutils import escape
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+NAMESPACES = {
+    'D': 'DAV:',
+    'C': 'urn:ietf:params:xml:ns:caldav'
+}
+
+RESPONSE_TAG = '{DAV:}response'
+SYNC_TOKEN_TAG = '{DAV:}sync-token'
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+SYNC_COLLECTION_BODY = '''<?xml version="1.0" encoding="utf-8"?>
+<D:sync-collection xmlns:D="DAV:">
+    <D:sync-token>{token}</D:sync-token>
+    <D:sync-level>1</D:sync-level>
+    <D:prop>
+        <D:getetag/>
+    </D:prop>
+</D:sync-collection>'''
+
+ETAG_PROPFIND_BODY = '''<?xml version="1.0" encoding="utf-8"?>
+<D:propfind xmlns:D="DAV:">
+    <D:prop>
+        <D:getetag/>
+        <D:resourcetype/>
+    </D:prop>
+</D:propfind>'''
+
+CALENDAR_QUERY_BODY = '''<?xml version="1.0" encoding="utf-8"?>
+<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+    <D:prop>
+        <D:getetag/>
+    </D:prop>
+    <C:filter>
+        <C:comp-filter name="VCALENDAR">
+            <C:comp-filter name="VEVENT">
+                <C:time-range start="{start}" end="{end}"/>{summary_filter}
+            </C:comp-filter>
+        </C:comp-filter>
+    </C:filter>
+</C:calendar-query>'''
+
+SUMMARY_FILTER = '''
+                <C:prop-filter name="SUMMARY">
+                    <C:text-match>{text}</C:text-match>
+                </C:prop-filter>'''
+
+MULTIGET_BODY = '''<?xml version="1.0" encoding="utf-8"?>
+<C:calendar-multiget xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+    <D:prop>
+        <D:getetag/>
+        <C:calendar-data/>
+    </D:prop>
+{hrefs}
+</C:calendar-multiget>'''
+
+
+class CalDAVError(Exception):
+    """CalDAV 請求失敗"""
+
+    def __init__(self, status_code: int, message: str, body: str = ''):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class CalendarResource:
+    """單一 CalDAV 資源（一個 .ics 檔）及其解析後的事件"""
+
+    __slots__ = ('href', 'etag', 'uid', 'events')
+
+    def __init__(self, href: str, etag: str, uid: str, events: List[Dict]):
+        self.href = href
+        self.etag = etag
+        self.uid = uid
+        self.events = events
+
+
+class SyncResult:
+    """一次同步的統計結果（多個日曆時為合併後的結果）"""
+
+    __slots__ = ('mode', 'listed', 'changed', 'removed', 'full', 'calendars', 'failed')
+
+    def __init__(self, mode: str, listed: int = 0, changed: int = 0, removed: int = 0, full: bool = False,
+                 calendars: int = 1, failed: int = 0):
+        self.mode = mode
+        self.listed = listed
+        self.changed = changed
+        self.removed = removed
+        self.full = full
+        self.calendars = calendars
+        self.failed = failed
+
+    def to_dict(self) -> Dict:
+        return {
+            'mode': self.mode,
+            'listed': self.listed,
+            'changed': self.changed,
+            'removed': self.removed,
+            'full': self.full,
+            'calendars': self.calendars,
+            'failed': self.failed
+        }
+
+
+class MultistatusStream:
+    """
+    串流解析 207 Multi-Status 回應
+
+    以 XMLPullParser 逐塊餵入回應內容，每個 <D:response> 結束時立即產出並清除，
+    記憶體用量只與單一 response 大小有關，與整份回應大小無關
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = chunks
+        self.sync_token = None
+
+    def __iter__(self) -> Iterator[Tuple[str, int, Dict]]:
+        """逐一產出 (href, 狀態碼, {'etag': ..., 'calendar_data': ...})"""
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        self._root = None
+
+        for chunk in self.chunks:
+            if chunk:
+                parser.feed(chunk)
+                yield from self._drain(parser)
+
+        parser.close()
+        yield from self._drain(parser)
+
+    def _drain(self, parser: ET.XMLPullParser) -> Iterator[Tuple[str, int, Dict]]:
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = elem
+                continue
+
+            if elem.tag == RESPONSE_TAG:
+                item = _parse_response_elem(elem)
+                elem.clear()
+                self._root.clear()
+                if item is not None:
+                    yield item
+            elif elem.tag == SYNC_TOKEN_TAG and elem.text:
+                self.sync_token = elem.text.strip()
+
+
+def parse_multistatus(content: bytes) -> Tuple[List[Tuple[str, int, Dict]], Optional[str]]:
+    """
+    解析完整的 207 Multi-Status 回應內容
+
+    Returns:
+        ([(href, 狀態碼, {'etag': ..., 'calendar_data': ...}), ...], sync_token)
+    """
+    stream = MultistatusStream([content])
+    items = list(stream)
+    return items, stream.sync_token
+
+
+def _parse_response_elem(response_elem: ET.Element) -> Optional[Tuple[str, int, Dict]]:
+    """解析單一 <D:response> 元素"""
+    href_elem = response_elem.find('D:href', NAMESPACES)
+    if href_elem is None or not href_elem.text:
+        return None
+
+    status = _parse_status(response_elem.findtext('D:status', '', NAMESPACES))
+    props = {}
+
+    for propstat in response_elem.findall('D:propstat', NAMESPACES):
+        prop_status = _parse_status(propstat.findtext('D:status', '', NAMESPACES))
+        if prop_status != 200:
+            continue
+        prop = propstat.find('D:prop', NAMESPACES)
+        if prop is None:
+            continue
+        etag = prop.findtext('D:getetag', None, NAMESPACES)
+        if etag:
+            props['etag'] = etag
+        calendar_data = prop.findtext('C:calendar-data', None, NAMESPACES)
+        if calendar_data:
+            props['calendar_data'] = calendar_data
+        if prop.find('D:resourcetype/D:collection', NAMESPACES) is not None:
+            props['collection'] = True
+
+    return href_elem.text.strip(), status or 200, props
+
+
+def format_utc(dt: datetime) -> str:
+    """轉換為 CalDAV time-range 使用的 UTC 格式（YYYYMMDDTHHMMSSZ）"""
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return dt.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def window_bounds(past_days: int, future_days: int, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """時間窗的起訖（本地時間，含時區）：今天往前 past_days 天到往後 future_days 天（含當天）"""
+    now = (now or datetime.now()).astimezone()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=past_days), today + timedelta(days=future_days + 1)
+
+
+def create_session(config: Dict, pool_size: int = 10) -> requests.Session:
+    """
+    建立 CalDAV 請求共用的 Session（HTTP Basic 認證、keep-alive 連線池）
+
+    Args:
+        config: CALDAV_CONFIG 設定（username、password）
+        pool_size: 每個主機保留的連線數（並行請求數）
+    """
+    session = requests.Session()
+    session.auth = HTTPBasicAuth(config['username'], config['password'])
+    session.headers.update({'Content-Type': 'application/xml; charset=utf-8'})
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _item_uid(item) -> str:
+    """取得事件物件（dict）或重複事件系列的 UID"""
+    if isinstance(item, dict):
+        return item.get('uid', '')
+    return getattr(item, 'uid', '')
+
+
+def _parse_status(status_line: str) -> int:
+    """從 'HTTP/1.1 200 OK' 取出狀態碼"""
+    parts = status_line.split()
+    if len(parts) >= 2 and parts[1].isdigit():
+        return int(parts[1])
+    return 0
+
+
+class CalDAVSyncEngine:
+    """
+    CalDAV 增量同步引擎
+
+    以 href 為鍵保存 (ETag, UID, 解析後事件)，每次同步只下載並解析有變更的資源；
+    指定 store 時每次同步的變更與 sync-token 寫入本機儲存，重新啟動後以 restore() 載入
+
+    fetch_mode:
+        'sync'   - sync-collection REPORT（不支援時改用 ETag PROPFIND），同步整個日曆
+        'window' - calendar-query time-range REPORT，只同步 window_past_days ~ window_future_days 內的事件
+    """
+
+    def __init__(self, config: Dict, parse_ical: Callable[[str], List[Dict]],
+                 timeout: int = 30, multiget_batch_size: int = 200, store=None,
+                 session: Optional[requests.Session] = None, collection_url: Optional[str] = None):
+        """
+        初始化同步引擎
+
+        Args:
+            config: CALDAV_CONFIG 設定（url、username、password、calendar_path，
+                    以及選用的 fetch_mode、window_past_days、window_future_days、summary_filter）
+            parse_ical: 將 iCal 文字解析成事件列表的函數（列表中可包含重複事件系列物件）
+            timeout: 請求超時時間（秒）
+            multiget_batch_size: 每次 calendar-multiget 請求的 href 數量上限
+            store: 本機儲存（PersistentStore，None 表示不保存）
+            session: 共用的 requests.Session（None 表示建立新的 Session）
+            collection_url: 日曆集合的完整 URL（None 表示使用 url + calendar_path）
+        """
+        self.config = config
+        self.parse_ical = parse_ical
+        self.timeout = timeout
+        self.multiget_batch_size = multiget_batch_size
+        self._collection_url = collection_url
+
+        self.session = session if session is not None else create_session(config)
+
+        self.resources = {}  # href -> CalendarResource
+        self.uid_index = {}  # uid -> href
+        self.sync_token = None
+        self.supports_sync_collection = True
+        self.fetch_mode = config.get('fetch_mode', 'sync')
+        self.window_past_days = config.get('window_past_days', 7)
+        self.window_future_days = config.get('window_future_days', 60)
+        self.summary_filter = config.get('summary_filter')
+        self.version = 0
+        self.partial = None  # 最近一次同步中斷前已套用並保存的變更（SyncResult），同步完成或沒有變更時為 None
+        self.store = store
+        self._lock = threading.Lock()
+
+    @property
+    def collection_url(self) -> str:
+        """日曆集合的完整 URL"""
+        if self._collection_url:
+            return self._collection_url
+        if self.config.get('calendar_path'):
+            return f"{self.config['url']}{self.config['calendar_path']}"
+        return self.config['url']
+
+    def window_bounds(self, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+        """目前時間窗的起訖（本地時間，含時區）"""
+        return window_bounds(self.window_past_days, self.window_future_days, now)
+
+    @property
+    def source(self) -> str:
+        """日曆來源識別字串（來源或同步範圍變更時，本機儲存的資料不可沿用）"""
+        return f"{self.collection_url}|{self.fetch_mode}|{self.summary_filter or ''}"
+
+    def restore(self) -> int:
+        """
+        從本機儲存載入上次同步的資源與 sync-token（之後的 sync() 只處理變更）
+
+        Returns:
+            載入的資源數量
+        """
+        if self.store is None:
+            return 0
+        resources, sync_token = self.store.load(self.parse_ical, self.collection_url)
+        with self._lock:
+            for href, (etag, uid, events) in resources.items():
+                self.resources[href] = CalendarResource(href, etag, uid, events)
+                self.uid_index[uid] = href
+            self.sync_token = sync_token
+            if resources:
+                self.version += 1
+        return len(resources)
+
+    def get(self, uid: str) -> Optional[Tuple[str, List[Dict]]]:
+        """依 UID 取得 (ETag, 事件列表)"""
+        href = self.uid_index.get(uid)
+        if href is None:
+            return None
+        resource = self.resources[href]
+        return resource.etag, resource.events
+
+    def iter_events(self) -> Iterator[Dict]:
+        """逐一產出目前儲存的所有事件（不重新解析）"""
+        for resource in self.resources.values():
+            yield from resource.events
+
+    def events(self) -> List[Dict]:
+        """目前儲存的所有事件（不重新解析）"""
+        return list(self.iter_events())
+
+    def sync(self) -> SyncResult:
+        """
+        執行一次同步
+
+        Returns:
+            SyncResult 同步統計
+
+        Raises:
+            CalDAVError: CalDAV 伺服器回應錯誤
+        """
+        with self._lock:
+            listing = None
+            previous_token = token = self.sync_token
+
+            if self.fetch_mode == 'window':
+                mode = 'calendar-query'
+                current, removed, full = self._calendar_query_etags(*self.window_bounds()), None, True
+            else:
+                if self.supports_sync_collection:
+                    listing = self._sync_collection()
+
+                if listing is None:
+                    mode = 'propfind'
+                    current, removed, full = self._propfind_etags(), None, True
+                else:
+                    mode = 'sync-collection'
+                    current, removed, full, token = listing
+
+            if full:
+                removed = set(self.resources) - set(current)
+
+            changed = [href for href, etag in current.items()
+                       if href not in self.resources or self.resources[href].etag != etag]
+
+            for href in removed:
+                self._remove(href)
+
+            # 每個 <D:response> 解析完立即存入，不保留整份回應
+            self.partial = None
+            fetched = 0
+            stored = []
+            try:
+                for href, etag, events, calendar_data in self.iter_multiget(changed):
+                    resource = self._store(href, etag, events)
+                    fetched += 1
+                    if self.store is not None:
+                        stored.append((href, etag, resource.uid, events, calendar_data))
+            except BaseException:
+                # 下載中斷：保留已處理的變更，但不前進 sync-token，下次同步重新列出尚未下載的資源
+                if fetched or removed:
+                    self.version += 1
+                    self.partial = SyncResult(mode, len(current), fetched, len(removed), full)
+                    if self.store is not None:
+                        self.store.save(stored, removed, previous_token, self.collection_url)
+                raise
+
+            # 所有變更都已下載後才前進 sync-token
+            self.sync_token = token
+            if changed or removed:
+                self.version += 1
+            if self.store is not None and (stored or removed or self.sync_token != previous_token):
+                self.store.save(stored, removed, self.sync_token, self.collection_url)
+
+            return SyncResult(mode, len(current), fetched, len(removed), full)
+
+    def _request(self, method: str, url: str, body: str, depth: str) -> requests.Response:
+        """發送 WebDAV 請求（串流模式，回應內容需由呼叫端逐塊讀取）"""
+        return self.session.request(
+            method,
+            url,
+            data=body.encode('utf-8'),
+            headers={'Depth': depth},
+            timeout=self.timeout,
+            stream=True
+        )
+
+    def _stream(self, method: str, body: str, depth: str) -> Iterator[Tuple[str, int, Dict]]:
+        """發送請求並串流解析 Multi-Status 回應"""
+        with self._request(method, self.collection_url, body, depth) as response:
+            self._check_status(response)
+            yield from MultistatusStream(response.iter_content(STREAM_CHUNK_SIZE))
+
+    def _sync_collection(self) -> Optional[Tuple[Dict[str, str], set, bool, Optional[str]]]:
+        """
+        以 sync-collection REPORT 取得自上次 sync-token 以來的變更
+
+        不修改 self.sync_token：新的 token 由 sync() 在所有變更都下載完成後才保存
+
+        Returns:
+            ({href: etag}, 已刪除 href 集合, 是否為完整列表, 新的 sync-token)；伺服器不支援時回傳 None
+        """
+        current = {}
+        removed = set()
+        full = self.sync_token is None
+        token = self.sync_token or ''
+
+        # 伺服器可能分批回傳（507），持續以新 token 取得剩餘變更
+        for _ in range(20):
+            body = SYNC_COLLECTION_BODY.format(token=escape(token))
+            with self._request('REPORT', self.collection_url, body, '0') as response:
+                if response.status_code in (403, 409) and token and b'valid-sync-token' in response.content:
+                    # sync-token 已失效，重新進行完整同步
+                    print("⚠️ sync-token 已失效，重新進行完整同步")
+                    token = ''
+                    current.clear()
+                    removed.clear()
+                    full = True
+                    continue
+
+                if response.status_code in (400, 403, 405, 415, 501) and not token:
+                    print(f"⚠️ 伺服器不支援 sync-collection ({response.status_code})，改用 ETag PROPFIND")
+                    self.supports_sync_collection = False
+                    return None
+
+                self._check_status(response)
+                stream = MultistatusStream(response.iter_content(STREAM_CHUNK_SIZE))
+
+                truncated = False
+                for href, status, props in stream:
+                    if self._is_collection_href(href):
+                        truncated = truncated or status == 507
+                        continue
+                    if status == 404:
+                        removed.add(href)
+                        current.pop(href, None)
+                    elif props.get('etag'):
+                        current[href] = props['etag']
+                        removed.discard(href)
+
+            if stream.sync_token:
+                token = stream.sync_token
+            if not truncated:
+                break
+
+        return current, removed, full, token or None
+
+    def _propfind_etags(self) -> Dict[str, str]:
+        """以只含 ETag 的 PROPFIND 取得所有資源"""
+        return {
+            href: props['etag']
+            for href, status, props in self._stream('PROPFIND', ETAG_PROPFIND_BODY, '1')
+            if status == 200 and props.get('etag') and not props.get('collection')
+            and not self._is_collection_href(href)
+        }
+
+    def _calendar_query_etags(self, start: datetime, end: datetime) -> Dict[str, str]:
+        """以 calendar-query time-range 列出時間窗內事件的 ETag"""
+        summary_filter = ''
+        if self.summary_filter:
+            summary_filter = SUMMARY_FILTER.format(text=escape(self.summary_filter))
+
+        body = CALENDAR_QUERY_BODY.format(
+            start=format_utc(start),
+            end=format_utc(end),
+            summary_filter=summary_filter
+        )
+        return {
+            href: props['etag']
+            for href, status, props in self._stream('REPORT', body, '1')
+            if status == 200 and props.get('etag') and not self._is_collection_href(href)
+        }
+
+    def iter_multiget(self, hrefs: List[str]) -> Iterator[Tuple[str, str, List[Dict], str]]:
+        """
+        以 calendar-multiget 下載指定資源，邊接收邊解析
+
+        Yields:
+            (href, etag, 解析後事件列表, 原始 iCal 內容)
+        """
+        for i in range(0, len(hrefs), self.multiget_batch_size):
+            batch = hrefs[i:i + self.multiget_batch_size]
+            body = MULTIGET_BODY.format(
+                hrefs='\n'.join(f'    <D:href>{escape(href)}</D:href>' for href in batch)
+            )
+            for href, status, props in self._stream('REPORT', body, '1'):
+                if status == 200 and props.get('calendar_data'):
+                    yield href, props.get('etag', ''), self.parse_ical(props['calendar_data']), props['calendar_data']
+
+    def _store(self, href: str, etag: str, events: List[Dict]) -> CalendarResource:
+        """保存單一資源的解析結果"""
+        uid = next((_item_uid(event) for event in events if _item_uid(event)), href)
+
+        previous = self.resources.get(href)
+        if previous is not None and previous.uid != uid:
+            self.uid_index.pop(previous.uid, None)
+
+        resource = self.resources[href] = CalendarResource(href, etag, uid, events)
+        self.uid_index[uid] = href
+        return resource
+
+    def _remove(self, href: str) -> None:
+        """移除已刪除的資源"""
+        resource = self.resources.pop(href, None)
+        if resource is not None and self.uid_index.get(resource.uid) == href:
+            del self.uid_index[resource.uid]
+
+    def _is_collection_href(self, href: str) -> bool:
+        """判斷 href 是否為日曆集合本身"""
+        collection_path = urlsplit(self.collection_url).path
+        return href.endswith('/') or urlsplit(urljoin(self.collection_url, href)).path == collection_path
+
+    @staticmethod
+    def _check_status(response: requests.Response) -> None:
+        """非 207 回應時拋出 CalDAVError"""
+        if response.status_code == 207:
+            return
+        if response.status_code == 401:
+            raise CalDAVError(401, 'CalDAV 認證失敗 (401)', response.text)
+        if response.status_code == 404:
+            raise CalDAVError(404, 'CalDAV 日曆路徑不存在 (404)', response.text)
+        raise CalDAVError(response.status_code, f'CalDAV 請求失敗: {response.status_code}', response.text)
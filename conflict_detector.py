@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+排課衝突偵測
+同一講師或同一上課地點的事件時間重疊即為衝突，每個分組以掃描線演算法找出所有重疊的事件對
+"""
+
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from event_index import event_keys, event_span
+from title_parser import UNKNOWN_INSTRUCTOR
+
+CONFLICT_TYPES = ('instructor', 'location')
+
+
+def event_buckets(event: Dict) -> Tuple:
+    """事件所屬的分組：(講師)、(上課地點；標題無法解析時使用 location 欄位)"""
+    buckets = []
+    instructor = event.get('instructor')
+    if instructor and instructor != UNKNOWN_INSTRUCTOR:
+        buckets.append(('instructor', instructor))
+    location = event.get('course_location') or event.get('location')
+    if location:
+        buckets.append(('location', location))
+    return tuple(buckets)
+
+
+def sweep_overlaps(intervals: List[Tuple[int, int, Tuple]]) -> List[Tuple[int, int, Tuple, Tuple]]:
+    """
+    掃描線找出所有重疊的區間對，O(n log n + k)
+
+    Args:
+        intervals: [(開始秒數, 結束秒數, 鍵)]，長度為零的區間不列入
+
+    Returns:
+        [(重疊開始, 重疊結束, 先開始的鍵, 後開始的鍵)]
+    """
+    overlaps = []
+    active = []
+    for start, end, key in sorted(item for item in intervals if item[1] > item[0]):
+        # 已結束的事件移出（結束時間等於開始時間視為相接，不算重疊）
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for active_end, active_key in active:
+            overlaps.append((start, min(active_end, end), active_key, key))
+        heapq.heappush(active, (end, key))
+    return overlaps
+
+
+class ConflictDetector:
+    """
+    依講師與上課地點分組的衝突偵測器
+
+    以 update() 傳入目前完整的事件列表，依事件鍵比對差異，
+    只重新掃描有事件新增、移除或時間變更的分組
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._events = {}
+        self._buckets = {}
+        self._conflicts = {}
+        self._lock = threading.Lock()
+
+    def copy(self) -> 'ConflictDetector':
+        """複製偵測器（衝突列表不會就地修改，共用；之後對副本 update() 不影響原偵測器）"""
+        with self._lock:
+            detector = ConflictDetector()
+            detector._entries = self._entries
+            detector._events = dict(self._events)
+            detector._buckets = {bucket: set(keys) for bucket, keys in self._buckets.items()}
+            detector._conflicts = dict(self._conflicts)
+            return detector
+
+    def update(self, events: List[Dict]) -> Dict[str, int]:
+        """
+        同步事件列表並重新計算受影響分組的衝突
+
+        Returns:
+            {'buckets': 分組數, 'recomputed': 重新掃描的分組數, 'conflicts': 衝突數}
+        """
+        with self._lock:
+            current = {}
+            for key, event in zip(event_keys(events), events):
+                start, end = event_span(event)
+                if start is None:
+                    continue
+                current[key] = (start, end if end is not None else start, event_buckets(event))
+                self._events[key] = event
+
+            dirty = set()
+            for key, entry in current.items():
+                previous = self._entries.get(key)
+                if previous != entry:
+                    if previous is not None:
+                        dirty.update(previous[2])
+                    dirty.update(entry[2])
+            for key in [key for key in self._entries if key not in current]:
+                dirty.update(self._entries[key][2])
+                del self._events[key]
+
+            for key, entry in current.items():
+                previous = self._entries.get(key)
+                if previous is not None and previous[2] != entry[2]:
+                    for bucket in previous[2]:
+                        self._buckets[bucket].discard(key)
+                for bucket in entry[2]:
+                    self._buckets.setdefault(bucket, set()).add(key)
+            for key in [key for key in self._entries if key not in current]:
+                for bucket in self._entries[key][2]:
+                    self._buckets[bucket].discard(key)
+            self._entries = current
+
+            for bucket in dirty:
+                keys = self._buckets.get(bucket)
+                if not keys:
+                    self._buckets.pop(bucket, None)
+                    self._conflicts.pop(bucket, None)
+                    continue
+                overlaps = sweep_overlaps([current[key][:2] + (key,) for key in keys])
+                if overlaps:
+                    self._conflicts[bucket] = overlaps
+                else:
+                    self._conflicts.pop(bucket, None)
+
+            return {
+                'buckets': len(self._buckets),
+                'recomputed': len(dirty),
+                'conflicts': sum(len(overlaps) for overlaps in self._conflicts.values())
+            }
+
+    def conflicts(self, start: Optional[int] = None, end: Optional[int] = None,
+                  conflict_type: Optional[str] = None) -> List[Dict]:
+        """
+        與 [start, end) 重疊的衝突（依重疊開始時間排序）
+
+        Args:
+            start: 起點秒數（None 表示不限）
+            end: 終點秒數（None 表示不限）
+            conflict_type: 'instructor' 或 'location'（None 表示全部）
+
+        Returns:
+            [{'type', 'name', 'overlap_start', 'overlap_end', 'events'}]
+        """
+        with self._lock:
+            found = []
+            for (kind, name), overlaps in self._conflicts.items():
+                if conflict_type and kind != conflict_type:
+                    continue
+                for overlap_start, overlap_end, first, second in overlaps:
+                    if start is not None and overlap_end <= start:
+                        continue
+                    if end is not None and overlap_start >= end:
+                        continue
+                    found.append((overlap_start, kind, name, overlap_end, first, second))
+
+            found.sort(key=lambda item: item[:3])
+            return [{
+                'type': kind,
+                'name': name,
+                'overlap_start': overlap_start,
+                'overlap_end': overlap_end,
+                'events': [self._events[first], self._events[second]]
+            } for overlap_start, kind, name, overlap_end, first, second in found]
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件索引
+事件集合變更時整體重建，建立後不再修改，可在多執行緒下直接讀取
+"""
+
+import base64
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from facet_index import FacetIndex, span_mask
+
+EPOCH = datetime(1970, 1, 1)
+SECONDS_PER_DAY = 86400
+
+
+def parse_event_time(value: str) -> Optional[int]:
+    """
+    將事件時間字串轉換為秒數（台灣時間，自 1970-01-01 起算）
+
+    支援 '2025-01-01'、'2025-01-01T09:00'、'2025-01-01T09:00:00.000' 等 ISO 格式，格式錯誤時回傳 None
+    """
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip()[:19])
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        return None
+    return int((dt - EPOCH).total_seconds())
+
+
+def event_span(event) -> Tuple[Optional[int], Optional[int]]:
+    """事件的開始與結束秒數（EventRecord 直接取整數時間，字典則解析時間字串）"""
+    start = getattr(event, 'start_ts', None)
+    if start is not None:
+        return start, event.end_ts
+    return parse_event_time(event.get('start')), parse_event_time(event.get('end'))
+
+
+def event_keys(events: List[Dict]) -> List[Tuple]:
+    """
+    事件鍵（uid、開始時間、標題），用於比對前後兩次事件集合的差異
+
+    相同鍵重複出現時（例如沒有 uid 的模擬事件）以序號區分
+    """
+    seen = {}
+    keys = []
+    for event in events:
+        base = (event.get('uid') or '', event.get('start'), event.get('title'))
+        count = seen.get(base, 0)
+        seen[base] = count + 1
+        keys.append(base + (count,))
+    return keys
+
+
+def encode_cursor(start: int, skip: int) -> str:
+    """
+    分頁游標：下一頁第一個事件的開始秒數，以及同一開始時間中已回傳的事件數
+
+    以開始時間而非列表位置定位，其他時間的事件新增或刪除時游標仍然有效
+    """
+    return base64.urlsafe_b64encode(f'{start}.{skip}'.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[int, int]]:
+    """解析分頁游標，格式錯誤時回傳 None"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        start, skip = text.split('.')
+        start, skip = int(start), int(skip)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return (start, skip) if skip >= 0 else None
+
+
+def paginate(events: List, limit: int, cursor: Optional[Tuple[int, int]] = None,
+             starts: Optional[List[int]] = None) -> Tuple[List, Optional[str]]:
+    """
+    依開始時間排序的事件列表分頁
+
+    Args:
+        events: 依開始時間排序的事件
+        limit: 每頁筆數
+        cursor: decode_cursor() 的結果（None 表示第一頁）
+        starts: 事件的開始秒數（EventIndex.starts；未提供時由事件計算）
+
+    Returns:
+        (本頁事件, 下一頁游標；沒有下一頁時為 None)
+    """
+    if starts is None:
+        starts = [event_span(event)[0] for event in events]
+    position = 0
+    if cursor is not None:
+        start, skip = cursor
+        position = bisect_left(starts, start)
+        # 同一開始時間的事件數變少時，從下一個開始時間繼續
+        position = min(position + skip, bisect_right(starts, start))
+
+    end = position + limit
+    page = events[position:end]
+    if end >= len(events):
+        return page, None
+    next_start = starts[end]
+    return page, encode_cursor(next_start, end - bisect_left(starts, next_start))
+
+
+def day_key(seconds: int) -> str:
+    """秒數轉換為日期鍵（YYYY-MM-DD）"""
+    return _day_label(seconds // SECONDS_PER_DAY)
+
+
+@lru_cache(maxsize=4096)
+def _day_label(day: int) -> str:
+    # 事件集中在少數日期，建立索引時大量重複轉換同一天
+    return (EPOCH + timedelta(days=day)).strftime('%Y-%m-%d')
+
+
+class EventIndex:
+    """
+    事件索引
+
+    區間索引：starts 為排序後的開始時間，max_ends[i] 為前 i+1 個事件結束時間的最大值（非遞減），
+    查詢 [start, end) 時以二分搜尋找出候選範圍，成本為 O(log n + k)
+
+    雜湊索引：by_instructor、by_day、by_instructor_day 在建立時一次完成，
+    各列表內的事件依開始時間排序，查詢成本為 O(k)
+
+    分面索引：facets 以 events 的位置為位元序號，可與 range_mask 的時間範圍位元圖直接交集
+    """
+
+    def __init__(self, events: List[Dict]):
+        entries = []
+        for event in events:
+            start, end = event_span(event)
+            if start is None:
+                continue
+            entries.append((start, end if end is not None and end >= start else start, event))
+        entries.sort(key=lambda entry: entry[0])
+
+        self.events = [entry[2] for entry in entries]
+        self.starts = [entry[0] for entry in entries]
+        self.ends = [entry[1] for entry in entries]
+
+        self.max_ends = []
+        running = None
+        for end in self.ends:
+            running = end if running is None or end > running else running
+            self.max_ends.append(running)
+
+        self.by_instructor = {}
+        self.by_day = {}
+        self.by_instructor_day = {}
+        for start, end, event in entries:
+            instructor = event.get('instructor', 'UNKNOWN')
+            self.by_instructor.setdefault(instructor, []).append(event)
+            for day in self._days(start, end):
+                self.by_day.setdefault(day, []).append(event)
+                self.by_instructor_day.setdefault((instructor, day), []).append(event)
+
+        self.facets = FacetIndex(self.events)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def instructor_events(self, instructor: str) -> List[Dict]:
+        """講師的所有事件"""
+        return self.by_instructor.get(instructor, [])
+
+    def day_events(self, day: str, instructor: Optional[str] = None) -> List[Dict]:
+        """某一天（YYYY-MM-DD）的事件，可指定講師"""
+        if instructor is None:
+            return self.by_day.get(day, [])
+        return self.by_instructor_day.get((instructor, day), [])
+
+    def days_events(self, days: List[str], instructor: Optional[str] = None) -> List[Dict]:
+        """多天的事件（跨日事件只出現一次）"""
+        events = []
+        seen = set()
+        for day in days:
+            for event in self.day_events(day, instructor):
+                if id(event) not in seen:
+                    seen.add(id(event))
+                    events.append(event)
+        return events
+
+    def column(self, field: str) -> List:
+        """所有事件的某個欄位值（與 events 順序相同）"""
+        return [event.get(field) for event in self.events]
+
+    def instructor_counts(self) -> Dict[str, int]:
+        """各講師的事件數"""
+        return {instructor: len(events) for instructor, events in self.by_instructor.items()}
+
+    @staticmethod
+    def _days(start: int, end: int) -> List[str]:
+        """事件涵蓋的日期（結束於午夜的事件不算入隔天）"""
+        first = start // SECONDS_PER_DAY
+        last = max(first, (end - 1) // SECONDS_PER_DAY) if end > start else first
+        return [_day_label(day) for day in range(first, last + 1)]
+
+    def range(self, start: Optional[int] = None, end: Optional[int] = None) -> List[Dict]:
+        """
+        查詢與 [start, end) 重疊的事件（依開始時間排序）
+
+        Args:
+            start: 起點秒數（None 表示不限）
+            end: 終點秒數（None 表示不限）
+        """
+        lo, hi = self.range_bounds(start, end)
+        if start is None:
+            return self.events[lo:hi]
+
+        ends = self.ends
+        events = self.events
+        return [events[i] for i in range(lo, hi) if ends[i] > start or self.starts[i] == start]
+
+    def iter_range(self, start: Optional[int] = None, end: Optional[int] = None) -> Iterator:
+        """逐一產生與 [start, end) 重疊的事件（與 range() 相同，但不建立列表）"""
+        lo, hi = self.range_bounds(start, end)
+        events = self.events
+        if start is None:
+            for i in range(lo, hi):
+                yield events[i]
+            return
+
+        ends = self.ends
+        starts = self.starts
+        for i in range(lo, hi):
+            if ends[i] > start or starts[i] == start:
+                yield events[i]
+
+    def range_bounds(self, start: Optional[int] = None, end: Optional[int] = None):
+        """回傳可能與 [start, end) 重疊的候選位置範圍 [lo, hi)"""
+        hi = len(self.starts) if end is None else bisect_left(self.starts, end)
+        lo = 0 if start is None else bisect_right(self.max_ends, start)
+        # 零長度事件（開始即結束）恰好落在起點時也算在範圍內
+        if start is not None:
+            lo = min(lo, bisect_left(self.starts, start))
+        return lo, max(lo, hi)
+
+    def range_mask(self, start: Optional[int] = None, end: Optional[int] = None) -> int:
+        """與 [start, end) 重疊的事件位元圖（位置與 events 相同）"""
+        lo, hi = self.range_bounds(start, end)
+        if start is None:
+            return span_mask(lo, hi)
+
+        # 開始時間不早於 start 的事件必定重疊，只需逐一檢查更早開始的跨越事件
+        split = min(hi, max(lo, bisect_left(self.starts, start)))
+        mask = span_mask(split, hi)
+        ends = self.ends
+        for i in range(lo, split):
+            if ends[i] > start:
+                mask |= 1 << i
+        return mask
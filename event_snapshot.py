@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件資料快照
+一次同步的事件與所有衍生索引（區間、分面、空檔、統計欄位、全文索引、衝突偵測）組成不可變的快照，
+同步完成後整體替換；請求開始時取得目前的快照，之後只讀取該快照，不需加鎖，
+也不會讀到一半舊、一半新的資料
+"""
+
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from analytics import EventColumns
+from availability import AvailabilityIndex
+from conflict_detector import ConflictDetector
+from event_index import EventIndex
+from fulltext_index import FullTextIndex
+
+# 資料就緒狀態：
+#   warming  - 啟動後第一次同步尚未完成（先以空資料回應，不阻擋啟動）
+#   ready    - 已成功同步 CalDAV 資料
+#   stale    - 最近一次同步失敗，仍使用先前成功同步的資料
+#   degraded - 從未成功同步，使用模擬資料
+READINESS_STATES = ('warming', 'ready', 'stale', 'degraded')
+
+# 只指定 start 或 end 的查詢，未指定的一端視為延伸到預先展開時間窗之外這麼遠（即時展開重複事件的上限）
+OPEN_RANGE_HORIZON_SECONDS = 366 * 86400
+
+
+class SearchIndexes:
+    """
+    快照的全文索引與衝突偵測
+
+    第一次使用時（或由同步執行緒呼叫 build()）建立；以前一版快照已建立的索引複製後增量更新，
+    只重新處理變更的事件，建立後不再修改。只保留一層前一版的參照，不會形成鏈結
+    """
+
+    def __init__(self, events: List, previous: Optional['SearchIndexes'] = None):
+        self._events = events
+        self._base = None
+        if previous is not None:
+            self._base = previous if previous._indexes is not None else previous._base
+        self._indexes = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._indexes is not None
+
+    def build(self) -> Optional[Tuple[Dict[str, int], Dict[str, int]]]:
+        """
+        建立索引（已建立時不重複處理）
+
+        Returns:
+            (全文索引統計, 衝突偵測統計)；已建立時回傳 None
+        """
+        with self._lock:
+            if self._indexes is not None:
+                return None
+            if self._base is not None:
+                fulltext, detector = self._base._indexes
+                fulltext, detector = fulltext.copy(), detector.copy()
+            else:
+                fulltext, detector = FullTextIndex(), ConflictDetector()
+            stats = fulltext.update(self._events), detector.update(self._events)
+            self._indexes = fulltext, detector
+            self._base = None
+            return stats
+
+    @property
+    def fulltext(self) -> FullTextIndex:
+        self.build()
+        return self._indexes[0]
+
+    @property
+    def conflicts(self) -> ConflictDetector:
+        self.build()
+        return self._indexes[1]
+
+
+class EventSnapshot:
+    """
+    不可變的事件資料快照
+
+    Attributes:
+        version: 資料版本（事件集合變更時遞增，狀態變更不遞增）
+        events: 依開始時間排序的事件
+        index / availability / columns: 衍生索引
+        search: 全文索引與衝突偵測（SearchIndexes，第一次使用時建立）
+        teachers: 講師列表
+        data_source: 'caldav'、'mock' 或 'none'（尚未載入）
+        readiness: 就緒狀態（見 READINESS_STATES）
+        series / window: 重複事件系列與預先展開的時間窗（秒）
+        synced_at: 最近一次同步的時間（None 表示尚未同步）
+    """
+
+    __slots__ = ('version', 'events', 'index', 'availability', 'columns', 'search', 'teachers',
+                 'data_source', 'readiness', 'series', 'window', 'synced_at')
+
+    def __init__(self, version: int, index: EventIndex, availability: AvailabilityIndex, columns: EventColumns,
+                 search: SearchIndexes, teachers: Tuple, data_source: str, readiness: str, series: Tuple = (),
+                 window: Tuple[Optional[int], Optional[int]] = (None, None), synced_at: Optional[datetime] = None):
+        for name, value in (('version', version), ('events', index.events), ('index', index),
+                            ('availability', availability), ('columns', columns), ('search', search),
+                            ('teachers', teachers), ('data_source', data_source), ('readiness', readiness),
+                            ('series', series), ('window', window), ('synced_at', synced_at)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('EventSnapshot 為不可變物件，請以 build() 或 with_status() 建立新的快照')
+
+    @classmethod
+    def build(cls, version: int, events: Iterable, teachers: List, data_source: str, readiness: str,
+              series: Iterable = (), window: Tuple[Optional[int], Optional[int]] = (None, None),
+              synced_at: Optional[datetime] = None, previous: Optional['EventSnapshot'] = None) -> 'EventSnapshot':
+        """由事件列表建立快照（建立所有衍生索引；全文索引與衝突偵測以 previous 的索引為基礎增量建立）"""
+        return cls.from_index(version, EventIndex(list(events)), teachers, data_source, readiness,
+                              series, window, synced_at, previous)
+
+    @classmethod
+    def from_index(cls, version: int, index: EventIndex, teachers: List, data_source: str, readiness: str,
+                   series: Iterable = (), window: Tuple[Optional[int], Optional[int]] = (None, None),
+                   synced_at: Optional[datetime] = None, previous: Optional['EventSnapshot'] = None) -> 'EventSnapshot':
+        """由已建立的事件索引建立快照（例如 MappedEventIndex；空檔與統計索引由索引的欄位建立）"""
+        teachers = tuple(teachers)
+        availability = AvailabilityIndex(index, [teacher.get('name') for teacher in teachers])
+        search = SearchIndexes(index.events, previous.search if previous is not None else None)
+        return cls(version, index, availability, EventColumns(index), search, teachers, data_source, readiness,
+                   tuple(series), window, synced_at)
+
+    @classmethod
+    def empty(cls, readiness: str = 'warming') -> 'EventSnapshot':
+        """尚未載入任何資料的快照"""
+        return cls.build(0, [], [], 'none', readiness)
+
+    def with_status(self, readiness: str, synced_at: Optional[datetime] = None) -> 'EventSnapshot':
+        """資料不變、只更新狀態的新快照（共用同一組索引）"""
+        return EventSnapshot(self.version, self.index, self.availability, self.columns, self.search, self.teachers,
+                             self.data_source, readiness, self.series, self.window,
+                             synced_at if synced_at is not None else self.synced_at)
+
+    def expansion_range(self, start: Optional[int], end: Optional[int]) -> Optional[Tuple[int, int]]:
+        """
+        查詢 [start, end) 需要即時展開重複事件的範圍
+
+        start 與 end 都未指定時使用預先展開的時間窗；只指定一端時，另一端延伸到時間窗之外
+        OPEN_RANGE_HORIZON_SECONDS（例如 start 在時間窗之後、未指定 end 時仍會展開重複事件）
+
+        Returns:
+            (start, end) 秒數；None 表示預先展開的時間窗已涵蓋，不需即時展開
+        """
+        window_start, window_end = self.window
+        if not self.series or (start is None and end is None):
+            return None
+        if start is None:
+            start = min(end, window_start if window_start is not None else end) - OPEN_RANGE_HORIZON_SECONDS
+        if end is None:
+            end = max(start, window_end if window_end is not None else start) + OPEN_RANGE_HORIZON_SECONDS
+        if window_start is not None and window_start <= start and end <= window_end:
+            return None
+        return start, end
+
+    def covers(self, start: Optional[int], end: Optional[int]) -> bool:
+        """[start, end) 是否在預先展開的時間窗內（不需即時展開重複事件）"""
+        return self.expansion_range(start, end) is None
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+精簡事件紀錄
+事件以 __slots__ 物件保存，時間為整數秒數（台灣時間，自 1970-01-01 起算），
+講師、地點、課程類型等重複出現的字串共用同一個物件；
+只在輸出 JSON 時才轉換為原本的事件格式
+"""
+
+import sys
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from event_index import EPOCH, parse_event_time
+
+# 輸出 JSON 時的欄位（與原本的事件格式相同）
+EVENT_FIELDS = (
+    'uid', 'title', 'instructor', 'start', 'end', 'location', 'description', 'recurring',
+    'course_type', 'weekday', 'time_range', 'course_location', 'week_number',
+    'substitute_type', 'original_instructor'
+)
+
+# 紀錄的屬性（與 EVENT_FIELDS 相同，但時間為秒數），也是 to_row() / from_row() 的欄位順序
+RECORD_FIELDS = (
+    'uid', 'title', 'instructor', 'start_ts', 'end_ts', 'location', 'description', 'recurring',
+    'course_type', 'weekday', 'time_range', 'course_location', 'week_number',
+    'substitute_type', 'original_instructor'
+)
+
+
+# 直接對應屬性的欄位（start / end 需由秒數轉換）
+_ATTRIBUTE_FIELDS = frozenset(EVENT_FIELDS) - {'start', 'end'}
+
+
+def format_event_time(seconds: int) -> str:
+    """秒數轉換為事件時間字串（例如 2025-09-01T09:00:00.000）"""
+    return (EPOCH + timedelta(seconds=seconds)).isoformat() + '.000'
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class EventRecord:
+    """
+    精簡事件紀錄
+
+    start_ts / end_ts 為整數秒數；get() 與 [] 以原本的欄位名稱取值（start / end 回傳時間字串），
+    各索引可與原本的事件字典一樣使用
+    """
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, uid: Optional[str], title: str, instructor: str, start_ts: int, end_ts: int,
+                 location: str, description: str, recurring: bool = False, facets: Optional[Dict] = None):
+        self.uid = uid
+        self.title = _intern(title)
+        self.instructor = _intern(instructor)
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.location = _intern(location)
+        self.description = description
+        self.recurring = recurring
+
+        facets = facets or {}
+        self.course_type = _intern(facets.get('course_type'))
+        self.weekday = _intern(facets.get('weekday'))
+        self.time_range = _intern(facets.get('time_range'))
+        self.course_location = _intern(facets.get('course_location'))
+        self.week_number = facets.get('week_number')
+        self.substitute_type = _intern(facets.get('substitute_type'))
+        self.original_instructor = _intern(facets.get('original_instructor'))
+
+    @classmethod
+    def from_dict(cls, event: Dict, facets: Optional[Dict] = None) -> Optional['EventRecord']:
+        """由事件字典建立（時間格式錯誤時回傳 None）"""
+        start = parse_event_time(event.get('start'))
+        end = parse_event_time(event.get('end'))
+        if start is None or end is None:
+            return None
+        return cls(event.get('uid'), event.get('title'), event.get('instructor'), start, end,
+                   event.get('location'), event.get('description'), event.get('recurring', False),
+                   facets if facets is not None else event)
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> 'EventRecord':
+        """由 to_row() 的欄位值建立（不重新解析標題）"""
+        record = cls.__new__(cls)
+        (record.uid, title, instructor, record.start_ts, record.end_ts, location, record.description, recurring,
+         course_type, weekday, time_range, course_location, record.week_number,
+         substitute_type, original_instructor) = row
+        # 載入大量紀錄時逐欄判斷比呼叫 _intern() 快（欄位值只會是 str 或 None）
+        intern = sys.intern
+        record.title = intern(title) if title else title
+        record.instructor = intern(instructor) if instructor else instructor
+        record.location = intern(location) if location else location
+        record.recurring = bool(recurring)
+        record.course_type = intern(course_type) if course_type else course_type
+        record.weekday = intern(weekday) if weekday else weekday
+        record.time_range = intern(time_range) if time_range else time_range
+        record.course_location = intern(course_location) if course_location else course_location
+        record.substitute_type = intern(substitute_type) if substitute_type else substitute_type
+        record.original_instructor = intern(original_instructor) if original_instructor else original_instructor
+        return record
+
+    def to_row(self) -> Tuple:
+        """依 RECORD_FIELDS 順序的欄位值（用於儲存）"""
+        return (self.uid, self.title, self.instructor, self.start_ts, self.end_ts, self.location,
+                self.description, self.recurring, self.course_type, self.weekday, self.time_range,
+                self.course_location, self.week_number, self.substitute_type, self.original_instructor)
+
+    def get(self, key: str, default=None):
+        # 建立索引時大量呼叫，最常見的屬性欄位先判斷
+        if key in _ATTRIBUTE_FIELDS:
+            return getattr(self, key)
+        if key == 'start':
+            return format_event_time(self.start_ts)
+        if key == 'end':
+            return format_event_time(self.end_ts)
+        return default
+
+    def __getitem__(self, key: str):
+        if key not in EVENT_FIELDS:
+            raise KeyError(key)
+        return self.get(key)
+
+    def to_dict(self) -> Dict:
+        """轉換為原本的事件格式"""
+        return {
+            'uid': self.uid,
+            'title': self.title,
+            'instructor': self.instructor,
+            'start': format_event_time(self.start_ts),
+            'end': format_event_time(self.end_ts),
+            'location': self.location,
+            'description': self.description,
+            'recurring': self.recurring,
+            'course_type': self.course_type,
+            'weekday': self.weekday,
+            'time_range': self.time_range,
+            'course_location': self.course_location,
+            'week_number': self.week_number,
+            'substitute_type': self.substitute_type,
+            'original_instructor': self.original_instructor
+        }
+
+    def __repr__(self) -> str:
+        return f"EventRecord({self.title!r}, {format_event_time(self.start_ts)})"
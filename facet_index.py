@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件分面索引
+每個分面值對應一個位元圖（Python int，第 i 個位元代表索引中第 i 個事件），
+篩選時同一分面內的值取聯集、不同分面之間取交集，整批以位元運算完成
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+# 分面名稱 -> 事件欄位
+FACET_FIELDS = {
+    'instructor': 'instructor',
+    'course_type': 'course_type',
+    'location': 'course_location',
+    'weekday': 'weekday',
+    'substitute': 'substitute_type',
+    'substitute_type': 'substitute_type',
+}
+
+
+def span_mask(lo: int, hi: int) -> int:
+    """位置 [lo, hi) 全為 1 的位元圖"""
+    if hi <= lo:
+        return 0
+    return ((1 << (hi - lo)) - 1) << lo
+
+
+def popcount(mask: int) -> int:
+    """位元圖中 1 的個數"""
+    return bin(mask).count('1')
+
+
+def iter_positions(mask: int) -> Iterable[int]:
+    """依序列出位元圖中為 1 的位置"""
+    bits = bin(mask)[:1:-1]
+    position = bits.find('1')
+    while position != -1:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+class FacetIndex:
+    """
+    分面位元圖索引
+
+    事件順序必須與建立索引時的列表一致（EventIndex.events），位置即為位元序號
+    """
+
+    def __init__(self, events: List[Dict]):
+        self.size = len(events)
+        self.all = span_mask(0, self.size)
+        self.bitmaps = {facet: {} for facet in FACET_FIELDS}
+
+        # 先收集每個值的位置，再一次組成位元圖（避免對大整數逐位元 OR）；
+        # 每個欄位只讀取一次，多個分面共用同一欄位時不重複取值
+        columns = {}
+        positions = {facet: {} for facet in FACET_FIELDS}
+        for facet, values in positions.items():
+            field = FACET_FIELDS[facet]
+            column = columns.get(field)
+            if column is None:
+                column = columns[field] = [event.get(field) for event in events]
+            if facet == 'substitute':
+                column = ['true' if value else 'false' for value in column]
+            for i, value in enumerate(column):
+                if value is not None:
+                    values.setdefault(value, []).append(i)
+
+        for facet, values in positions.items():
+            bitmaps = self.bitmaps[facet]
+            for value, indexes in values.items():
+                bits = bytearray(b'0' * self.size)
+                for i in indexes:
+                    bits[i] = 49  # ord('1')
+                bitmaps[value] = int(bits[::-1].decode('ascii'), 2)
+
+    @classmethod
+    def from_bitmaps(cls, size: int, bitmaps: Dict[str, Dict[str, int]]) -> 'FacetIndex':
+        """由已建立的位元圖建立（例如由共用快照檔載入）"""
+        index = cls.__new__(cls)
+        index.size = size
+        index.all = span_mask(0, size)
+        index.bitmaps = {facet: dict(bitmaps.get(facet, {})) for facet in FACET_FIELDS}
+        return index
+
+    def value_mask(self, facet: str, values: List[str]) -> int:
+        """分面內多個值的聯集（不分大小寫）"""
+        bitmaps = self.bitmaps[facet]
+        mask = 0
+        for value in values:
+            bitmap = bitmaps.get(value)
+            if bitmap is None:
+                bitmap = next((bm for key, bm in bitmaps.items() if key.upper() == value.upper()), 0)
+            mask |= bitmap
+        return mask
+
+    def search(self, filters: Dict[str, List[str]], base: Optional[int] = None):
+        """
+        依分面篩選
+
+        Args:
+            filters: 分面名稱 -> 可接受的值（同一分面內為 OR，不同分面之間為 AND）
+            base: 預先限定的位元圖（例如時間範圍），None 表示全部事件
+
+        Returns:
+            (結果位元圖, 各分面的值與數量)
+
+            分面數量不套用該分面自身的條件，勾選多個值時其他選項的數量仍然有意義
+        """
+        base = self.all if base is None else base & self.all
+        masks = {facet: self.value_mask(facet, values) for facet, values in filters.items() if values}
+
+        result = base
+        for mask in masks.values():
+            result &= mask
+
+        counts = {}
+        for facet, bitmaps in self.bitmaps.items():
+            scope = base
+            for other, mask in masks.items():
+                if other != facet:
+                    scope &= mask
+            facet_counts = {}
+            for value, bitmap in bitmaps.items():
+                count = popcount(bitmap & scope)
+                if count:
+                    facet_counts[value] = count
+            counts[facet] = facet_counts
+        return result, counts
+
+    @staticmethod
+    def select(events: List[Dict], mask: int) -> List[Dict]:
+        """取出位元圖中的事件（維持原本順序）"""
+        return [events[i] for i in iter_positions(mask)]
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件全文索引
+中文以字元二元組（bigram）切詞、英數以單字切詞，倒排索引保存詞的位置以支援片語查詢，
+事件集合變更時只重新切詞新增或內容有變更的事件
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from event_index import event_keys
+
+# 中日韓統一表意文字（含擴充 A 區與相容區）
+_RUN_RE = re.compile(r'([㐀-䶿一-鿿豈-﫿]+)|([0-9a-z]+)')
+_PHRASE_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+# 欄位之間的位置間隔，片語不會跨欄位比對；位置小於 FIELD_GAP 者屬於標題
+FIELD_GAP = 1 << 16
+INDEXED_FIELDS = ('title', 'description', 'location')
+TITLE_WEIGHT = 2
+
+# BM25 參數
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str, offset: int = 0) -> List[Tuple[str, int]]:
+    """
+    切詞
+
+    中文連續字元切成重疊的二元組（只有一個字時保留單字），英數轉小寫後以單字為詞，
+    標點與空白只作為分隔
+
+    Returns:
+        [(詞, 位置)]
+    """
+    tokens = []
+    if not text:
+        return tokens
+    position = offset
+    for match in _RUN_RE.finditer(unicodedata.normalize('NFKC', text).lower()):
+        cjk, word = match.groups()
+        if word:
+            tokens.append((word, position))
+            position += 1
+        elif len(cjk) == 1:
+            tokens.append((cjk, position))
+            position += 1
+        else:
+            for i in range(len(cjk) - 1):
+                tokens.append((cjk[i:i + 2], position))
+                position += 1
+    return tokens
+
+
+def parse_query(query: str) -> List[List[str]]:
+    """
+    解析查詢字串
+
+    以空白分隔的每一段都視為片語（中文詞的二元組必須相鄰），雙引號內可包含空白；
+    所有片語都必須符合
+    """
+    phrases = []
+    for quoted, bare in _PHRASE_RE.findall(query or ''):
+        tokens = [token for token, _ in tokenize(quoted or bare)]
+        if tokens:
+            phrases.append(tokens)
+    return phrases
+
+
+class FullTextIndex:
+    """
+    位置倒排索引：詞 -> {文件編號: [位置]}
+
+    以 update() 傳入目前完整的事件列表，依事件鍵（uid、開始時間、標題）比對差異，
+    只對新增或內容變更的事件切詞；查詢與更新以鎖互斥
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.docs = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self._keys = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def copy(self) -> 'FullTextIndex':
+        """複製索引（位置列表不會就地修改，共用；之後對副本 update() 不影響原索引）"""
+        with self._lock:
+            index = FullTextIndex()
+            index.postings = {token: dict(postings) for token, postings in self.postings.items()}
+            index.docs = dict(self.docs)
+            index.doc_lengths = dict(self.doc_lengths)
+            index.total_length = self.total_length
+            index._keys = dict(self._keys)
+            index._next_id = self._next_id
+            return index
+
+    @staticmethod
+    def _signature(event: Dict) -> Tuple:
+        return tuple(event.get(field) or '' for field in INDEXED_FIELDS)
+
+    def update(self, events: List[Dict]) -> Dict[str, int]:
+        """
+        同步索引內容與事件列表
+
+        Returns:
+            {'added': 新增數, 'removed': 移除數, 'unchanged': 未變更數}
+        """
+        with self._lock:
+            stats = {'added': 0, 'removed': 0, 'unchanged': 0}
+            current = {}
+            for key, event in zip(event_keys(events), events):
+                current[key] = event
+                existing = self._keys.get(key)
+                if existing is not None:
+                    doc_id, signature = existing
+                    if signature == self._signature(event):
+                        # 內容相同只更新事件參照
+                        self.docs[doc_id] = event
+                        stats['unchanged'] += 1
+                        continue
+                    self._remove(doc_id)
+                    stats['removed'] += 1
+                self._keys[key] = (self._add(event), self._signature(event))
+                stats['added'] += 1
+
+            for key in [key for key in self._keys if key not in current]:
+                doc_id, _ = self._keys.pop(key)
+                self._remove(doc_id)
+                stats['removed'] += 1
+            return stats
+
+    def _add(self, event: Dict) -> int:
+        doc_id = self._next_id
+        self._next_id += 1
+
+        positions = {}
+        length = 0
+        for field_number, field in enumerate(INDEXED_FIELDS):
+            tokens = tokenize(event.get(field) or '', field_number * FIELD_GAP)
+            length += len(tokens)
+            for token, position in tokens:
+                positions.setdefault(token, []).append(position)
+
+        for token, token_positions in positions.items():
+            self.postings.setdefault(token, {})[doc_id] = token_positions
+        self.docs[doc_id] = event
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+        return doc_id
+
+    def _remove(self, doc_id: int):
+        event = self.docs.pop(doc_id)
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for field_number, field in enumerate(INDEXED_FIELDS):
+            for token, _ in tokenize(event.get(field) or '', field_number * FIELD_GAP):
+                postings = self.postings.get(token)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.postings[token]
+
+    def _phrase_matches(self, tokens: List[str]) -> Dict[int, List[int]]:
+        """
+        片語符合的文件與片語起始位置
+
+        單一中文字的查詢詞比對所有包含該字的二元組（不限位置）
+        """
+        if len(tokens) == 1:
+            token = tokens[0]
+            if len(token) == 1 and not token.isascii():
+                matches = {}
+                for key, postings in self.postings.items():
+                    if token in key:
+                        for doc_id, positions in postings.items():
+                            matches.setdefault(doc_id, []).extend(positions)
+                return matches
+            return dict(self.postings.get(token, {}))
+
+        lists = [self.postings.get(token) for token in tokens]
+        if not all(lists):
+            return {}
+        # 從文件數最少的詞開始求交集
+        candidates = set(min(lists, key=len))
+        for postings in lists:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return {}
+
+        matches = {}
+        for doc_id in candidates:
+            following = [set(postings[doc_id]) for postings in lists[1:]]
+            starts = [p for p in lists[0][doc_id]
+                      if all(p + i + 1 in positions for i, positions in enumerate(following))]
+            if starts:
+                matches[doc_id] = starts
+        return matches
+
+    def search(self, query: str, limit: Optional[int] = 50) -> List[Tuple[float, Dict]]:
+        """
+        查詢（所有片語都必須符合），依 BM25 分數排序，標題中的符合權重加倍
+
+        Returns:
+            [(分數, 事件)]
+        """
+        phrases = parse_query(query)
+        if not phrases:
+            return []
+
+        with self._lock:
+            scores = None
+            doc_count = len(self.docs)
+            average_length = self.total_length / doc_count if doc_count else 0
+            for tokens in phrases:
+                matches = self._phrase_matches(tokens)
+                if not matches:
+                    return []
+                idf = math.log(1 + (doc_count - len(matches) + 0.5) / (len(matches) + 0.5))
+                phrase_scores = {}
+                for doc_id, positions in matches.items():
+                    tf = sum(TITLE_WEIGHT if p < FIELD_GAP else 1 for p in positions)
+                    norm = 1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / average_length if average_length else 1
+                    phrase_scores[doc_id] = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+                if scores is None:
+                    scores = phrase_scores
+                else:
+                    scores = {doc_id: score + phrase_scores[doc_id]
+                              for doc_id, score in scores.items() if doc_id in phrase_scores}
+                if not scores:
+                    return []
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self.docs[item[0]].get('start') or ''))
+            if limit is not None:
+                ranked = ranked[:limit]
+            return [(round(score, 4), self.docs[doc_id]) for doc_id, score in ranked]
+
+    def stats(self) -> Dict[str, int]:
+        return {'documents': len(self.docs), 'terms': len(self.postings)}
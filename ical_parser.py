@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RFC 5545 iCal 解析器
+單次掃描完成行折疊還原、屬性參數、TZID/VTIMEZONE、跳脫字元與 UID 解析，
+輸出具型別的 ICalEvent 紀錄
+"""
+
+import re
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+    ZoneInfoNotFoundError = KeyError
+
+# 行事曆顯示使用的時區（講師與教室都在台灣）
+DISPLAY_TIMEZONE = 'Asia/Taipei'
+
+# 屬性名稱後的參數區段（支援以雙引號包住、含 : ; , 的參數值）
+_PARAM_RE = re.compile(r';([A-Za-z0-9-]+)=("[^"]*"|[^";:]*)')
+_PARAMS_PREFIX_RE = re.compile(r'[A-Za-z0-9-]+(?:;[A-Za-z0-9-]+=(?:"[^"]*"|[^";:]*)(?:,(?:"[^"]*"|[^";:]*))*)*:')
+
+_UNESCAPE_RE = re.compile(r'\\([\\;,nN])')
+_UNESCAPE_MAP = {'\\': '\\', ';': ';', ',': ',', 'n': '\n', 'N': '\n'}
+
+_DURATION_RE = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$'
+)
+_OFFSET_RE = re.compile(r'^([+-])(\d{2})(\d{2})(\d{2})?$')
+
+# 只保留轉換事件需要的 VEVENT 屬性，其餘屬性在掃描時直接略過
+_EVENT_PROPERTIES = frozenset((
+    'UID', 'SUMMARY', 'DESCRIPTION', 'LOCATION', 'DTSTART', 'DTEND', 'DURATION',
+    'RRULE', 'RDATE', 'EXDATE', 'RECURRENCE-ID', 'SEQUENCE', 'STATUS'
+))
+_MULTI_VALUE_PROPERTIES = frozenset(('RDATE', 'EXDATE'))
+
+_timezone_cache = {}
+
+# parse_ical_datetime 快取的不同值數量
+DATETIME_CACHE_SIZE = 16384
+_MONTH_DAYS = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+class ICalEvent:
+    """解析後的 VEVENT 紀錄"""
+
+    __slots__ = ('uid', 'summary', 'description', 'location', 'start', 'end', 'all_day',
+                 'rrule', 'rdates', 'exdates', 'recurrence_id', 'sequence', 'status')
+
+    def __init__(self, uid: str = '', summary: str = '', description: str = '', location: str = '',
+                 start: Optional[datetime] = None, end: Optional[datetime] = None, all_day: bool = False,
+                 rrule: Optional[str] = None, rdates: Optional[List[datetime]] = None,
+                 exdates: Optional[List[datetime]] = None, recurrence_id: Optional[datetime] = None,
+                 sequence: int = 0, status: str = ''):
+        self.uid = uid
+        self.summary = summary
+        self.description = description
+        self.location = location
+        self.start = start
+        self.end = end
+        self.all_day = all_day
+        self.rrule = rrule
+        self.rdates = rdates or []
+        self.exdates = exdates or []
+        self.recurrence_id = recurrence_id
+        self.sequence = sequence
+        self.status = status
+
+    def __repr__(self) -> str:
+        return f"ICalEvent(uid={self.uid!r}, summary={self.summary!r}, start={self.start!r})"
+
+
+def get_timezone(name: str) -> Optional[tzinfo]:
+    """依 IANA 名稱取得時區（找不到時回傳 None）"""
+    if name in _timezone_cache:
+        return _timezone_cache[name]
+
+    tz = None
+    if ZoneInfo is not None:
+        try:
+            tz = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError, OSError):
+            tz = None
+    if tz is None and name == DISPLAY_TIMEZONE:
+        # 系統沒有 tzdata 時，台灣時間固定為 UTC+8（無日光節約）
+        tz = timezone(timedelta(hours=8), DISPLAY_TIMEZONE)
+
+    _timezone_cache[name] = tz
+    return tz
+
+
+def to_display_time(dt: Optional[datetime]) -> Optional[datetime]:
+    """轉換為顯示時區的 naive datetime（浮動時間與全天事件維持原值）"""
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(get_timezone(DISPLAY_TIMEZONE)).replace(tzinfo=None)
+
+
+def unescape_text(value: str) -> str:
+    """還原 TEXT 值中的跳脫字元（\\n、\\,、\\;、\\\\）"""
+    if '\\' not in value:
+        return value
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPE_MAP[m.group(1)], value)
+
+
+def parse_offset(value: str) -> Optional[timezone]:
+    """解析 UTC 偏移量（+0800、-0500、+053000）"""
+    match = _OFFSET_RE.match(value.strip())
+    if not match:
+        return None
+    sign, hours, minutes, seconds = match.groups()
+    delta = timedelta(hours=int(hours), minutes=int(minutes), seconds=int(seconds or 0))
+    return timezone(-delta if sign == '-' else delta)
+
+
+def parse_duration(value: str) -> Optional[timedelta]:
+    """解析 DURATION 值（例如 PT1H30M、P1D）"""
+    match = _DURATION_RE.match(value.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(
+        weeks=int(weeks or 0), days=int(days or 0),
+        hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0)
+    )
+    return -delta if sign == '-' else delta
+
+
+def parse_ical_datetime(value: str, tz: Optional[tzinfo] = None) -> Optional[datetime]:
+    """
+    解析 iCal DATE / DATE-TIME 值
+
+    Args:
+        value: YYYYMMDD、YYYYMMDDTHHMMSS、YYYYMMDDTHHMMSSZ 或 YYYYMMDDTHHMMSS±HHMM
+        tz: TZID 對應的時區（結尾為 Z 或帶有偏移量時以值本身的時區為準）
+
+    Returns:
+        datetime（UTC、偏移量或有 TZID 時含時區，浮動時間為 naive），格式錯誤時回傳 None
+
+    重複事件的 DTSTART / DTEND 大量重複，相同的值與時區直接取用快取結果
+    """
+    if not value:
+        return None
+    return _parse_ical_datetime(value.strip(), tz)
+
+
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def _parse_ical_datetime(value: str, tz: Optional[tzinfo]) -> Optional[datetime]:
+    length = len(value)
+
+    # 固定寬度格式：先確認皆為 ASCII 數字與日期範圍，正常路徑不會拋出例外
+    if length >= 15 and value[8] == 'T':
+        date_part = value[:8]
+        time_part = value[9:15]
+        if not (value.isascii() and date_part.isdigit() and time_part.isdigit()):
+            return None
+        suffix = value[15:]
+        if suffix == 'Z':
+            zone = timezone.utc
+        elif not suffix:
+            zone = tz
+        else:
+            zone = parse_offset(suffix)
+            if zone is None:
+                return None
+        # 整段轉成整數再拆位數，比逐欄位 int() 快
+        year, month_day = divmod(int(date_part), 10000)
+        month, day = divmod(month_day, 100)
+        hour, minute_second = divmod(int(time_part), 10000)
+        minute, second = divmod(minute_second, 100)
+        if not _valid_date(year, month, day) or hour > 23 or minute > 59 or second > 60:
+            return None
+        # 閏秒（:60）以該分鐘最後一秒表示
+        return datetime(year, month, day, hour, minute, min(second, 59), tzinfo=zone)
+
+    if length == 8:
+        if not (value.isascii() and value.isdigit()):
+            return None
+        year, month_day = divmod(int(value), 10000)
+        month, day = divmod(month_day, 100)
+        return datetime(year, month, day) if _valid_date(year, month, day) else None
+
+    # 非標準的 ISO 格式（少數伺服器使用）
+    try:
+        if length == 19:
+            return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+        if length == 10:
+            return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return None
+
+
+def _valid_date(year: int, month: int, day: int) -> bool:
+    if year < 1 or not 1 <= month <= 12 or day < 1:
+        return False
+    if month == 2 and day == 29:
+        return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    return day <= _MONTH_DAYS[month]
+
+
+def split_content_line(line: str) -> Optional[Tuple[str, Dict[str, str], str]]:
+    """
+    拆解一行內容為 (屬性名稱, 參數, 值)
+
+    例如 'DTSTART;TZID=Asia/Taipei:20250101T090000'
+    -> ('DTSTART', {'TZID': 'Asia/Taipei'}, '20250101T090000')
+    """
+    colon = line.find(':')
+    if colon <= 0:
+        return None
+
+    semi = line.find(';', 0, colon)
+    if semi == -1:
+        return line[:colon].upper(), {}, line[colon + 1:]
+
+    # 參數值可能以引號包住並含有 ':'，需以正規表示式找出真正的分隔位置
+    if '"' in line:
+        match = _PARAMS_PREFIX_RE.match(line)
+        if not match:
+            return None
+        colon = match.end() - 1
+
+    params = {}
+    for key, value in _PARAM_RE.findall(line, semi, colon):
+        if value[:1] == '"':
+            value = value[1:-1]
+        params[key.upper()] = value
+    return line[:semi].upper(), params, line[colon + 1:]
+
+
+def unfold_lines(ical_content: str) -> List[str]:
+    """還原折疊行（換行後接一個空白或 TAB）並分割為內容行"""
+    if '\r' in ical_content:
+        ical_content = ical_content.replace('\r\n', '\n')
+    if '\n ' in ical_content:
+        ical_content = ical_content.replace('\n ', '')
+    if '\n\t' in ical_content:
+        ical_content = ical_content.replace('\n\t', '')
+    return ical_content.split('\n')
+
+
+def parse_calendar(ical_content: str) -> List[ICalEvent]:
+    """
+    解析 iCal 文字中的所有 VEVENT
+
+    Args:
+        ical_content: VCALENDAR 文字內容
+
+    Returns:
+        ICalEvent 列表（包含 RRULE 系列主事件與 RECURRENCE-ID 覆寫事件）
+    """
+    events = []
+    timezones = {}
+
+    component = None        # 目前所在的元件：'VEVENT'、'VTIMEZONE' 或 None
+    nested = 0              # VEVENT / VTIMEZONE 內的子元件深度（VALARM、STANDARD...）
+    sub_component = None
+    values = params = multi = None
+    tz_id = None
+    tz_offset = None
+
+    for line in unfold_lines(ical_content):
+        if not line:
+            continue
+
+        first = line[0]
+        if first == 'B' and line.startswith('BEGIN:'):
+            name = line[6:].strip().upper()
+            if component is None:
+                if name == 'VEVENT':
+                    component = 'VEVENT'
+                    values, params, multi = {}, {}, {}
+                elif name == 'VTIMEZONE':
+                    component = 'VTIMEZONE'
+                    tz_id = None
+                    tz_offset = None
+            else:
+                if not nested:
+                    sub_component = name
+                nested += 1
+            continue
+
+        if first == 'E' and line.startswith('END:'):
+            name = line[4:].strip().upper()
+            if nested:
+                nested -= 1
+            elif name == component:
+                if component == 'VEVENT':
+                    event = _build_event(values, params, multi, timezones)
+                    if event is not None:
+                        events.append(event)
+                elif tz_id and tz_offset is not None:
+                    timezones[tz_id] = tz_offset
+                component = None
+            continue
+
+        if component == 'VEVENT':
+            if nested:
+                continue  # VALARM 等子元件的屬性不屬於事件本身
+
+            # 快速路徑：沒有參數的屬性直接以第一個 ':' 分割
+            colon = line.find(':')
+            if colon <= 0:
+                continue
+            if line.find(';', 0, colon) == -1:
+                name = line[:colon]
+                value = line[colon + 1:]
+                line_params = None
+            else:
+                parsed = split_content_line(line)
+                if parsed is None:
+                    continue
+                name, line_params, value = parsed
+
+            if name not in _EVENT_PROPERTIES:
+                name = name.upper()
+                if name not in _EVENT_PROPERTIES:
+                    continue
+            if name in _MULTI_VALUE_PROPERTIES:
+                multi.setdefault(name, []).append((line_params, value))
+            else:
+                values[name] = value
+                if line_params:
+                    params[name] = line_params
+
+        elif component == 'VTIMEZONE':
+            parsed = split_content_line(line)
+            if parsed is None:
+                continue
+            name, _, value = parsed
+            if name == 'TZID':
+                tz_id = value.strip()
+            elif name == 'TZOFFSETTO' and (tz_offset is None or sub_component == 'STANDARD'):
+                # 以 STANDARD（沒有時用 DAYLIGHT）的偏移量近似非 IANA 名稱的 TZID
+                offset = parse_offset(value)
+                if offset is not None:
+                    tz_offset = offset
+
+    return events
+
+
+def _resolve_timezone(params: Optional[Dict[str, str]], timezones: Dict[str, tzinfo]) -> Optional[tzinfo]:
+    """依 TZID 參數取得時區：優先使用 IANA 時區，否則使用 VTIMEZONE 的偏移量"""
+    if not params:
+        return None
+    tzid = params.get('TZID')
+    if not tzid:
+        return None
+    tzid = tzid.strip()
+    return get_timezone(tzid) or timezones.get(tzid)
+
+
+def _parse_date_list(props: List[Tuple[Optional[Dict[str, str]], str]],
+                     timezones: Dict[str, tzinfo]) -> List[datetime]:
+    values = []
+    for params, value in props:
+        tz = _resolve_timezone(params, timezones)
+        for item in value.split(','):
+            dt = parse_ical_datetime(item, tz)
+            if dt is not None:
+                values.append(dt)
+    return values
+
+
+def _build_event(values: Dict[str, str], params: Dict[str, Dict[str, str]],
+                 multi: Dict[str, List], timezones: Dict[str, tzinfo]) -> Optional[ICalEvent]:
+    """由收集到的屬性建立 ICalEvent"""
+    dtstart = values.get('DTSTART')
+    if dtstart is None:
+        return None
+    start_params = params.get('DTSTART')
+    start = parse_ical_datetime(dtstart, _resolve_timezone(start_params, timezones))
+    if start is None:
+        return None
+
+    all_day = len(dtstart.strip()) == 8 or (start_params is not None and start_params.get('VALUE', '').upper() == 'DATE')
+
+    dtend = values.get('DTEND')
+    end = parse_ical_datetime(dtend, _resolve_timezone(params.get('DTEND'), timezones)) if dtend else None
+    if end is None:
+        duration = parse_duration(values['DURATION']) if 'DURATION' in values else None
+        if duration is not None:
+            end = start + duration
+        else:
+            end = start + timedelta(days=1) if all_day else start
+
+    recurrence_id = values.get('RECURRENCE-ID')
+    if recurrence_id is not None:
+        recurrence_id = parse_ical_datetime(recurrence_id, _resolve_timezone(params.get('RECURRENCE-ID'), timezones))
+
+    summary = values.get('SUMMARY', '')
+    description = values.get('DESCRIPTION', '')
+    location = values.get('LOCATION', '')
+    sequence = values.get('SEQUENCE', '').strip()
+    rrule = values.get('RRULE')
+
+    return ICalEvent(
+        values.get('UID', '').strip(),
+        unescape_text(summary) if summary else summary,
+        unescape_text(description) if description else description,
+        unescape_text(location) if location else location,
+        start,
+        end,
+        all_day,
+        rrule.strip() if rrule else None,
+        _parse_date_list(multi['RDATE'], timezones) if 'RDATE' in multi else None,
+        _parse_date_list(multi['EXDATE'], timezones) if 'EXDATE' in multi else None,
+        recurrence_id,
+        int(sequence) if sequence.isdigit() else 0,
+        values.get('STATUS', '').strip().upper()
+    )
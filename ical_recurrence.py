@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重複事件展開引擎
+依 RRULE / RDATE / EXDATE / RECURRENCE-ID 在指定時間窗內逐一產生重複事件，
+並依系列快取已展開的時間窗
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from ical_parser import DISPLAY_TIMEZONE, ICalEvent, get_timezone, parse_ical_datetime, to_display_time
+
+WEEKDAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+
+# 避免錯誤的規則（例如沒有 UNTIL/COUNT 的 DAILY）無限展開
+MAX_PERIODS = 20000
+
+SUPPORTED_FREQS = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+# 尚未支援的規則部分（一天內多個實例、依年中第幾天/第幾週）；含這些部分的系列只保留主事件，不猜測展開
+UNSUPPORTED_PARTS = ('BYYEARDAY', 'BYWEEKNO', 'BYHOUR', 'BYMINUTE', 'BYSECOND')
+
+
+class RecurrenceRule:
+    """
+    解析後的 RRULE
+
+    unsupported 列出無法正確展開的部分（空列表表示可展開）
+    """
+
+    __slots__ = ('freq', 'interval', 'count', 'until', 'until_is_date', 'byday', 'bymonthday', 'bymonth',
+                 'bysetpos', 'wkst', 'unsupported')
+
+    def __init__(self, rrule: str):
+        parts = {}
+        for item in rrule.split(';'):
+            if '=' in item:
+                key, value = item.split('=', 1)
+                parts[key.strip().upper()] = value.strip()
+
+        self.freq = parts.get('FREQ', '').upper()
+        self.interval = max(int(parts['INTERVAL']), 1) if parts.get('INTERVAL', '').isdigit() else 1
+        self.count = int(parts['COUNT']) if parts.get('COUNT', '').isdigit() else None
+        self.until = parse_ical_datetime(parts['UNTIL']) if parts.get('UNTIL') else None
+        self.until_is_date = len(parts.get('UNTIL', '')) == 8
+        self.wkst = WEEKDAYS.get(parts.get('WKST', 'MO').upper(), 0)
+
+        self.byday = []  # [(序數或 None, 星期)]
+        for item in filter(None, parts.get('BYDAY', '').upper().split(',')):
+            weekday = WEEKDAYS.get(item[-2:])
+            if weekday is None:
+                continue
+            ordinal = item[:-2]
+            self.byday.append((int(ordinal) if ordinal.lstrip('+-').isdigit() else None, weekday))
+
+        self.bymonthday = [int(v) for v in parts.get('BYMONTHDAY', '').split(',') if v.lstrip('+-').isdigit()]
+        self.bymonth = [int(v) for v in parts.get('BYMONTH', '').split(',') if v.isdigit()]
+        self.bysetpos = [int(v) for v in parts.get('BYSETPOS', '').split(',')
+                         if v.lstrip('+-').isdigit() and int(v) != 0]
+
+        self.unsupported = [part for part in UNSUPPORTED_PARTS if part in parts]
+        if self.freq not in SUPPORTED_FREQS:
+            self.unsupported.append(f'FREQ={self.freq}')
+        if self.freq in ('DAILY', 'WEEKLY') and any(ordinal is not None for ordinal, _ in self.byday):
+            self.unsupported.append('BYDAY 序數')
+        if self.freq == 'WEEKLY' and self.bymonthday:
+            self.unsupported.append('BYMONTHDAY')
+
+
+class RecurringSeries:
+    """一個重複事件系列：主事件（含 RRULE）與 RECURRENCE-ID 覆寫事件"""
+
+    __slots__ = ('uid', 'master', 'rule', 'overrides', '__weakref__')
+
+    def __init__(self, master: ICalEvent, overrides: Optional[List[ICalEvent]] = None):
+        self.uid = master.uid
+        self.master = master
+        self.rule = RecurrenceRule(master.rrule) if master.rrule else None
+        if self.rule is not None and self.rule.unsupported:
+            print(f"⚠️ 重複規則含尚未支援的部分（{', '.join(self.rule.unsupported)}），"
+                  f"只保留主事件: {master.summary} RRULE:{master.rrule}")
+            self.rule = None
+        self.overrides = {}
+        for override in overrides or []:
+            self.overrides[_align(override.recurrence_id, master.start)] = override
+
+    def occurrences(self, window_start: datetime, window_end: datetime) -> Iterator[ICalEvent]:
+        """
+        逐一產生與時間窗 [window_start, window_end) 重疊的事件（依開始時間排序的主規則事件，其後為移動過的覆寫事件）
+
+        Args:
+            window_start: 時間窗起點（顯示時區的 naive datetime）
+            window_end: 時間窗終點（顯示時區的 naive datetime）
+        """
+        master = self.master
+        duration = master.end - master.start
+        window_start = _align(window_start, master.start)
+        start_bound = window_start - duration
+        end_bound = _align(window_end, master.start)
+        excluded = {_align(dt, master.start) for dt in master.exdates}
+        excluded_dates = {dt.date() for dt in master.exdates if dt.tzinfo is None and dt.hour == dt.minute == 0}
+
+        for start in self._iter_starts(start_bound, end_bound):
+            if start in excluded or (master.all_day and start.date() in excluded_dates):
+                continue
+            if start in self.overrides:
+                continue  # 由下方的覆寫事件取代
+            if start + duration <= window_start and start < window_start:
+                continue
+            yield ICalEvent(
+                master.uid, master.summary, master.description, master.location,
+                start, start + duration, master.all_day,
+                None, None, None, start, master.sequence, master.status
+            )
+
+        for original_start, override in self.overrides.items():
+            if original_start in excluded or override.status == 'CANCELLED':
+                continue
+            if _align(override.start, master.start) < end_bound and _align(override.end, master.start) > window_start:
+                yield override
+
+    def _iter_starts(self, start_bound: datetime, end_bound: datetime) -> Iterator[datetime]:
+        """依序產生開始時間早於 end_bound 的所有實例開始時間（含 RDATE）"""
+        master = self.master
+        extra = sorted(_align(dt, master.start) for dt in master.rdates)
+        rule_starts = _iter_rule_starts(master.start, self.rule, start_bound) if self.rule else iter((master.start,))
+
+        # 合併 RRULE 與 RDATE 兩個已排序序列
+        next_extra = 0
+        for start in rule_starts:
+            while next_extra < len(extra) and extra[next_extra] < start:
+                if extra[next_extra] >= end_bound:
+                    return
+                yield extra[next_extra]
+                next_extra += 1
+            if start >= end_bound:
+                break
+            if next_extra < len(extra) and extra[next_extra] == start:
+                next_extra += 1
+            yield start
+
+        for dt in extra[next_extra:]:
+            if dt >= end_bound:
+                return
+            yield dt
+
+
+def split_recurring(records: List[ICalEvent]) -> Tuple[List[ICalEvent], List[RecurringSeries]]:
+    """
+    將解析結果分為單次事件與重複事件系列
+
+    Returns:
+        (單次事件列表, RecurringSeries 列表)；覆寫事件歸入同 UID 的系列
+    """
+    masters = {}
+    overrides = {}
+    singles = []
+
+    for record in records:
+        if record.recurrence_id is not None:
+            overrides.setdefault(record.uid, []).append(record)
+        elif record.rrule or record.rdates:
+            masters[record.uid] = record
+        else:
+            singles.append(record)
+
+    series = [RecurringSeries(master, overrides.pop(uid, None)) for uid, master in masters.items()]
+
+    # 找不到主事件的覆寫事件視為單次事件
+    for records in overrides.values():
+        singles.extend(records)
+
+    return singles, series
+
+
+class RecurrenceExpander:
+    """
+    依系列快取已展開時間窗的展開器
+
+    快取以系列物件為弱參照鍵，系列所屬資源被同步更新或刪除後快取自動釋放；
+    請求執行緒與背景同步執行緒共用同一個展開器，快取的讀寫以鎖保護（展開本身不持有鎖）
+    """
+
+    def __init__(self, convert: Callable[[ICalEvent], Optional[Dict]], windows_per_series: int = 8):
+        """
+        Args:
+            convert: 將展開後的 ICalEvent 轉成事件物件的函數
+            windows_per_series: 每個系列最多快取的時間窗數量
+        """
+        self.convert = convert
+        self.windows_per_series = windows_per_series
+        self._cache = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def expand(self, series: RecurringSeries, window_start: datetime, window_end: datetime) -> List[Dict]:
+        """取得系列在時間窗內的事件（已快取時直接回傳）"""
+        key = (window_start, window_end)
+        with self._lock:
+            windows = self._cache.get(series)
+            cached = windows.get(key) if windows is not None else None
+            if cached is not None:
+                windows.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        # 多個執行緒同時展開同一時間窗時結果相同，後寫入者覆蓋即可
+        events = []
+        for occurrence in series.occurrences(window_start, window_end):
+            event = self.convert(occurrence)
+            if event:
+                events.append(event)
+
+        with self._lock:
+            windows = self._cache.get(series)
+            if windows is None:
+                windows = self._cache[series] = OrderedDict()
+            windows[key] = events
+            windows.move_to_end(key)
+            while len(windows) > self.windows_per_series:
+                windows.popitem(last=False)
+        return events
+
+    def iter_expand(self, series: RecurringSeries, window_start: datetime, window_end: datetime) -> Iterator[Dict]:
+        """逐一產生系列在時間窗內的事件（不經過快取，用於大範圍匯出）"""
+        with self._lock:
+            windows = self._cache.get(series)
+            cached = windows.get((window_start, window_end)) if windows is not None else None
+        if cached is not None:
+            yield from cached
+            return
+        for occurrence in series.occurrences(window_start, window_end):
+            event = self.convert(occurrence)
+            if event:
+                yield event
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'series': len(self._cache), 'hits': self.hits, 'misses': self.misses}
+
+
+def _align(dt: datetime, reference: datetime) -> datetime:
+    """讓 dt 與 reference 的時區型態一致（naive 視為顯示時區）以便比較"""
+    if reference.tzinfo is None:
+        return to_display_time(dt) if dt.tzinfo is not None else dt
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=get_timezone(DISPLAY_TIMEZONE))
+    return dt
+
+
+def _iter_rule_starts(dtstart: datetime, rule: RecurrenceRule, start_bound: datetime) -> Iterator[datetime]:
+    """依 RRULE 產生實例開始時間（DTSTART 為第一個實例）"""
+    until = None
+    if rule.until is not None:
+        if rule.until_is_date:
+            # UNTIL 只有日期時包含當天
+            until = _align(datetime.combine(rule.until.date(), time.max), dtstart)
+        else:
+            until = _align(rule.until, dtstart)
+
+    count = rule.count
+    emitted = 0
+
+    yield dtstart
+    emitted += 1
+    if count is not None and emitted >= count:
+        return
+
+    period_start, skip_days = _first_period(dtstart, rule, start_bound)
+    for period in range(MAX_PERIODS):
+        days = _period_days(period_start, dtstart, rule)
+        for day in days:
+            candidate = datetime.combine(day, dtstart.timetz())
+            if candidate <= dtstart:
+                continue
+            if until is not None and candidate > until:
+                return
+            yield candidate
+            emitted += 1
+            if count is not None and emitted >= count:
+                return
+        period_start = _advance(period_start, rule, skip_days)
+
+
+def _first_period(dtstart: datetime, rule: RecurrenceRule, start_bound: datetime) -> Tuple[date, int]:
+    """
+    計算第一個週期的起始日期
+
+    沒有 COUNT 時，DAILY / WEEKLY 規則直接跳到時間窗附近，不必從 DTSTART 逐期展開
+    """
+    start_date = dtstart.date()
+    if rule.freq == 'WEEKLY':
+        start_date = start_date - timedelta(days=(start_date.weekday() - rule.wkst) % 7)
+        step = 7 * rule.interval
+    elif rule.freq == 'DAILY':
+        step = rule.interval
+    elif rule.freq == 'MONTHLY':
+        return start_date.replace(day=1), 0
+    else:
+        return start_date.replace(month=1, day=1), 0
+
+    if rule.count is None and start_bound > dtstart:
+        periods = (start_bound.date() - start_date).days // step - 1
+        if periods > 0:
+            start_date = start_date + timedelta(days=periods * step)
+    return start_date, step
+
+
+def _advance(period_start: date, rule: RecurrenceRule, step_days: int) -> date:
+    """前進到下一個週期"""
+    if rule.freq in ('DAILY', 'WEEKLY'):
+        return period_start + timedelta(days=step_days)
+    if rule.freq == 'MONTHLY':
+        month_index = period_start.year * 12 + period_start.month - 1 + rule.interval
+        return date(month_index // 12, month_index % 12 + 1, 1)
+    if rule.freq == 'YEARLY':
+        return date(period_start.year + rule.interval, 1, 1)
+    return date.max
+
+
+def _period_days(period_start: date, dtstart: datetime, rule: RecurrenceRule) -> List[date]:
+    """列出一個週期內符合規則的日期（已排序，已套用 BYSETPOS）"""
+    if rule.freq == 'DAILY':
+        days = [period_start]
+        if rule.byday:
+            days = [day for day in days if day.weekday() in {weekday for _, weekday in rule.byday}]
+        if rule.bymonthday:
+            days = [day for day in days if _matches_monthday(day, rule.bymonthday)]
+    elif rule.freq == 'WEEKLY':
+        weekdays = sorted({weekday for _, weekday in rule.byday}) or [dtstart.weekday()]
+        days = sorted(period_start + timedelta(days=(weekday - rule.wkst) % 7) for weekday in weekdays)
+    elif rule.freq == 'MONTHLY':
+        days = _month_days(period_start.year, period_start.month, dtstart, rule)
+    elif rule.freq == 'YEARLY':
+        year = period_start.year
+        if rule.byday and not rule.bymonth and not rule.bymonthday:
+            # 只有 BYDAY：序數以整年計算（例如 20MO 為當年第 20 個星期一）
+            year_days = [date(year, 1, 1) + timedelta(days=offset)
+                         for offset in range((date(year + 1, 1, 1) - date(year, 1, 1)).days)]
+            days = sorted(_byday_matches(year_days, rule.byday))
+        else:
+            months = rule.bymonth or (range(1, 13) if rule.bymonthday else [dtstart.month])
+            days = []
+            for month in sorted(months):
+                days.extend(_month_days(year, month, dtstart, rule))
+    else:
+        return []
+
+    if rule.bymonth:
+        days = [day for day in days if day.month in rule.bymonth]
+    if rule.bysetpos:
+        days = _select_positions(days, rule.bysetpos)
+    return days
+
+
+def _month_days(year: int, month: int, dtstart: datetime, rule: RecurrenceRule) -> List[date]:
+    """列出某月符合 BYMONTHDAY / BYDAY 的日期（兩者都指定時取交集）"""
+    month_length = (date(year + month // 12, month % 12 + 1, 1) - date(year, month, 1)).days
+
+    days = None
+    if rule.bymonthday:
+        days = set()
+        for day in rule.bymonthday:
+            day = day if day > 0 else month_length + day + 1
+            if 1 <= day <= month_length:
+                days.add(date(year, month, day))
+
+    if rule.byday:
+        matches = _byday_matches([date(year, month, day) for day in range(1, month_length + 1)], rule.byday)
+        days = matches if days is None else days & matches
+
+    if days is not None:
+        return sorted(days)
+    if dtstart.day <= month_length:
+        return [date(year, month, dtstart.day)]
+    return []
+
+
+def _byday_matches(days: List[date], byday: List[Tuple[Optional[int], int]]) -> set:
+    """範圍內（某月或某年，已排序）符合 BYDAY 的日期；有序數時取範圍內第 n 個（負數從最後算起）"""
+    matched = set()
+    for ordinal, weekday in byday:
+        candidates = [day for day in days if day.weekday() == weekday]
+        if ordinal is None:
+            matched.update(candidates)
+        elif 0 < abs(ordinal) <= len(candidates):
+            matched.add(candidates[ordinal - 1 if ordinal > 0 else ordinal])
+    return matched
+
+
+def _select_positions(days: List[date], bysetpos: List[int]) -> List[date]:
+    """BYSETPOS：從週期內已排序的日期中取第 n 個（負數從最後算起）"""
+    selected = set()
+    for position in bysetpos:
+        if 0 < abs(position) <= len(days):
+            selected.add(days[position - 1 if position > 0 else position])
+    return sorted(selected)
+
+
+def _matches_monthday(day: date, bymonthday: List[int]) -> bool:
+    month_length = (date(day.year + day.month // 12, day.month % 12 + 1, 1) - date(day.year, day.month, 1)).days
+    return day.day in bymonthday or day.day - month_length - 1 in bymonthday
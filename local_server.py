@@ -5,17 +5,53 @@
 用於本地端測試講師行事曆檢視系統
 """
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import json
 import os
+from functools import partial
 from datetime import datetime, timedelta
 import random
-import requests
+import sqlite3
+import threading
+import time
 import xml.etree.ElementTree as ET
 from urllib.parse import quote
 
+from caldav_discovery import MultiCalendarSync
+from caldav_sync import CalDAVError
+from ical_parser import parse_calendar, to_display_time
+from ical_recurrence import RecurrenceExpander, RecurringSeries, split_recurring
+from event_index import EPOCH, SECONDS_PER_DAY, EventIndex, decode_cursor, event_span, paginate, parse_event_time
+from event_store import EVENT_FIELDS, EventRecord
+from facet_index import FACET_FIELDS, FacetIndex
+from conflict_detector import CONFLICT_TYPES, ConflictDetector
+from availability import BUSINESS_END, BUSINESS_START
+from analytics import PERIODS, EventColumns
+from response_cache import ENCODINGS, ResponseCache
+from event_snapshot import EventSnapshot
+from snapshot_refresher import SnapshotRefresher
+from persistent_store import PersistentStore
+from snapshot_file import MappedEventIndex, MappedEvents, SnapshotFileReader, SnapshotFileWriter, snapshot_synced_at
+from title_parser import get_instructor_matcher, instructor_search_text, parse_course_title
+
+class EventJSONProvider(DefaultJSONProvider):
+    """事件以精簡紀錄保存，輸出 JSON 時才轉換為原本的事件格式"""
+    
+    # 中文直接輸出 UTF-8（\uXXXX 跳脫會讓每個字從 3 bytes 變成 6 bytes）
+    ensure_ascii = False
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, EventRecord):
+            return o.to_dict()
+        if isinstance(o, MappedEvents):
+            return list(o)
+        return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
+app.json = EventJSONProvider(app)
 CORS(app)  # 允許跨域請求
 
 # CalDAV 配置
@@ -23,7 +59,45 @@ CALDAV_CONFIG = {
     'url': 'https://funlearnbar.synology.me:9102/caldav/',
     'username': 'testacount',
     'password': 'testacount',
-    'calendar_path': 'testacount/'
+    'calendar_path': 'testacount/',
+    # 'sync': 以 sync-collection 同步整個日曆（預設）；
+    # 'window': 以 calendar-query 只抓取時間窗內的事件（請求量較小，但 /api/events、本機儲存、
+    #           /api/analytics 的月結統計與 /api/conflicts 都只看得到時間窗內的資料）
+    'fetch_mode': 'sync',
+    # 'window' 模式的抓取範圍，也是重複事件預先展開的時間窗（天）。兩種模式下快照與各索引
+    # 都只包含時間窗內展開的重複事件；查詢範圍超出時間窗時，/api/events、/api/events/search、
+    # /api/analytics、/api/conflicts 與 /api/availability 改為即時展開重複事件（較慢，但結果完整）
+    'window_past_days': 7,
+    'window_future_days': 60,
+    # 只抓取 SUMMARY 包含此字串的事件（None 表示不篩選）
+    'summary_filter': None,
+    # 以 current-user-principal / calendar-home-set 探索帳號的所有事件日曆並合併
+    # （False 或伺服器不支援探索時只同步 calendar_path）
+    'discover_calendars': True,
+    # 探索結果的快取秒數（日曆新增或移除最多延遲這麼久才會被發現）
+    'discovery_ttl_seconds': 3600,
+    # 同時同步的日曆數上限（也是共用連線池的連線數）
+    'max_concurrent_fetches': 4,
+    # 背景重新同步的間隔秒數（0 表示只在啟動與呼叫 /api/refresh 時同步）
+    'refresh_ttl_seconds': 300,
+    # 同步結果的本機儲存（SQLite），重新啟動時直接載入；可用環境變數 CALDAV_STORE_PATH 指定，設為空字串表示不保存
+    'store_path': os.environ.get('CALDAV_STORE_PATH',
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), 'caldav_store.sqlite3'))
+}
+
+# 執行角色（以環境變數 SERVER_ROLE 或 create_app(role) 指定）：
+#   standalone - 同一個行程同步 CalDAV 並提供 API（預設）
+#   sync       - 同上，另在每次同步後將快照寫入共用快照檔
+#   worker     - 不連線 CalDAV、不讀取本機儲存，以 mmap 讀取共用快照檔，檔案替換時重新載入
+SERVER_ROLES = ('standalone', 'sync', 'worker')
+
+SERVER_CONFIG = {
+    'role': os.environ.get('SERVER_ROLE', 'standalone'),
+    # sync 行程寫入、worker 行程讀取的共用快照檔（可用環境變數 SNAPSHOT_FILE 指定）
+    'snapshot_file': os.environ.get('SNAPSHOT_FILE',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'event_snapshot.bin')),
+    # worker 檢查快照檔是否已替換的間隔秒數
+    'snapshot_poll_seconds': 1.0
 }
 
 # 真實講師資料（從原系統獲取）
@@ -114,256 +188,546 @@ def generate_mock_events():
                 "location": "樂程坊 Funlearnbar",
                 "description": f"{instructor} 助教:無 教案:{course_type}教案:範例課程"
             }
-            events.append(event)
+            events.append(to_event_record(event))
     
     return events
 
-# 儲存事件資料
-real_events = []
-mock_events = generate_mock_events()
+def to_event_record(event):
+    """事件字典轉換為精簡紀錄，並從標題拆解課程類型、星期、時段、上課地點、週數、代課類型與原講師"""
+    return EventRecord.from_dict(event, parse_course_title(event.get('title', '')))
+
+# 依資料版本快取的序列化回應
+response_cache = ResponseCache()
+
+# 啟動時間與第一次同步完成所需秒數
+startup_time = time.monotonic()
+warmup_seconds = None
+
+# 目前的事件資料快照（事件與所有索引；同步完成後整體替換，請求開始時取得一次，讀取不需加鎖）
+current_snapshot = EventSnapshot.empty()
+
+# 目前的執行角色（由 create_app() 設定，None 表示尚未啟動）與共用快照檔的寫入端（sync）、讀取端（worker）
+server_role = None
+server_role_lock = threading.Lock()
+snapshot_writer = None
+snapshot_reader = None
 
 def fetch_caldav_events():
-    """從 CalDAV 抓取真實事件資料"""
-    global real_events
-    
+    """從 CalDAV 增量同步事件資料（只下載並解析有變更的事件），回傳同步結果，失敗時回傳 None"""
     try:
-        print("🔄 開始從 CalDAV 抓取真實事件資料...")
+        print("🔄 開始從 CalDAV 同步事件資料...")
         
-        # 構建 CalDAV 請求 URL
-        if CALDAV_CONFIG['calendar_path']:
-            caldav_url = f"{CALDAV_CONFIG['url']}{CALDAV_CONFIG['calendar_path']}"
-        else:
-            caldav_url = CALDAV_CONFIG['url']
-        
-        # 構建 PROPFIND 請求
-        headers = {
-            'Content-Type': 'application/xml',
-            'Depth': '1'
-        }
+        result = caldav_engine.sync()
+        print(f"📡 同步方式: {result.mode} ({'完整' if result.full else '增量'})，日曆 {result.calendars} 個"
+              + (f"（{result.failed} 個失敗）" if result.failed else ""))
+        print(f"📅 伺服器資源 {result.listed} 個，下載變更 {result.changed} 個，移除 {result.removed} 個")
+        return result
         
-        # CalDAV PROPFIND 請求體
-        propfind_body = '''<?xml version="1.0" encoding="utf-8"?>
-<D:propfind xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
-    <D:prop>
-        <D:getetag/>
-        <C:calendar-data/>
-    </D:prop>
-</D:propfind>'''
-        
-        # 發送請求 - 使用 Basic Auth
-        from requests.auth import HTTPBasicAuth
-        response = requests.request(
-            'PROPFIND',
-            caldav_url,
-            data=propfind_body,
-            headers=headers,
-            auth=HTTPBasicAuth(CALDAV_CONFIG['username'], CALDAV_CONFIG['password']),
-            timeout=30
-        )
-        
-        print(f"📡 CalDAV 請求狀態: {response.status_code}")
-        print(f"📡 回應標頭: {dict(response.headers)}")
-        
-        if response.status_code == 207:  # Multi-Status
-            print("✅ CalDAV 請求成功")
-            
-            # 解析 XML 回應
-            try:
-                root = ET.fromstring(response.content)
-                
-                # 定義命名空間
-                namespaces = {
-                    'D': 'DAV:',
-                    'C': 'urn:ietf:params:xml:ns:caldav'
-                }
-                
-                events = []
-                
-                # 遍歷所有回應項目
-                for response_elem in root.findall('.//D:response', namespaces):
-                    # 檢查是否有 calendar-data
-                    calendar_data_elem = response_elem.find('.//C:calendar-data', namespaces)
-                    
-                    if calendar_data_elem is not None and calendar_data_elem.text:
-                        ical_content = calendar_data_elem.text
-                        print(f"📅 找到 iCal 內容: {len(ical_content)} 字元")
-                        
-                        # 解析 iCal 內容
-                        parsed_events = parse_ical_content(ical_content)
-                        events.extend(parsed_events)
-                        print(f"📅 解析出 {len(parsed_events)} 個事件")
-                
-                real_events = events
-                print(f"✅ 成功抓取 {len(real_events)} 個真實事件")
-                return True
-                
-            except ET.ParseError as e:
-                print(f"❌ XML 解析失敗: {str(e)}")
-                print(f"原始回應: {response.text[:500]}...")
-                return False
-            
-        elif response.status_code == 401:
-            print("❌ CalDAV 認證失敗 (401)")
+    except CalDAVError as e:
+        print(f"❌ {str(e)}")
+        if e.status_code == 401:
             print("💡 請檢查用戶名和密碼是否正確")
-            print(f"回應內容: {response.text}")
-            return False
-        elif response.status_code == 404:
-            print("❌ CalDAV 日曆路徑不存在 (404)")
+        elif e.status_code == 404:
             print("💡 請檢查日曆路徑是否正確")
-            print(f"回應內容: {response.text}")
-            return False
-        else:
-            print(f"❌ CalDAV 請求失敗: {response.status_code}")
-            print(f"回應內容: {response.text}")
-            return False
-            
+        print(f"回應內容: {e.body[:500]}")
+        return None
+    except ET.ParseError as e:
+        print(f"❌ XML 解析失敗: {str(e)}")
+        return None
     except Exception as e:
         print(f"❌ CalDAV 抓取失敗: {str(e)}")
-        return False
+        return None
 
 def parse_ical_content(ical_content):
-    """解析 iCal 內容並轉換為事件物件"""
-    events = []
-    
+    """解析 iCal 內容：單次事件轉換為事件物件，重複事件保留為 RecurringSeries 以便依時間窗展開"""
     try:
-        lines = ical_content.split('\n')
-        current_event = {}
-        in_event = False
-        
-        for line in lines:
-            line = line.strip()
-            
-            if line == 'BEGIN:VEVENT':
-                in_event = True
-                current_event = {}
-            elif line == 'END:VEVENT':
-                if in_event and current_event:
-                    # 轉換為標準格式
-                    event = convert_ical_to_event(current_event)
-                    if event:
-                        events.append(event)
-                in_event = False
-                current_event = {}
-            elif in_event and ':' in line:
-                key, value = line.split(':', 1)
-                current_event[key] = value
-        
-        return events
+        singles, series = split_recurring(parse_calendar(ical_content))
+        events = []
+        for ical_event in singles:
+            event = convert_ical_to_event(ical_event)
+            if event:
+                events.append(event)
+        return events + series
         
     except Exception as e:
         print(f"❌ 解析 iCal 內容失敗: {str(e)}")
         return []
 
-def convert_ical_to_event(ical_event):
-    """將 iCal 事件轉換為標準事件格式"""
+def convert_ical_to_event(ical_event, recurring=False):
+    """將 ICalEvent 轉換為標準事件格式（recurring 表示由重複事件系列展開）"""
     try:
-        # 提取基本資訊
-        title = ical_event.get('SUMMARY', '無標題')
-        start_str = ical_event.get('DTSTART', '')
-        end_str = ical_event.get('DTEND', '')
-        description = ical_event.get('DESCRIPTION', '')
-        location = ical_event.get('LOCATION', '樂程坊 Funlearnbar')
-        
-        # 解析時間
-        start_time = parse_ical_datetime(start_str)
-        end_time = parse_ical_datetime(end_str)
+        # 轉換為台灣時間（TZID / UTC 時間不再被直接忽略）
+        start_time = to_display_time(ical_event.start)
+        end_time = to_display_time(ical_event.end)
         
         if not start_time or not end_time:
             return None
         
-        # 從標題中提取講師資訊
-        instructor = extract_instructor_from_title(title)
+        title = ical_event.summary or '無標題'
+        facets = parse_course_title(title)
         
-        # 構建事件物件
-        event = {
-            'title': title,
-            'instructor': instructor,
-            'start': start_time.isoformat() + '.000',
-            'end': end_time.isoformat() + '.000',
-            'location': location,
-            'description': description
-        }
+        # 從標題（或描述）中提取講師資訊（代課標示後的原講師不算）
+        instructor = extract_instructor_from_title(instructor_search_text(title, facets), ical_event.description)
         
-        return event
+        # 構建事件紀錄（時間以整數秒數保存）
+        return EventRecord(
+            ical_event.uid,
+            title,
+            instructor,
+            int((start_time - EPOCH).total_seconds()),
+            int((end_time - EPOCH).total_seconds()),
+            ical_event.location or '樂程坊 Funlearnbar',
+            ical_event.description,
+            recurring,
+            facets
+        )
         
     except Exception as e:
         print(f"❌ 轉換 iCal 事件失敗: {str(e)}")
         return None
 
-def parse_ical_datetime(dt_str):
-    """解析 iCal 日期時間字串"""
+def extract_instructor_from_title(title, description=''):
+    """從標題中提取講師名稱（標題找不到時改從描述中尋找）"""
+    return get_instructor_matcher(REAL_TEACHERS).match(title, description)
+
+def default_event_window():
+    """預設事件時間窗（與 CalDAV 時間窗相同），以台灣時間的 naive datetime 表示"""
+    window_start, window_end = caldav_engine.window_bounds()
+    return to_display_time(window_start), to_display_time(window_end)
+
+def materialize_events(items, window_start, window_end):
+    """將單次事件與重複事件系列展開成時間窗內的事件列表"""
+    events = []
+    for item in items:
+        if isinstance(item, RecurringSeries):
+            events.extend(recurrence_expander.expand(item, window_start, window_end))
+        else:
+            events.append(item)
+    return events
+
+def publish_snapshot(events, teachers, data_source, readiness, series=(), window=(None, None), synced_at=None):
+    """建立新的快照並整體替換目前的快照（全文索引與衝突偵測由 update_search_indexes() 另外建立）"""
+    global current_snapshot
+    snapshot = EventSnapshot.build(current_snapshot.version + 1, events, teachers, data_source, readiness,
+                                   series, window, synced_at or datetime.now(), previous=current_snapshot)
+    current_snapshot = snapshot
+    return snapshot
+
+def update_search_indexes(snapshot=None):
+    """
+    建立快照的全文索引與衝突偵測（以前一版快照的索引為基礎，只處理變更的事件）
+    
+    由背景同步執行緒在替換快照後呼叫；worker 行程沒有同步執行緒，改在第一次使用時建立。
+    索引屬於快照本身，請求取得的快照與其全文索引、衝突偵測一定是同一個資料版本
+    
+    Returns:
+        快照的 SearchIndexes
+    """
+    snapshot = snapshot or current_snapshot
+    stats = snapshot.search.build()
+    if stats is not None:
+        fulltext_stats, conflict_stats = stats
+        print(f"🔎 全文索引: 新增 {fulltext_stats['added']} 個，移除 {fulltext_stats['removed']} 個，"
+              f"未變更 {fulltext_stats['unchanged']} 個")
+        print(f"⚠️ 排課衝突: {conflict_stats['conflicts']} 組"
+              f"（重新檢查 {conflict_stats['recomputed']}/{conflict_stats['buckets']} 個分組）")
+    return snapshot.search
+
+def query_events(start, end, snapshot=None):
+    """
+    查詢與 [start, end) 重疊的事件（秒數，None 表示不限）
+    
+    超出預先展開時間窗的範圍改為即時展開重複事件（依系列與時間窗快取；
+    只指定一端時展開範圍見 EventSnapshot.expansion_range）
+    """
+    snapshot = snapshot or current_snapshot
+    events = snapshot.index.range(start, end)
+    if snapshot.expansion_range(start, end) is None:
+        return events
+    
+    events = [event for event in events if not event.get('recurring')]
+    events.extend(expand_series_events(start, end, snapshot))
+    events.sort(key=lambda event: event.start_ts)
+    return events
+
+def expand_series_events(start, end, snapshot):
+    """即時展開重複事件（範圍見 EventSnapshot.expansion_range；預先展開時間窗已涵蓋時回傳空列表）"""
+    expansion = snapshot.expansion_range(start, end)
+    if expansion is None:
+        return []
+    range_start = EPOCH + timedelta(seconds=expansion[0])
+    range_end = EPOCH + timedelta(seconds=expansion[1])
+    events = []
+    for series in snapshot.series:
+        events.extend(recurrence_expander.expand(series, range_start, range_end))
+    return events
+
+def availability_index(start, end, snapshot):
+    """[start, end) 的空檔索引（範圍超出預先展開時間窗時加入即時展開的重複事件）"""
+    occurrences = expand_series_events(start, end, snapshot)
+    if not occurrences:
+        return snapshot.availability
+    return snapshot.availability.with_events(occurrences)
+
+def iter_query_events(start, end, instructor=None, snapshot=None):
+    """
+    逐一產生與 [start, end) 重疊的事件（可指定講師），不建立完整列表
+    
+    範圍內的事件依開始時間排序；超出預先展開時間窗時，重複事件改為逐一展開並依系列接在後面
+    """
+    snapshot = snapshot or current_snapshot
+    index = snapshot.index
+    expansion = snapshot.expansion_range(start, end)
+    expand = expansion is not None
+    
+    if instructor:
+        # 講師的事件列表已依開始時間排序，只需再檢查時間範圍
+        candidates = index.instructor_events(instructor)
+        if start is not None or end is not None:
+            candidates = (event for event in candidates if overlaps(event, start, end))
+    else:
+        candidates = index.iter_range(start, end)
+    
+    for event in candidates:
+        if expand and event.get('recurring'):
+            continue
+        yield event
+    
+    if expand:
+        range_start = EPOCH + timedelta(seconds=expansion[0])
+        range_end = EPOCH + timedelta(seconds=expansion[1])
+        for series in snapshot.series:
+            for event in recurrence_expander.iter_expand(series, range_start, range_end):
+                if not instructor or event.get('instructor') == instructor:
+                    yield event
+
+def overlaps(event, start, end):
+    """事件是否與 [start, end) 重疊（與 EventIndex.range 的判斷相同）"""
+    event_start, event_end = event_span(event)
+    if event_start is None:
+        return False
+    if end is not None and event_start >= end:
+        return False
+    return start is None or event_end > start or event_start == start
+
+def parse_range_args():
+    """
+    解析 start / end 查詢參數
+    
+    Returns:
+        (start 秒數, end 秒數, 錯誤訊息)
+    """
+    start_arg = request.args.get('start')
+    end_arg = request.args.get('end')
+    start = parse_event_time(start_arg) if start_arg else None
+    end = parse_event_time(end_arg) if end_arg else None
+    
+    if (start_arg and start is None) or (end_arg and end is None):
+        return None, None, '日期格式錯誤，請使用 YYYY-MM-DD 或 YYYY-MM-DDTHH:MM:SS'
+    if start is not None and end is not None and start >= end:
+        return None, None, 'start 必須早於 end'
+    return start, end, None
+
+# 分頁：指定 cursor 但未指定 limit 時的每頁筆數與每頁上限
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+def parse_page_args():
+    """
+    解析 limit / cursor / fields 查詢參數
+    
+    Returns:
+        ({'limit', 'cursor', 'fields'}, 錯誤訊息)；limit 為 None 表示不分頁，fields 為 None 表示回傳所有欄位
+    """
+    limit_arg = request.args.get('limit')
+    cursor_arg = request.args.get('cursor')
+    fields_arg = request.args.get('fields')
+    
+    limit = None
+    if limit_arg:
+        try:
+            limit = int(limit_arg)
+        except ValueError:
+            return None, 'limit 必須是整數'
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return None, f'limit 必須介於 1 到 {MAX_PAGE_SIZE}'
+    
+    cursor = None
+    if cursor_arg:
+        cursor = decode_cursor(cursor_arg)
+        if cursor is None:
+            return None, 'cursor 格式錯誤'
+        limit = limit or DEFAULT_PAGE_SIZE
+    
+    fields = None
+    if fields_arg:
+        fields = [field.strip() for field in fields_arg.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in EVENT_FIELDS]
+        if unknown:
+            return None, f"未知的欄位: {', '.join(unknown)}（可用: {', '.join(EVENT_FIELDS)}）"
+    
+    return {'limit': limit, 'cursor': cursor, 'fields': fields}, None
+
+def apply_page(response, events, page, starts=None):
+    """
+    依分頁參數填入 response 的 data / total / next_cursor
+    
+    events 必須依開始時間排序（分頁游標以開始時間定位）；有指定 fields 時只輸出這些欄位
+    """
+    response["total"] = len(events)
+    if page['limit'] is not None:
+        events, next_cursor = paginate(events, page['limit'], page['cursor'], starts)
+        response["limit"] = page['limit']
+        response["next_cursor"] = next_cursor
+    if page['fields'] is not None:
+        events = [{field: event.get(field) for field in page['fields']} for event in events]
+    response["data"] = events
+    return response
+
+def cached_json_response(snapshot, build):
+    """
+    回傳快取的 JSON 回應（依資料版本、路徑與查詢參數快取序列化結果）
+    
+    依 Accept-Encoding 回傳預先壓縮的內容（同一版本只壓縮一次）；
+    回應附帶 ETag，客戶端的 If-None-Match 符合時直接回傳 304
+    """
+    key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    entry = response_cache.get(
+        snapshot.version, key, lambda: app.json.dumps(build(), separators=(',', ':')).encode('utf-8') + b'\n')
+    
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    body, etag = entry.representation(encoding)
+    
+    if etag in request.if_none_match:
+        print(f"[{datetime.now()}] 304 Not Modified ({request.path})")
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if body is not entry.body:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # 客戶端每次都需帶 If-None-Match 重新驗證
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def parse_clock_arg(name, default):
+    """解析 HH:MM 查詢參數為自午夜起算的秒數，格式錯誤時回傳 None"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        hour, minute = value.split(':')
+        seconds = int(hour) * 3600 + int(minute) * 60
+    except ValueError:
+        return None
+    return seconds if 0 <= seconds <= 24 * 3600 else None
+
+def format_seconds(seconds):
+    """秒數轉換為 ISO 時間字串（台灣時間）"""
+    return (EPOCH + timedelta(seconds=seconds)).isoformat()
+
+# 重複事件展開器（依系列快取已展開的時間窗，同一系列同一時間窗不重複展開）
+recurrence_expander = RecurrenceExpander(convert=partial(convert_ical_to_event, recurring=True))
+
+# CalDAV 增量同步引擎（探索所有日曆並行同步；保存 ETag 與已解析事件，重新整理時只處理變更）
+caldav_engine = MultiCalendarSync(CALDAV_CONFIG, parse_ical=parse_ical_content)
+
+# 目前的 CalDAV 快照建立時同步引擎的資料版本（同步失敗但已套用部分變更時據此重建快照）
+caldav_snapshot_version = None
+
+def open_persistent_store():
+    """
+    開啟本機儲存（每次同步的變更寫入 SQLite，重新啟動時不需重新下載與解析）
+    
+    只由同步 CalDAV 的行程（standalone、sync）在 create_app() 中開啟；
+    開啟時會設定 WAL 並在日曆來源不同時清除資料，worker 行程不可開啟
+    """
+    if caldav_engine.store is not None or not CALDAV_CONFIG['store_path']:
+        return caldav_engine.store
     try:
-        if not dt_str:
-            return None
-        
-        # 移除時區資訊（簡化處理）
-        if 'T' in dt_str:
-            dt_str = dt_str.split('T')[0] + 'T' + dt_str.split('T')[1].split('Z')[0]
-        
-        # 嘗試解析不同格式
-        formats = [
-            '%Y%m%dT%H%M%S',
-            '%Y%m%d',
-            '%Y-%m-%dT%H:%M:%S',
-            '%Y-%m-%d'
-        ]
-        
-        for fmt in formats:
-            try:
-                return datetime.strptime(dt_str, fmt)
-            except ValueError:
-                continue
-        
+        caldav_engine.store = PersistentStore(CALDAV_CONFIG['store_path'], caldav_engine.source)
+    except sqlite3.Error as e:
+        print(f"⚠️ 無法開啟本機儲存 {CALDAV_CONFIG['store_path']}: {str(e)}，同步結果不會保存")
+    return caldav_engine.store
+
+def window_seconds(window_start, window_end):
+    """時間窗（台灣時間 naive datetime）轉換為秒數"""
+    return int((window_start - EPOCH).total_seconds()), int((window_end - EPOCH).total_seconds())
+
+def publish_caldav_snapshot(readiness, synced_at=None):
+    """以同步引擎目前保存的資源建立快照（沒有事件時不替換，回傳 None）"""
+    global caldav_snapshot_version
+    window_start, window_end = default_event_window()
+    engine_version = caldav_engine.version
+    items = list(caldav_engine.iter_events())
+    events = materialize_events(items, window_start, window_end)
+    if not events:
         return None
-        
-    except Exception as e:
-        print(f"❌ 解析日期時間失敗: {str(e)}")
+    series = [item for item in items if isinstance(item, RecurringSeries)]
+    caldav_snapshot_version = engine_version
+    return publish_snapshot(events, REAL_TEACHERS, 'caldav', readiness, series,
+                            window_seconds(window_start, window_end), synced_at)
+
+def restore_persisted_snapshot():
+    """
+    載入本機儲存的上次同步結果作為啟動時的快照（不連線 CalDAV）
+    
+    第一次同步完成前狀態仍為 warming；同步失敗時繼續使用這份資料（stale），不改用模擬資料
+    """
+    if caldav_engine.store is None:
+        return None
+    started = time.perf_counter()
+    try:
+        count = caldav_engine.restore()
+        saved_at = caldav_engine.store.stats()['saved_at']
+    except sqlite3.Error as e:
+        print(f"⚠️ 載入本機儲存失敗: {str(e)}")
+        return None
+    if not count:
         return None
+    snapshot = publish_caldav_snapshot('warming', datetime.fromtimestamp(saved_at) if saved_at else None)
+    if snapshot is not None:
+        print(f"💾 從本機儲存載入 {count} 個資源、{len(snapshot.events)} 個事件"
+              f"（{(time.perf_counter() - started) * 1000:.0f} ms）")
+    return snapshot
 
-def extract_instructor_from_title(title):
-    """從標題中提取講師名稱"""
-    print(f"🔍 解析標題: {title}")
-    
-    # 檢查是否包含已知講師名稱（不區分大小寫）
-    for teacher in REAL_TEACHERS:
-        teacher_name = teacher['name'].upper()
-        if teacher_name in title.upper():
-            print(f"✅ 找到講師: {teacher['name']}")
-            return teacher['name']
-    
-    # 嘗試從標題中提取講師名稱（如果標題格式是 "講師名稱 課程名稱"）
-    # 這裡可以根據實際的標題格式來調整
-    words = title.split()
-    if len(words) > 0:
-        potential_instructor = words[0].upper()
-        # 檢查是否為已知講師
-        for teacher in REAL_TEACHERS:
-            if teacher['name'].upper() == potential_instructor:
-                print(f"✅ 從標題提取講師: {teacher['name']}")
-                return teacher['name']
-    
-    print(f"⚠️ 未找到講師，使用預設值: UNKNOWN")
-    return 'UNKNOWN'
-
-# 嘗試抓取真實 CalDAV 資料
-caldav_success = fetch_caldav_events()
-
-# 如果 CalDAV 抓取失敗或沒有事件，使用真實格式的模擬資料
-if not caldav_success or len(real_events) == 0:
-    if caldav_success and len(real_events) == 0:
-        print("⚠️ CalDAV 連接成功但沒有事件，使用真實格式的模擬資料")
-    else:
-        print("⚠️ CalDAV 抓取失敗，使用真實格式的模擬資料")
+def sync_caldav():
+    """
+    同步 CalDAV 資料並替換快照
+    
+    資料沒有變更時沿用目前的索引；同步失敗時保留先前的資料（stale，中斷前已套用並保存的部分變更會重建快照），
+    從未成功時改用模擬資料（degraded）
+    """
+    global current_snapshot, warmup_seconds
+    previous = current_snapshot
+    
+    result = fetch_caldav_events()
+    if result is not None:
+        window_start, window_end = default_event_window()
+        window = window_seconds(window_start, window_end)
+        if (not result.changed and not result.removed and previous.data_source == 'caldav'
+                and previous.window == window):
+            print("✅ CalDAV 資料沒有變更")
+            current_snapshot = previous.with_status('ready', datetime.now())
+        elif publish_caldav_snapshot('ready') is not None:
+            print(f"✅ 成功同步 {len(current_snapshot.events)} 個真實事件")
+        else:
+            print("⚠️ CalDAV 連接成功但沒有事件")
+            result = None
+    
+    if result is None:
+        if previous.data_source == 'caldav' and caldav_engine.version != caldav_snapshot_version:
+            print("⚠️ CalDAV 同步失敗，以中斷前已套用的部分變更重建快照")
+            if publish_caldav_snapshot('stale', previous.synced_at) is None:
+                current_snapshot = previous.with_status('stale')
+        elif previous.data_source == 'caldav':
+            print("⚠️ CalDAV 同步失敗，繼續使用先前同步的資料")
+            current_snapshot = previous.with_status('stale')
+        elif previous.data_source == 'mock':
+            current_snapshot = previous.with_status('degraded', datetime.now())
+        else:
+            print("⚠️ CalDAV 同步失敗，使用真實格式的模擬資料")
+            from mock_caldav_data import generate_realistic_caldav_events, generate_realistic_teachers
+            events = [to_event_record(event) for event in generate_realistic_caldav_events()]
+            teachers = generate_realistic_teachers()
+            print(f"✅ 生成 {len(events)} 個真實格式事件")
+            print(f"✅ 生成 {len(teachers)} 位真實講師")
+            publish_snapshot(events, teachers, 'mock', 'degraded')
+    
+    update_search_indexes()
+    export_shared_snapshot()
+    if warmup_seconds is None:
+        warmup_seconds = time.monotonic() - startup_time
+        print(f"🔥 啟動同步完成（{warmup_seconds:.2f} 秒），狀態: {current_snapshot.readiness}")
+    return result is not None
+
+def export_shared_snapshot():
+    """sync 行程：目前的快照寫入共用快照檔（資料與狀態都沒有變更時不重寫）"""
+    snapshot = current_snapshot
+    if snapshot_writer is None or snapshot.data_source == 'none':
+        return
+    try:
+        if snapshot_writer.write(snapshot):
+            stats = snapshot_writer.stats()
+            print(f"🗺️ 共用快照已寫入 v{stats['data_version']}: {len(snapshot.events)} 個事件，"
+                  f"{stats['bytes'] / 1024:,.0f} KiB（{stats['last_write_ms']} ms）")
+    except OSError as e:
+        print(f"⚠️ 寫入共用快照失敗: {str(e)}")
+
+def load_shared_snapshot(force=False):
+    """
+    worker 行程：快照檔已替換時重新 mmap 並替換快照
     
-    from mock_caldav_data import generate_realistic_caldav_events, generate_realistic_teachers
-    real_events = generate_realistic_caldav_events()
-    REAL_TEACHERS = generate_realistic_teachers()
-    print(f"✅ 生成 {len(real_events)} 個真實格式事件")
-    print(f"✅ 生成 {len(REAL_TEACHERS)} 位真實講師")
+    資料版本相同（只有就緒狀態或同步時間變更）時沿用目前的索引，回應快取也不會失效
+    """
+    global current_snapshot
+    mapped = snapshot_reader.poll(force)
+    if mapped is None:
+        return current_snapshot
+    meta = mapped.meta
+    previous = current_snapshot
+    if previous.data_source != 'none' and previous.version == mapped.data_version:
+        current_snapshot = previous.with_status(meta['readiness'], snapshot_synced_at(meta))
+        return current_snapshot
     
-    # 更新模擬資料為真實格式資料
-    mock_events = real_events
-    MOCK_TEACHERS = REAL_TEACHERS
+    started = time.perf_counter()
+    current_snapshot = EventSnapshot.from_index(mapped.data_version, MappedEventIndex(mapped), meta['teachers'],
+                                                meta['data_source'], meta['readiness'],
+                                                synced_at=snapshot_synced_at(meta), previous=previous)
+    print(f"🗺️ 載入共用快照 v{mapped.data_version}: {len(current_snapshot.events)} 個事件"
+          f"（{(time.perf_counter() - started) * 1000:.0f} ms）")
+    return current_snapshot
+
+# 背景同步：啟動後立即同步一次，之後每 refresh_ttl_seconds 秒重新同步；
+# 同步期間請求繼續讀取舊快照，/api/refresh 的並行要求合併為同一次同步
+snapshot_refresher = SnapshotRefresher(sync_caldav, CALDAV_CONFIG['refresh_ttl_seconds'], name='caldav-refresh')
+
+def create_app(role=None):
+    """
+    依執行角色啟動並回傳 Flask app（同一個行程只啟動一次）
+    
+    pre-fork 部署時由一個 sync 行程同步 CalDAV 並寫入共用快照檔，多個 worker 行程讀取同一個檔案，
+    worker 增加時不會增加 CalDAV 請求，事件資料也只在作業系統的頁面快取中保存一份，例如：
+        SERVER_ROLE=sync python3 local_server.py
+        gunicorn -w 8 'local_server:create_app("worker")'
+    
+    Args:
+        role: 'standalone'、'sync' 或 'worker'（None 表示使用 SERVER_CONFIG['role']）
+    """
+    global server_role, snapshot_writer, snapshot_reader
+    role = role or SERVER_CONFIG['role']
+    if role not in SERVER_ROLES:
+        raise ValueError(f"未知的執行角色: {role}（可用: {', '.join(SERVER_ROLES)}）")
+    
+    with server_role_lock:
+        if server_role is not None:
+            if server_role != role:
+                raise ValueError(f"此行程已以 {server_role} 角色啟動")
+            return app
+        
+        if role == 'worker':
+            snapshot_reader = SnapshotFileReader(SERVER_CONFIG['snapshot_file'], SERVER_CONFIG['snapshot_poll_seconds'])
+            if load_shared_snapshot(force=True).data_source == 'none':
+                print(f"⏳ 共用快照 {SERVER_CONFIG['snapshot_file']} 尚未建立，等待 sync 行程寫入")
+        else:
+            if role == 'sync':
+                snapshot_writer = SnapshotFileWriter(SERVER_CONFIG['snapshot_file'])
+            # 先載入本機儲存的資料（只讀取本機檔案，不等待 CalDAV），之後在背景同步
+            open_persistent_store()
+            restore_persisted_snapshot()
+            export_shared_snapshot()
+            snapshot_refresher.start()
+        server_role = role
+    return app
+
+@app.before_request
+def ensure_started():
+    """匯入模組時不連線 CalDAV 也不載入資料，第一個請求（或直接啟動伺服器）時才依角色啟動"""
+    if server_role is None:
+        create_app()
+    elif server_role == 'worker':
+        load_shared_snapshot()
 
 @app.route('/')
 def index():
@@ -384,99 +748,513 @@ def test_frontend():
 def get_teachers():
     """獲取講師列表 API"""
     print(f"[{datetime.now()}] GET /api/teachers")
+    snapshot = current_snapshot
     
-    # 使用真實講師資料
-    teachers = REAL_TEACHERS if caldav_success else MOCK_TEACHERS
+    def build():
+        # 使用真實講師資料
+        teachers = list(snapshot.teachers)
+        
+        response = {
+            "success": True,
+            "teachers": teachers,
+            "cached": False,
+            "data_source": snapshot.data_source
+        }
+        
+        print(f"[{datetime.now()}] 返回 {len(teachers)} 位講師 (資料來源: {snapshot.data_source})")
+        return response
+    
+    return cached_json_response(snapshot, build)
+
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """獲取事件列表 API（可用 start / end 查詢參數指定時間範圍）"""
+    print(f"[{datetime.now()}] GET /api/events")
+    snapshot = current_snapshot
+    
+    start, end, error = parse_range_args()
+    if not error:
+        page, error = parse_page_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    
+    def build():
+        # 使用真實事件資料（分頁時使用依開始時間排序的索引）
+        starts = None
+        if start is None and end is None:
+            if page['limit'] is None:
+                events = snapshot.events
+            else:
+                events, starts = snapshot.index.events, snapshot.index.starts
+        else:
+            events = query_events(start, end, snapshot)
+        
+        response = {
+            "success": True,
+            "data_source": snapshot.data_source
+        }
+        apply_page(response, events, page, starts)
+        if start is not None or end is not None:
+            response["start"] = request.args.get('start')
+            response["end"] = request.args.get('end')
+        
+        print(f"[{datetime.now()}] 返回 {len(response['data'])}/{len(events)} 個事件 (資料來源: {snapshot.data_source})")
+        return response
+    
+    return cached_json_response(snapshot, build)
+
+@app.route('/api/events/today', methods=['GET'])
+def get_today_events():
+    """獲取當日事件 API（可用 instructor 查詢參數指定講師）"""
+    print(f"[{datetime.now()}] GET /api/events/today")
+    snapshot = current_snapshot
+    
+    page, error = parse_page_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    
+    instructor = request.args.get('instructor')
+    today = datetime.now().strftime('%Y-%m-%d')
+    events = snapshot.index.day_events(today, instructor)
     
     response = {
         "success": True,
-        "teachers": teachers,
-        "cached": False,
-        "data_source": "caldav" if caldav_success else "mock"
+        "type": "today",
+        "date": today,
+        "data_source": snapshot.data_source
     }
+    apply_page(response, events, page)
+    if instructor:
+        response["instructor"] = instructor
     
-    print(f"[{datetime.now()}] 返回 {len(teachers)} 位講師 (資料來源: {'CalDAV' if caldav_success else '模擬'})")
+    print(f"[{datetime.now()}] 返回 {today} 的 {len(events)} 個事件")
     return jsonify(response)
 
-@app.route('/api/events', methods=['GET'])
-def get_events():
-    """獲取事件列表 API"""
-    print(f"[{datetime.now()}] GET /api/events")
+@app.route('/api/events/week', methods=['GET'])
+def get_week_events():
+    """獲取本週（週一到週日）事件 API（可用 instructor 查詢參數指定講師）"""
+    print(f"[{datetime.now()}] GET /api/events/week")
+    snapshot = current_snapshot
+    
+    page, error = parse_page_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    
+    instructor = request.args.get('instructor')
+    today = datetime.now()
+    week_start = today - timedelta(days=today.weekday())
+    days = [(week_start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+    events = snapshot.index.days_events(days, instructor)
+    
+    response = {
+        "success": True,
+        "type": "week",
+        "week_start": days[0],
+        "week_end": days[-1],
+        "data_source": snapshot.data_source
+    }
+    apply_page(response, events, page)
+    if instructor:
+        response["instructor"] = instructor
+    
+    print(f"[{datetime.now()}] 返回本週 ({days[0]} ~ {days[-1]}) 的 {len(events)} 個事件")
+    return jsonify(response)
+
+@app.route('/api/events/search', methods=['GET'])
+def search_events():
+    """
+    分面篩選事件 API
+    
+    查詢參數 instructor、course_type、location、weekday、substitute（true/false）、substitute_type
+    可重複或以逗號分隔多個值（同一分面內為 OR，不同分面之間為 AND），另可加 start / end 限定時間範圍；
+    範圍超出預先展開時間窗時，改對即時展開重複事件後的事件建立分面索引
+    """
+    print(f"[{datetime.now()}] GET /api/events/search")
+    snapshot = current_snapshot
+    
+    start, end, error = parse_range_args()
+    if not error:
+        page, error = parse_page_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    
+    filters = {}
+    for facet in FACET_FIELDS:
+        values = [value.strip() for arg in request.args.getlist(facet) for value in arg.split(',') if value.strip()]
+        if values:
+            filters[facet] = values
+    
+    if snapshot.expansion_range(start, end) is None:
+        # 各分面位元圖與時間範圍位元圖整批交集，不逐一掃描事件
+        index = snapshot.index
+        base = index.range_mask(start, end) if start is not None or end is not None else None
+        mask, facet_counts = index.facets.search(filters, base)
+        events = index.facets.select(index.events, mask)
+    else:
+        events = query_events(start, end, snapshot)
+        facets = FacetIndex(events)
+        mask, facet_counts = facets.search(filters)
+        events = facets.select(events, mask)
+    
+    response = {
+        "success": True,
+        "filters": filters,
+        "facets": facet_counts,
+        "data_source": snapshot.data_source
+    }
+    apply_page(response, events, page)
+    if start is not None or end is not None:
+        response["start"] = request.args.get('start')
+        response["end"] = request.args.get('end')
+    
+    print(f"[{datetime.now()}] 分面篩選 {filters} 返回 {len(events)} 個事件")
+    return jsonify(response)
+
+@app.route('/api/events/fulltext', methods=['GET'])
+def fulltext_search_events():
+    """
+    全文搜尋事件 API（標題、描述、地點）
+    
+    q 以空白分隔多個詞（全部都要符合），雙引號內為片語，例如 q=助教:無 "教案:SPIKE"；
+    limit 限制回傳筆數（預設 50）
+    """
+    print(f"[{datetime.now()}] GET /api/events/fulltext")
+    snapshot = current_snapshot
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"success": False, "error": "請提供查詢字串 q"}), 400
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"success": False, "error": "limit 必須是整數"}), 400
     
-    # 使用真實事件資料
-    events = real_events if caldav_success else mock_events
+    results = update_search_indexes(snapshot).fulltext.search(query, limit=max(limit, 0))
+    events = [dict(event.to_dict(), score=score) for score, event in results]
     
     response = {
         "success": True,
         "data": events,
         "total": len(events),
-        "data_source": "caldav" if caldav_success else "mock"
+        "query": query,
+        "data_source": snapshot.data_source
     }
     
-    print(f"[{datetime.now()}] 返回 {len(events)} 個事件 (資料來源: {'CalDAV' if caldav_success else '模擬'})")
+    print(f"[{datetime.now()}] 全文搜尋 '{query}' 返回 {len(events)} 個事件")
     return jsonify(response)
 
+@app.route('/api/events/stream', methods=['GET'])
+def stream_events():
+    """
+    NDJSON 串流匯出 API（每行一個事件）
+    
+    可用 start / end / instructor 篩選；事件逐一序列化後立即送出，不在記憶體中組出完整回應
+    """
+    print(f"[{datetime.now()}] GET /api/events/stream")
+    snapshot = current_snapshot
+    
+    start, end, error = parse_range_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    instructor = request.args.get('instructor')
+    
+    def generate():
+        count = 0
+        for event in iter_query_events(start, end, instructor, snapshot):
+            yield app.json.dumps(event, separators=(',', ':')) + '\n'
+            count += 1
+        print(f"[{datetime.now()}] 串流匯出 {count} 個事件")
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/api/events/<instructor>', methods=['GET'])
 def get_events_by_instructor(instructor):
     """根據講師獲取事件列表 API"""
     print(f"[{datetime.now()}] GET /api/events/{instructor}")
+    snapshot = current_snapshot
+    
+    page, error = parse_page_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    
+    def build():
+        # 由講師索引直接取得，不需掃描所有事件
+        filtered_events = snapshot.index.instructor_events(instructor)
+        
+        response = {
+            "success": True,
+            "instructor": instructor,
+            "data_source": snapshot.data_source
+        }
+        apply_page(response, filtered_events, page)
+        
+        print(f"[{datetime.now()}] 返回講師 {instructor} 的 {len(filtered_events)} 個事件 (資料來源: {snapshot.data_source})")
+        return response
+    
+    return cached_json_response(snapshot, build)
+
+@app.route('/api/conflicts', methods=['GET'])
+def get_conflicts():
+    """
+    排課衝突 API
+    
+    同一講師或同一上課地點時間重疊的事件對，可用 start / end 限定時間範圍、type（instructor / location）限定種類；
+    範圍超出預先展開時間窗時，對即時展開重複事件後的事件重新掃描
+    """
+    print(f"[{datetime.now()}] GET /api/conflicts")
+    snapshot = current_snapshot
+    
+    start, end, error = parse_range_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    conflict_type = request.args.get('type')
+    if conflict_type and conflict_type not in CONFLICT_TYPES:
+        return jsonify({"success": False, "error": f"type 必須是 {' / '.join(CONFLICT_TYPES)}"}), 400
+    
+    if snapshot.expansion_range(start, end) is None:
+        conflicts = update_search_indexes(snapshot).conflicts.conflicts(start, end, conflict_type)
+    else:
+        detector = ConflictDetector()
+        detector.update(query_events(start, end, snapshot))
+        conflicts = detector.conflicts(start, end, conflict_type)
+    for conflict in conflicts:
+        conflict['overlap_start'] = format_seconds(conflict['overlap_start'])
+        conflict['overlap_end'] = format_seconds(conflict['overlap_end'])
+    
+    response = {
+        "success": True,
+        "data": conflicts,
+        "total": len(conflicts),
+        "data_source": snapshot.data_source
+    }
+    
+    print(f"[{datetime.now()}] 返回 {len(conflicts)} 組排課衝突")
+    return jsonify(response)
+
+# 空檔查詢的最大範圍（天）：空檔依講師逐日計算，範圍過大時單一請求會產生大量時段
+MAX_AVAILABILITY_DAYS = 92
+
+@app.route('/api/availability', methods=['GET'])
+def get_availability():
+    """
+    講師空檔 API
+    
+    start / end 指定範圍（預設今天起 7 天，最多 MAX_AVAILABILITY_DAYS 天），
+    day_start / day_end 指定每天營業時間（HH:MM，預設 08:00-22:00），instructor 可重複或以逗號分隔指定講師
+    """
+    print(f"[{datetime.now()}] GET /api/availability")
+    snapshot = current_snapshot
+    
+    start, end, error = parse_range_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    day_start = parse_clock_arg('day_start', BUSINESS_START)
+    day_end = parse_clock_arg('day_end', BUSINESS_END)
+    if day_start is None or day_end is None or day_start >= day_end:
+        return jsonify({"success": False, "error": "營業時間格式錯誤，請使用 HH:MM 且 day_start 必須早於 day_end"}), 400
+    
+    if start is None:
+        start = parse_event_time(datetime.now().strftime('%Y-%m-%d'))
+    if end is None:
+        end = start + 7 * 86400
+    if start >= end:
+        return jsonify({"success": False, "error": "start 必須早於 end"}), 400
+    if end - start > MAX_AVAILABILITY_DAYS * 86400:
+        return jsonify({"success": False, "error": f"查詢範圍最多 {MAX_AVAILABILITY_DAYS} 天"}), 400
+    instructors = [name.strip() for arg in request.args.getlist('instructor') for name in arg.split(',') if name.strip()]
+    
+    slots = availability_index(start, end, snapshot).free_slots(start, end, instructors or None, day_start, day_end)
+    data = {
+        name: [{"start": format_seconds(slot_start), "end": format_seconds(slot_end)} for slot_start, slot_end in free]
+        for name, free in slots.items()
+    }
+    
+    response = {
+        "success": True,
+        "data": data,
+        "start": format_seconds(start),
+        "end": format_seconds(end),
+        "data_source": snapshot.data_source
+    }
+    
+    print(f"[{datetime.now()}] 返回 {len(data)} 位講師的空檔")
+    return jsonify(response)
+
+@app.route('/api/availability/candidates', methods=['GET'])
+def get_substitute_candidates():
+    """
+    代課候選講師 API
+    
+    start / end 指定需要代課的時段（必填），exclude 為請假的講師；
+    依衝突時間、當天課程負擔、過去替該講師代課次數與前後課程間隔排序
+    """
+    print(f"[{datetime.now()}] GET /api/availability/candidates")
+    snapshot = current_snapshot
+    
+    start, end, error = parse_range_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    if start is None or end is None:
+        return jsonify({"success": False, "error": "請提供 start 與 end"}), 400
+    
+    exclude = request.args.get('exclude')
+    # 當天課程負擔與前後間隔會查到時段前後各一天
+    day = start - start % SECONDS_PER_DAY
+    availability = availability_index(day - SECONDS_PER_DAY, end - end % SECONDS_PER_DAY + 2 * SECONDS_PER_DAY,
+                                      snapshot)
+    candidates = availability.candidates(start, end, exclude)
+    
+    response = {
+        "success": True,
+        "data": candidates,
+        "total": len(candidates),
+        "available": sum(1 for candidate in candidates if candidate['available']),
+        "start": format_seconds(start),
+        "end": format_seconds(end),
+        "data_source": snapshot.data_source
+    }
+    if exclude:
+        response["exclude"] = exclude
+    
+    print(f"[{datetime.now()}] 返回 {len(candidates)} 位候選講師（{response['available']} 位有空）")
+    return jsonify(response)
+
+@app.route('/api/analytics', methods=['GET'])
+def get_analytics():
+    """
+    授課統計 API
+    
+    統計 start / end 範圍內開始的事件：各講師每週或每月授課時數（period=week / month，預設 month）、
+    代課比例、各地點使用率（營業時間 day_start / day_end，HH:MM）、課程類型數量與尖峰時段分布；
+    範圍超出預先展開時間窗時（例如上個月的月結），以即時展開重複事件後的事件統計
+    """
+    print(f"[{datetime.now()}] GET /api/analytics")
+    snapshot = current_snapshot
     
-    # 使用真實事件資料
-    events = real_events if caldav_success else mock_events
-    filtered_events = [event for event in events if event['instructor'] == instructor]
+    start, end, error = parse_range_args()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    period = request.args.get('period', 'month')
+    if period not in PERIODS:
+        return jsonify({"success": False, "error": f"period 必須是 {' / '.join(PERIODS)}"}), 400
+    day_start = parse_clock_arg('day_start', BUSINESS_START)
+    day_end = parse_clock_arg('day_end', BUSINESS_END)
+    if day_start is None or day_end is None or day_start >= day_end:
+        return jsonify({"success": False, "error": "營業時間格式錯誤，請使用 HH:MM 且 day_start 必須早於 day_end"}), 400
+    
+    columns = snapshot.columns
+    if snapshot.expansion_range(start, end) is not None:
+        columns = EventColumns(EventIndex(query_events(start, end, snapshot)))
+    report = columns.report(start, end, period, day_start, day_end)
     
     response = {
         "success": True,
-        "data": filtered_events,
-        "total": len(filtered_events),
-        "instructor": instructor,
-        "data_source": "caldav" if caldav_success else "mock"
+        "data": report,
+        "data_source": snapshot.data_source
     }
+    if start is not None or end is not None:
+        response["start"] = request.args.get('start')
+        response["end"] = request.args.get('end')
     
-    print(f"[{datetime.now()}] 返回講師 {instructor} 的 {len(filtered_events)} 個事件 (資料來源: {'CalDAV' if caldav_success else '模擬'})")
+    print(f"[{datetime.now()}] 統計 {report['events']} 個事件（{report['engine']}）")
     return jsonify(response)
 
+# 呼叫 /api/refresh 時最多等待同步完成的秒數（逾時仍在背景繼續同步）
+REFRESH_WAIT_SECONDS = 30
+
+def caldav_status(readiness):
+    """就緒狀態對應的 CalDAV 狀態"""
+    return {'ready': 'success', 'warming': 'pending'}.get(readiness, 'failed')
+
+@app.route('/api/refresh', methods=['POST'])
+def refresh_events():
+    """
+    立即重新同步 CalDAV 資料 API
+    
+    已有同步進行中時不另外發出請求，等待進行中的同步完成；加 ?wait=false 時不等待直接回傳
+    """
+    print(f"[{datetime.now()}] POST /api/refresh")
+    if server_role == 'worker':
+        return jsonify({"success": False, "error": "worker 行程不同步 CalDAV，請對 sync 行程呼叫 /api/refresh"}), 409
+    
+    wait = request.args.get('wait', 'true').lower() != 'false'
+    result = snapshot_refresher.refresh(wait=wait, timeout=REFRESH_WAIT_SECONDS)
+    snapshot = current_snapshot
+    
+    response = {
+        "success": True,
+        "refresh": result,
+        "readiness": snapshot.readiness,
+        "version": snapshot.version,
+        "events_count": len(snapshot.events),
+        "data_source": snapshot.data_source
+    }
+    
+    print(f"[{datetime.now()}] 重新同步{'（合併到進行中的同步）' if result['coalesced'] else ''}: {snapshot.readiness}")
+    return jsonify(response), 200 if result['completed'] else 202
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康檢查 API"""
-    # 使用真實資料
-    events = real_events if caldav_success else mock_events
-    teachers = REAL_TEACHERS if caldav_success else MOCK_TEACHERS
+    snapshot = current_snapshot
     
     return jsonify({
         "status": "healthy",
+        "role": server_role,
+        "readiness": snapshot.readiness,
         "timestamp": datetime.now().isoformat(),
-        "events_count": len(events),
-        "teachers_count": len(teachers),
-        "data_source": "caldav" if caldav_success else "mock",
-        "caldav_status": "success" if caldav_success else "failed"
+        "uptime_seconds": round(time.monotonic() - startup_time, 3),
+        "warmup_seconds": round(warmup_seconds, 3) if warmup_seconds is not None else None,
+        "last_sync": snapshot.synced_at.isoformat() if snapshot.synced_at else None,
+        "data_version": snapshot.version,
+        "events_count": len(snapshot.events),
+        "teachers_count": len(snapshot.teachers),
+        "data_source": snapshot.data_source,
+        "caldav_status": caldav_status(snapshot.readiness)
     })
 
 @app.route('/api/debug', methods=['GET'])
 def debug_info():
     """調試信息 API"""
-    # 使用真實資料
-    events = real_events if caldav_success else mock_events
-    teachers = REAL_TEACHERS if caldav_success else MOCK_TEACHERS
+    snapshot = current_snapshot
+    teachers = list(snapshot.teachers)
     
     return jsonify({
         "server": "local-flask-server",
+        "readiness": snapshot.readiness,
         "version": "1.0.0",
         "timestamp": datetime.now().isoformat(),
-        "data_source": "caldav" if caldav_success else "mock",
-        "caldav_status": "success" if caldav_success else "failed",
+        "data_source": snapshot.data_source,
+        "caldav_status": caldav_status(snapshot.readiness),
         "events": {
-            "total": len(events),
-            "by_instructor": {
-                instructor: len([e for e in events if e['instructor'] == instructor])
-                for instructor in set(e['instructor'] for e in events)
-            }
+            "total": len(snapshot.events),
+            "by_instructor": snapshot.index.instructor_counts(),
+            "days": len(snapshot.index.by_day)
         },
         "teachers": teachers,
+        "role": server_role,
+        "refresher": snapshot_refresher.stats(),
+        "shared_snapshot": (snapshot_writer or snapshot_reader).stats() if server_role in ('sync', 'worker') else None,
+        "recurrence_cache": recurrence_expander.stats(),
+        "instructor_matcher_cache": get_instructor_matcher(teachers).cache_info(),
+        "fulltext_index": snapshot.search.fulltext.stats() if snapshot.search.built else None,
+        "response_cache": response_cache.stats(),
+        "persistent_store": caldav_engine.store.stats() if caldav_engine.store is not None else None,
+        "calendars": caldav_engine.stats(),
         "caldav_config": {
             "url": CALDAV_CONFIG['url'],
             "username": CALDAV_CONFIG['username'],
-            "calendar_path": CALDAV_CONFIG['calendar_path']
+            "calendar_path": CALDAV_CONFIG['calendar_path'],
+            "fetch_mode": CALDAV_CONFIG['fetch_mode'],
+            "window_past_days": CALDAV_CONFIG['window_past_days'],
+            "window_future_days": CALDAV_CONFIG['window_future_days'],
+            "summary_filter": CALDAV_CONFIG['summary_filter'],
+            "discover_calendars": CALDAV_CONFIG['discover_calendars'],
+            "discovery_ttl_seconds": CALDAV_CONFIG['discovery_ttl_seconds'],
+            "max_concurrent_fetches": CALDAV_CONFIG['max_concurrent_fetches'],
+            "refresh_ttl_seconds": CALDAV_CONFIG['refresh_ttl_seconds'],
+            "store_path": CALDAV_CONFIG['store_path'],
+            "snapshot_file": SERVER_CONFIG['snapshot_file']
         }
     })
 
@@ -499,17 +1277,17 @@ def internal_error(error):
     }), 500
 
 if __name__ == '__main__':
-    print("🚀 啟動本地 Flask 伺服器...")
+    print(f"🚀 啟動本地 Flask 伺服器（角色: {SERVER_CONFIG['role']}）...")
     
-    # 顯示資料來源資訊
-    if caldav_success:
-        print(f"✅ 成功載入 {len(real_events)} 個真實 CalDAV 事件")
-        print(f"👥 載入 {len(REAL_TEACHERS)} 位真實講師")
-        print("📡 資料來源: CalDAV (iCloud)")
+    # 第一次 CalDAV 同步在背景進行，伺服器立即開始接受請求
+    create_app()
+    if server_role == 'worker':
+        print(f"🗺️ 讀取共用快照 {SERVER_CONFIG['snapshot_file']}，每 {SERVER_CONFIG['snapshot_poll_seconds']} 秒檢查是否更新")
     else:
-        print(f"⚠️ CalDAV 抓取失敗，載入 {len(mock_events)} 個模擬事件")
-        print(f"👥 載入 {len(MOCK_TEACHERS)} 位模擬講師")
-        print("📡 資料來源: 模擬資料")
+        print("📡 CalDAV 資料於背景同步中（完成前 /api/health 的 readiness 為 warming）")
+        print(f"🔁 每 {CALDAV_CONFIG['refresh_ttl_seconds']} 秒重新同步，可呼叫 POST /api/refresh 立即更新")
+        if server_role == 'sync':
+            print(f"🗺️ 每次同步後寫入共用快照 {SERVER_CONFIG['snapshot_file']}")
     
     print("🌐 伺服器將在 http://localhost:5001 啟動")
     print("📅 行事曆頁面: http://localhost:5001/perfect-calendar.html")
@@ -521,5 +1299,8 @@ if __name__ == '__main__':
         host='0.0.0.0',
         port=5001,
         debug=True,
+        # 重新載入器會另外啟動一個子行程再執行一次 create_app()，兩個行程各自定期同步 CalDAV、
+        # 寫入同一個本機儲存與共用快照檔；背景同步只能有一份，因此不使用重新載入器
+        use_reloader=False,
         threaded=True
     )
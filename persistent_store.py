@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalDAV 同步狀態的本機儲存（SQLite，WAL 模式）
+保存每個日曆集合的 sync-token，以及每個資源的 ETag、UID、已解析的事件（含標題拆解出的欄位），
+重新啟動時直接載入，不需重新下載與解析；之後的同步只處理自上次以來的變更。
+含重複事件系列的資源保存原始 iCal 內容，載入時重新解析（系列需依時間窗展開）
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from event_store import EventRecord, RECORD_FIELDS
+
+# 資料表結構或事件欄位的解析方式變更時遞增，舊的儲存內容會被清除並重新完整同步
+STORE_SCHEMA_VERSION = 2
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS collections (
+    url TEXT PRIMARY KEY,
+    sync_token TEXT
+);
+CREATE TABLE IF NOT EXISTS resources (
+    href TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    calendar_data TEXT
+);
+CREATE INDEX IF NOT EXISTS resources_collection ON resources (collection);
+CREATE TABLE IF NOT EXISTS events (
+    href TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    {', '.join(f'{field} {"INTEGER" if field in ("start_ts", "end_ts", "recurring", "week_number") else "TEXT"}'
+               for field in RECORD_FIELDS)},
+    PRIMARY KEY (href, position)
+);
+CREATE INDEX IF NOT EXISTS events_uid ON events (uid);
+'''
+
+INSERT_EVENT = f"INSERT INTO events VALUES ({', '.join('?' * (len(RECORD_FIELDS) + 2))})"
+SELECT_EVENTS = (f"SELECT events.href, {', '.join('events.' + field for field in RECORD_FIELDS)} "
+                 "FROM events JOIN resources ON resources.href = events.href "
+                 "WHERE resources.collection = ? ORDER BY events.href, events.position")
+TABLES = ('events', 'resources', 'collections', 'meta')
+
+
+class PersistentStore:
+    """
+    CalDAV 資源與事件的本機儲存
+
+    source 為日曆來源的識別字串（URL、同步模式、篩選條件），
+    與已保存的來源不同時清除舊資料，避免混入其他日曆的事件；
+    同一來源可包含多個日曆集合，各自保存資源與 sync-token
+    """
+
+    def __init__(self, path: str, source: str = ''):
+        """
+        Args:
+            path: SQLite 檔案路徑
+            source: 日曆來源識別字串
+        """
+        self.path = path
+        self.source = source
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL：背景同步寫入時不阻擋讀取；WAL 模式下 synchronous=NORMAL 斷電也不會損毀資料庫
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+        meta = dict(self._conn.execute('SELECT key, value FROM meta'))
+        if meta.get('schema_version') != str(STORE_SCHEMA_VERSION) or meta.get('source') != source:
+            if meta:
+                print("⚠️ 本機儲存的格式或日曆來源已變更，清除後重新完整同步")
+            # 舊格式的資料表欄位可能不同，整個重建
+            with self._transaction():
+                for table in TABLES:
+                    self._conn.execute(f'DROP TABLE IF EXISTS {table}')
+            self._conn.executescript(SCHEMA)
+            with self._transaction():
+                self._conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+                    ('schema_version', str(STORE_SCHEMA_VERSION)), ('source', source)])
+        else:
+            self._conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN / COMMIT（發生例外時 ROLLBACK）"""
+        self._conn.execute('BEGIN')
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def load(self, parse_ical: Callable[[str], List],
+             collection: str) -> Tuple[Dict[str, Tuple[str, str, List]], Optional[str]]:
+        """
+        載入一個日曆集合已保存的資源
+
+        Args:
+            parse_ical: 解析含重複事件系列資源的原始 iCal 內容
+            collection: 日曆集合 URL
+
+        Returns:
+            ({href: (etag, uid, 事件列表)}, sync_token)
+        """
+        with self._lock:
+            resources = {}
+            raw = []
+            for href, etag, uid, calendar_data in self._conn.execute(
+                    'SELECT href, etag, uid, calendar_data FROM resources WHERE collection = ?', (collection,)):
+                if calendar_data is None:
+                    resources[href] = (etag, uid, [])
+                else:
+                    raw.append((href, etag, uid, calendar_data))
+
+            from_row = EventRecord.from_row
+            for row in self._conn.execute(SELECT_EVENTS, (collection,)):
+                resource = resources.get(row[0])
+                if resource is not None:
+                    resource[2].append(from_row(row[1:]))
+
+            token = self._conn.execute('SELECT sync_token FROM collections WHERE url = ?', (collection,)).fetchone()
+
+        for href, etag, uid, calendar_data in raw:
+            resources[href] = (etag, uid, parse_ical(calendar_data))
+        return resources, token[0] if token else None
+
+    def save(self, stored: Iterable[Tuple[str, str, str, List, Optional[str]]], removed: Iterable[str],
+             sync_token: Optional[str], collection: str) -> None:
+        """
+        在同一個交易中寫入一個日曆集合一次同步的變更
+
+        Args:
+            stored: [(href, etag, uid, 事件列表, 原始 iCal 內容)]；事件全部為 EventRecord 時只保存事件，
+                    含重複事件系列時保存原始內容
+            removed: 已刪除的 href
+            sync_token: 目前的 sync-token（None 表示沒有）
+            collection: 日曆集合 URL
+        """
+        with self._lock, self._transaction():
+            conn = self._conn
+            for href in removed:
+                conn.execute('DELETE FROM events WHERE href = ?', (href,))
+                conn.execute('DELETE FROM resources WHERE href = ?', (href,))
+
+            for href, etag, uid, events, calendar_data in stored:
+                conn.execute('DELETE FROM events WHERE href = ?', (href,))
+                if all(isinstance(event, EventRecord) for event in events):
+                    calendar_data = None
+                    conn.executemany(INSERT_EVENT, [(href, position) + event.to_row()
+                                                    for position, event in enumerate(events)])
+                conn.execute('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)',
+                             (href, collection, etag, uid, calendar_data))
+
+            conn.execute('INSERT OR REPLACE INTO collections VALUES (?, ?)', (collection, sync_token))
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('saved_at', ?)", (str(time.time()),))
+
+    def collections(self) -> List[str]:
+        """已保存的日曆集合 URL"""
+        with self._lock:
+            return [url for url, in self._conn.execute('SELECT url FROM collections ORDER BY url')]
+
+    def drop_collection(self, collection: str) -> None:
+        """刪除一個日曆集合的所有資料（日曆已不存在時）"""
+        with self._lock, self._transaction():
+            conn = self._conn
+            conn.execute('DELETE FROM events WHERE href IN (SELECT href FROM resources WHERE collection = ?)',
+                         (collection,))
+            conn.execute('DELETE FROM resources WHERE collection = ?', (collection,))
+            conn.execute('DELETE FROM collections WHERE url = ?', (collection,))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            collections = self._conn.execute('SELECT COUNT(*) FROM collections').fetchone()[0]
+            resources = self._conn.execute('SELECT COUNT(*) FROM resources').fetchone()[0]
+            events = self._conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+            saved_at = self._conn.execute("SELECT value FROM meta WHERE key = 'saved_at'").fetchone()
+        return {
+            'path': self.path,
+            'collections': collections,
+            'resources': resources,
+            'events': events,
+            'saved_at': float(saved_at[0]) if saved_at else None
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 回應快取
+依資料版本保存序列化後的 JSON 回應，資料未變更時重複的請求不再重新序列化；
+ETag 由回應內容計算，客戶端帶 If-None-Match 時可直接回傳 304。
+壓縮版本（gzip，有安裝 brotli 時另有 br）在第一次被要求時產生並保存，之後直接回傳
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # 未安裝 brotli 時只提供 gzip
+    brotli = None
+
+# 小於此大小的回應不壓縮
+COMPRESSION_MIN_SIZE = 1024
+# 每個版本只壓縮一次，可使用較高的壓縮等級
+# （brotli 10 以上的等級在數 MB 的回應上需要數秒，第一個請求等待太久）
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# 依偏好順序排列的可用編碼
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+ENCODING_SUFFIXES = {'br': 'br', 'gzip': 'gz'}
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """以指定編碼壓縮（gzip 不寫入時間戳記，相同內容產生相同位元組）"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """還原 compress() 的結果"""
+    if encoding == 'br':
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+class CachedResponse:
+    """序列化後的回應內容、ETag 與已產生的壓縮版本"""
+
+    __slots__ = ('body', 'etag', '_encoded')
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self._encoded = {}
+
+    def representation(self, encoding: Optional[str]) -> Tuple[bytes, str]:
+        """
+        取得指定編碼的內容與 ETag（每種編碼的位元組不同，ETag 加上編碼後綴）
+
+        壓縮結果保存在物件中，同一版本的回應只壓縮一次
+        """
+        if encoding is None or len(self.body) < COMPRESSION_MIN_SIZE:
+            return self.body, self.etag
+        data = self._encoded.get(encoding)
+        if data is None:
+            # 多個請求同時壓縮時結果相同，後寫入者覆蓋即可
+            data = compress(self.body, encoding)
+            self._encoded[encoding] = data
+        return data, f"{self.etag}-{ENCODING_SUFFIXES[encoding]}"
+
+    def encoded_sizes(self) -> Dict[str, int]:
+        return {encoding: len(data) for encoding, data in self._encoded.items()}
+
+
+class ResponseCache:
+    """
+    依資料版本與請求鍵（路徑、查詢參數）保存回應
+
+    資料版本變更時整批清除；同一版本內最多保留 max_entries 個回應（LRU）
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version: Hashable, key: Hashable, build: Callable[[], bytes]) -> CachedResponse:
+        """
+        取得回應（快取中沒有時呼叫 build 產生序列化內容）
+
+        Args:
+            version: 資料版本
+            key: 請求鍵
+            build: 產生回應內容（bytes）的函數
+        """
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        # 序列化不持有鎖，避免大型回應阻擋其他請求
+        entry = CachedResponse(build())
+        with self._lock:
+            self.misses += 1
+            if version == self.version:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            'version': self.version,
+            'entries': len(entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'encodings': list(ENCODINGS),
+            'bytes': sum(len(entry.body) for entry in entries),
+            'compressed_bytes': sum(sum(entry.encoded_sizes().values()) for entry in entries)
+        }
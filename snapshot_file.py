@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共用快照檔
+由負責同步的行程將快照寫成精簡的二進位檔（固定寬度欄位 + 字串表 + 預先建立的索引），
+多個 worker 行程以 mmap 直接讀取同一個檔案：欄位不複製成 Python 物件，
+只在回應需要時才組成事件紀錄，各行程共用作業系統的頁面快取。
+
+檔案格式（原生位元組順序，只在同一台主機上交換）：
+    標頭      magic、格式版本、區段數、資料版本
+    區段目錄  每個區段的名稱、array 型別代碼、位移（8 位元組對齊）、項目數
+    區段      starts / ends / max_ends / end_ts（q）、字串欄位（I，字串表序號）、week_number（i）、recurring（B）、
+              strings.offsets / strings.data（字串表）、group.*（講師、日期索引）、facet.*（分面位元圖）、
+              meta（JSON：講師列表、資料來源、就緒狀態、同步時間）
+
+寫入時先寫暫存檔再替換，已 mmap 舊檔的行程繼續讀取舊內容，不會讀到寫到一半的檔案
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from event_index import EventIndex
+from event_store import EventRecord, RECORD_FIELDS
+from facet_index import FACET_FIELDS, FacetIndex
+
+MAGIC = b'FLBSNAP\0'
+# 檔案格式變更時遞增，讀取端拒絕載入不同格式的檔案
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('=8sIIQ')
+SECTION = struct.Struct('=32s4sQQ')
+
+# 字串欄位以字串表序號保存，None 以 NO_STRING 表示
+STRING_FIELDS = tuple(field for field in RECORD_FIELDS
+                      if field not in ('start_ts', 'end_ts', 'recurring', 'week_number'))
+NO_STRING = 0xFFFFFFFF
+NO_WEEK = -2 ** 31
+
+# 預先建立的雜湊索引（名稱 -> 鍵的欄位數）
+GROUPS = {'instructor': 1, 'day': 1, 'instructor_day': 2}
+
+
+class SnapshotFormatError(ValueError):
+    """快照檔格式不符（不是快照檔、格式版本不同或內容不完整）"""
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class _StringTable:
+    """不重複的字串依加入順序編號，序號對應 UTF-8 位元組的位置"""
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array('I', [0])
+        self.data = bytearray()
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = self.ids[value] = len(self.offsets) - 1
+            self.data += value.encode('utf-8')
+            self.offsets.append(len(self.data))
+        return sid
+
+
+def encode_sections(snapshot) -> List[Tuple[str, str, object]]:
+    """
+    快照轉換為區段列表
+
+    Args:
+        snapshot: EventSnapshot（使用其中的 EventIndex 與各事件欄位）
+
+    Returns:
+        [(區段名稱, array 型別代碼, array 或 bytes)]
+    """
+    index = snapshot.index
+    events = index.events
+    strings = _StringTable()
+    sections = [
+        ('starts', 'q', array('q', index.starts)),
+        ('ends', 'q', array('q', index.ends)),
+        ('max_ends', 'q', array('q', index.max_ends)),
+        ('end_ts', 'q', array('q', [event.end_ts if isinstance(event, EventRecord) else end
+                                    for event, end in zip(events, index.ends)])),
+        ('week_number', 'i', array('i', [NO_WEEK if value is None else value
+                                         for value in (event.get('week_number') for event in events)])),
+        ('recurring', 'B', array('B', [1 if event.get('recurring') else 0 for event in events])),
+    ]
+    for field in STRING_FIELDS:
+        sections.append((field, 'I', array('I', [strings.add(event.get(field)) for event in events])))
+
+    positions = {id(event): i for i, event in enumerate(events)}
+    for name, groups in (('instructor', {(key,): value for key, value in index.by_instructor.items()}),
+                         ('day', {(key,): value for key, value in index.by_day.items()}),
+                         ('instructor_day', index.by_instructor_day)):
+        keys = array('I')
+        offsets = array('I', [0])
+        members = array('I')
+        for key, group in groups.items():
+            keys.extend(strings.add(part) for part in key)
+            members.extend(positions[id(event)] for event in group)
+            offsets.append(len(members))
+        sections.extend([(f'group.{name}.keys', 'I', keys), (f'group.{name}.offsets', 'I', offsets),
+                         (f'group.{name}.positions', 'I', members)])
+
+    width = (len(events) + 7) // 8
+    for facet, bitmaps in index.facets.bitmaps.items():
+        sections.append((f'facet.{facet}.values', 'I', array('I', [strings.add(value) for value in bitmaps])))
+        sections.append((f'facet.{facet}.bitmaps', 'B',
+                         b''.join(bitmap.to_bytes(width, 'little') for bitmap in bitmaps.values())))
+
+    meta = {
+        'teachers': list(snapshot.teachers),
+        'data_source': snapshot.data_source,
+        'readiness': snapshot.readiness,
+        'synced_at': snapshot.synced_at.isoformat() if snapshot.synced_at else None,
+        'size': len(events)
+    }
+    sections.extend([
+        ('strings.offsets', 'I', strings.offsets),
+        ('strings.data', 'B', bytes(strings.data)),
+        ('meta', 'B', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+    ])
+    return sections
+
+
+def write_snapshot(path: str, snapshot, data_version: int) -> int:
+    """
+    寫入快照檔（寫入同目錄的暫存檔後替換）
+
+    Args:
+        path: 快照檔路徑
+        snapshot: EventSnapshot
+        data_version: 寫入標頭的資料版本
+
+    Returns:
+        檔案大小（位元組）
+    """
+    sections = encode_sections(snapshot)
+    table = []
+    payloads = []
+    offset = _align(HEADER.size + SECTION.size * len(sections))
+    for name, typecode, values in sections:
+        data = values.tobytes() if isinstance(values, array) else values
+        table.append(SECTION.pack(name.encode('ascii'), typecode.encode('ascii'), offset, len(values)))
+        payloads.append((offset, data))
+        offset = _align(offset + len(data))
+
+    fd, temp_path = tempfile.mkstemp(prefix='.snapshot-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), data_version))
+            f.write(b''.join(table))
+            for position, data in payloads:
+                f.seek(position)
+                f.write(data)
+            f.truncate(offset)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return offset
+
+
+def read_data_version(path: str) -> Optional[int]:
+    """讀取快照檔標頭的資料版本（檔案不存在或格式不符時回傳 None）"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, format_version, _, data_version = HEADER.unpack(header)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        return None
+    return data_version
+
+
+class MappedSnapshotFile:
+    """
+    以 mmap 開啟的快照檔
+
+    各區段為直接指向對應記憶體的 memoryview（不複製），
+    檔案在其他行程被替換後，已開啟的對應仍讀取原本的內容
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.size = stat.st_size
+
+        view = memoryview(self._mmap)
+        if self.size < HEADER.size:
+            raise SnapshotFormatError(f'{path} 不是快照檔')
+        magic, format_version, count, self.data_version = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotFormatError(f'{path} 不是快照檔')
+        if format_version != FORMAT_VERSION:
+            raise SnapshotFormatError(f'{path} 的格式版本 {format_version} 與目前的 {FORMAT_VERSION} 不同')
+
+        self.sections = {}
+        for i in range(count):
+            name, typecode, offset, length = SECTION.unpack_from(view, HEADER.size + SECTION.size * i)
+            typecode = typecode.rstrip(b'\0').decode('ascii')
+            end = offset + length * array(typecode).itemsize
+            if end > self.size:
+                raise SnapshotFormatError(f'{path} 內容不完整')
+            self.sections[name.rstrip(b'\0').decode('ascii')] = view[offset:end].cast(typecode)
+
+        self.meta = json.loads(str(self.sections['meta'], 'utf-8'))
+        self._string_offsets = self.sections['strings.offsets']
+        self._string_data = self.sections['strings.data']
+        self._string_columns = tuple(self.sections[field] for field in STRING_FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.sections['starts'])
+
+    def string(self, sid: int) -> Optional[str]:
+        """字串表中的字串（直接由對應的記憶體解碼）"""
+        if sid == NO_STRING:
+            return None
+        offsets = self._string_offsets
+        return str(self._string_data[offsets[sid]:offsets[sid + 1]], 'utf-8')
+
+    def record(self, position: int) -> EventRecord:
+        """組成第 position 個事件的紀錄（每次呼叫都建立新的物件，用完即釋放）"""
+        offsets = self._string_offsets
+        data = self._string_data
+        values = []
+        for column in self._string_columns:
+            sid = column[position]
+            values.append(None if sid == NO_STRING else str(data[offsets[sid]:offsets[sid + 1]], 'utf-8'))
+        (uid, title, instructor, location, description, course_type, weekday, time_range, course_location,
+         substitute_type, original_instructor) = values
+        sections = self.sections
+        week_number = sections['week_number'][position]
+        return EventRecord.from_row((
+            uid, title, instructor, sections['starts'][position], sections['end_ts'][position], location,
+            description, sections['recurring'][position], course_type, weekday, time_range, course_location,
+            None if week_number == NO_WEEK else week_number, substitute_type, original_instructor))
+
+    def column(self, field: str) -> List:
+        """所有事件的字串欄位值（相同的字串只解碼一次）"""
+        decoded = {}
+        string = self.string
+        values = []
+        for sid in self.sections[field]:
+            value = decoded.get(sid, decoded)
+            if value is decoded:
+                value = decoded[sid] = string(sid)
+            values.append(value)
+        return values
+
+    def groups(self, name: str) -> Dict:
+        """預先建立的雜湊索引：{鍵: 分組序號}（以 group_positions() 取得分組內的事件位置）"""
+        arity = GROUPS[name]
+        keys = self.sections[f'group.{name}.keys']
+        decoded = {}
+        groups = {}
+        for i in range(len(keys) // arity):
+            key = []
+            for sid in keys[i * arity:(i + 1) * arity]:
+                value = decoded.get(sid, decoded)
+                if value is decoded:
+                    value = decoded[sid] = self.string(sid)
+                key.append(value)
+            groups[key[0] if arity == 1 else tuple(key)] = i
+        return groups
+
+    def group_positions(self, name: str, group: Optional[int]):
+        """分組內的事件位置（memoryview；group 為 None 時回傳空的序列）"""
+        if group is None:
+            return ()
+        offsets = self.sections[f'group.{name}.offsets']
+        return self.sections[f'group.{name}.positions'][offsets[group]:offsets[group + 1]]
+
+    def facet_bitmaps(self) -> Dict[str, Dict[str, int]]:
+        """分面位元圖"""
+        width = (len(self) + 7) // 8
+        bitmaps = {}
+        for facet in FACET_FIELDS:
+            values = self.sections[f'facet.{facet}.values']
+            data = self.sections[f'facet.{facet}.bitmaps']
+            bitmaps[facet] = {self.string(sid): int.from_bytes(data[i * width:(i + 1) * width], 'little')
+                              for i, sid in enumerate(values)}
+        return bitmaps
+
+
+class MappedEvents:
+    """
+    快照檔中的事件序列（全部事件，或依 positions 指定的部分事件）
+
+    與事件列表一樣支援 len()、索引、切片與迭代；取出的事件在當下才組成 EventRecord
+    """
+
+    __slots__ = ('file', 'positions')
+
+    def __init__(self, file: MappedSnapshotFile, positions=None):
+        self.file = file
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return len(self.file) if self.positions is None else len(self.positions)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        return self.file.record(item if self.positions is None else self.positions[item])
+
+    def __iter__(self):
+        record = self.file.record
+        return (record(position) for position in (range(len(self.file)) if self.positions is None
+                                                  else self.positions))
+
+
+class MappedEventIndex(EventIndex):
+    """
+    以快照檔建立的事件索引（與 EventIndex 相同的介面）
+
+    starts / ends / max_ends 為 mmap 上的欄位；by_instructor / by_day / by_instructor_day 對應到分組序號，
+    查詢時才取出分組內的事件位置；分面位元圖由檔案載入
+    """
+
+    def __init__(self, file: MappedSnapshotFile):
+        self.file = file
+        self.events = MappedEvents(file)
+        self.starts = file.sections['starts']
+        self.ends = file.sections['ends']
+        self.max_ends = file.sections['max_ends']
+        self.by_instructor = file.groups('instructor')
+        self.by_day = file.groups('day')
+        self.by_instructor_day = file.groups('instructor_day')
+        self.facets = FacetIndex.from_bitmaps(len(file), file.facet_bitmaps())
+
+    def instructor_events(self, instructor: str) -> MappedEvents:
+        return MappedEvents(self.file, self.file.group_positions('instructor', self.by_instructor.get(instructor)))
+
+    def day_events(self, day: str, instructor: Optional[str] = None) -> MappedEvents:
+        if instructor is None:
+            return MappedEvents(self.file, self.file.group_positions('day', self.by_day.get(day)))
+        return MappedEvents(self.file, self.file.group_positions(
+            'instructor_day', self.by_instructor_day.get((instructor, day))))
+
+    def days_events(self, days: List[str], instructor: Optional[str] = None) -> MappedEvents:
+        positions = []
+        seen = set()
+        for day in days:
+            for position in self.day_events(day, instructor).positions:
+                if position not in seen:
+                    seen.add(position)
+                    positions.append(position)
+        return MappedEvents(self.file, positions)
+
+    def instructor_counts(self) -> Dict[str, int]:
+        offsets = self.file.sections['group.instructor.offsets']
+        return {instructor: offsets[group + 1] - offsets[group] for instructor, group in self.by_instructor.items()}
+
+    def column(self, field: str) -> List:
+        return self.file.column(field)
+
+
+class SnapshotFileWriter:
+    """
+    同步行程：每次快照替換後寫入快照檔
+
+    資料版本在事件集合變更時遞增（由檔案中已有的版本接續，重新啟動後不會重複）；
+    只有就緒狀態或同步時間變更時以相同的資料版本重寫，worker 沿用已載入的索引
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_version = read_data_version(path) or 0
+        self.writes = 0
+        self.bytes = None
+        self.duration = None
+        self._written = None
+
+    def write(self, snapshot) -> bool:
+        """寫入快照（與上次寫入的資料及狀態都相同時略過，回傳是否寫入）"""
+        state = (snapshot.version, snapshot.readiness, snapshot.synced_at)
+        if state == self._written:
+            return False
+        data_version = self.data_version
+        if self._written is None or self._written[0] != snapshot.version:
+            data_version += 1
+        started = time.perf_counter()
+        self.bytes = write_snapshot(self.path, snapshot, data_version)
+        self.duration = time.perf_counter() - started
+        self.data_version = data_version
+        self._written = state
+        self.writes += 1
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            'path': self.path,
+            'data_version': self.data_version,
+            'writes': self.writes,
+            'bytes': self.bytes,
+            'last_write_ms': round(self.duration * 1000, 1) if self.duration is not None else None
+        }
+
+
+class SnapshotFileReader:
+    """
+    worker 行程：檢查快照檔是否已被替換，有新檔案時重新 mmap
+
+    每 poll_seconds 秒最多檢查一次（只需 stat，不讀取內容），請求處理中可直接呼叫
+    """
+
+    def __init__(self, path: str, poll_seconds: float = 1.0):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.current = None
+        self.loads = 0
+        self._identity = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def poll(self, force: bool = False) -> Optional[MappedSnapshotFile]:
+        """
+        檢查快照檔
+
+        Returns:
+            檔案已替換時回傳新的 MappedSnapshotFile，否則回傳 None
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return None
+        with self._lock:
+            if not force and now < self._next_check:
+                return None
+            self._next_check = now + self.poll_seconds
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return None
+            if (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size) == self._identity:
+                return None
+            try:
+                mapped = MappedSnapshotFile(self.path)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 無法載入共用快照 {self.path}: {str(e)}")
+                return None
+            self._identity = mapped.identity
+            self.current = mapped
+            self.loads += 1
+            return mapped
+
+    def stats(self) -> Dict:
+        current = self.current
+        return {
+            'path': self.path,
+            'poll_seconds': self.poll_seconds,
+            'loads': self.loads,
+            'data_version': current.data_version if current is not None else None,
+            'mapped_bytes': current.size if current is not None else None
+        }
+
+
+def snapshot_synced_at(meta: Dict) -> Optional[datetime]:
+    """快照檔 meta 中的同步時間"""
+    return datetime.fromisoformat(meta['synced_at']) if meta.get('synced_at') else None
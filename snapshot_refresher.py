@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+背景資料更新
+依設定的 TTL 定期執行同步；同時間只會有一次同步在進行，
+其他要求更新的呼叫端合併到進行中的同步並等待同一個結果
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class RefreshAttempt:
+    """一次同步（進行中或已完成）"""
+
+    __slots__ = ('started', 'finished', 'success', 'error', 'done')
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.success = None
+        self.error = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict:
+        return {
+            'success': self.success,
+            'error': self.error,
+            'duration_seconds': round(self.finished - self.started, 3) if self.finished is not None else None
+        }
+
+
+class SnapshotRefresher:
+    """
+    定期同步與合併並行的更新要求
+
+    load 執行一次同步並替換資料（回傳是否成功）；同步在背景執行緒進行，
+    讀取端不會被阻擋，同步期間仍讀取舊資料
+    """
+
+    def __init__(self, load: Callable[[], bool], ttl: float, name: str = 'refresher'):
+        """
+        Args:
+            load: 同步函數
+            ttl: 兩次定期同步的間隔秒數（0 或 None 表示不定期同步，只在要求時更新）
+            name: 背景執行緒名稱
+        """
+        self.load = load
+        self.ttl = ttl
+        self.name = name
+        self.last = None
+        self.refreshes = 0
+        self.coalesced = 0
+        self._inflight = None
+        self._lock = threading.Lock()
+        self._loop = None
+        self._stop = threading.Event()
+        self._first = threading.Event()
+
+    def refresh(self, wait: bool = True, timeout: Optional[float] = None) -> Dict:
+        """
+        要求更新（已有同步進行中時合併到該次同步）
+
+        Args:
+            wait: 是否等待同步完成
+            timeout: 最多等待的秒數（None 表示等到完成）
+
+        Returns:
+            {'coalesced', 'completed', 'success', 'error', 'duration_seconds'}
+        """
+        with self._lock:
+            attempt = self._inflight
+            coalesced = attempt is not None
+            if coalesced:
+                self.coalesced += 1
+            else:
+                attempt = self._inflight = RefreshAttempt()
+                self.refreshes += 1
+                threading.Thread(target=self._run, args=(attempt,), name=f'{self.name}-sync', daemon=True).start()
+
+        completed = attempt.done.wait(timeout) if wait else attempt.done.is_set()
+        return dict(attempt.to_dict(), coalesced=coalesced, completed=completed)
+
+    def _run(self, attempt: RefreshAttempt):
+        try:
+            attempt.success = bool(self.load())
+        except Exception as e:
+            attempt.success = False
+            attempt.error = str(e)
+            print(f"❌ 背景同步失敗: {str(e)}")
+        finally:
+            attempt.finished = time.monotonic()
+            with self._lock:
+                self._inflight = None
+                self.last = attempt
+            attempt.done.set()
+            self._first.set()
+
+    def start(self) -> threading.Thread:
+        """啟動定期同步（第一次同步立即開始；已啟動時不重複啟動）"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = threading.Thread(target=self._run_loop, name=self.name, daemon=True)
+                self._loop.start()
+        return self._loop
+
+    @property
+    def started(self) -> bool:
+        return self._loop is not None
+
+    def _run_loop(self):
+        while not self._stop.is_set():
+            self.refresh(wait=True)
+            if not self.ttl or self._stop.wait(self.ttl):
+                break
+
+    def stop(self):
+        self._stop.set()
+
+    def wait_first(self, timeout: Optional[float] = None) -> bool:
+        """啟動定期同步並等待第一次同步完成（供命令列工具與測試使用）"""
+        self.start()
+        return self._first.wait(timeout)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            last = self.last
+            inflight = self._inflight is not None
+        return {
+            'ttl_seconds': self.ttl,
+            'running': self.started and not self._stop.is_set(),
+            'in_flight': inflight,
+            'refreshes': self.refreshes,
+            'coalesced': self.coalesced,
+            'last': last.to_dict() if last is not None else None
+        }
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+課程標題解析
+從事件標題與描述中辨識講師，並將固定格式的標題拆解為課程欄位
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+UNKNOWN_INSTRUCTOR = 'UNKNOWN'
+
+SUBSTITUTE_TYPES = ('代課', '帶班', '代理', '支援')
+
+# 標題格式：{課程類型} {星期} {HH:MM-HH:MM} {地點} 第{n}週 [{代課|帶班|代理|支援}]{原講師}
+COURSE_TITLE_RE = re.compile(
+    r'^\s*(?P<course_type>\S+)\s+'
+    r'(?P<weekday>[一二三四五六日])\s+'
+    r'(?P<time_range>\d{1,2}:\d{2}\s*-\s*\d{1,2}:\d{2})\s+'
+    r'(?P<location>.+?)\s+'
+    r'第\s*(?P<week_number>\d+)\s*週'
+    r'(?:\s*\[(?P<substitute_type>' + '|'.join(SUBSTITUTE_TYPES) + r')\]\s*(?P<original_instructor>\S+))?'
+    r'\s*$'
+)
+
+EMPTY_COURSE_FACETS = {
+    'course_type': None,
+    'weekday': None,
+    'time_range': None,
+    'course_location': None,
+    'week_number': None,
+    'substitute_type': None,
+    'original_instructor': None
+}
+
+
+@lru_cache(maxsize=4096)
+def _parse_course_title(title: str) -> Tuple:
+    match = COURSE_TITLE_RE.match(title)
+    if not match:
+        return ()
+    return (
+        match.group('course_type').upper(),
+        match.group('weekday'),
+        match.group('time_range').replace(' ', ''),
+        match.group('location'),
+        int(match.group('week_number')),
+        match.group('substitute_type'),
+        match.group('original_instructor')
+    )
+
+
+def parse_course_title(title: str) -> Dict:
+    """
+    拆解課程標題
+
+    例如 'SPM 日 13:30-15:00 松山 第2週 [代課]TIM' ->
+    {'course_type': 'SPM', 'weekday': '日', 'time_range': '13:30-15:00', 'course_location': '松山',
+     'week_number': 2, 'substitute_type': '代課', 'original_instructor': 'TIM'}
+
+    不符合格式的標題所有欄位皆為 None
+    """
+    parsed = _parse_course_title(title or '')
+    if not parsed:
+        return dict(EMPTY_COURSE_FACETS)
+    return dict(zip(EMPTY_COURSE_FACETS, parsed))
+
+
+def instructor_search_text(title: str, facets: Dict) -> str:
+    """講師比對用的標題：代課標示後的名稱是原講師，不是授課講師"""
+    if facets.get('substitute_type'):
+        return title.split('[', 1)[0]
+    return title
+
+
+class InstructorMatcher:
+    """
+    由講師名單編譯而成的講師比對器
+
+    所有講師名稱合併為一個不分大小寫的正規表示式（較長的名稱優先），
+    一次掃描即可找出標題中最左邊的講師名稱；重複出現的標題由 LRU 快取直接回傳
+    """
+
+    def __init__(self, names: Tuple[str, ...], cache_size: int = 4096):
+        """
+        Args:
+            names: 講師名稱
+            cache_size: LRU 快取大小（重複課程的標題大量重複）
+        """
+        self.names = names
+        self._canonical = {name.upper(): name for name in names}
+
+        pattern = '|'.join(re.escape(name) for name in sorted(self._canonical, key=len, reverse=True))
+        # 名稱前後不可緊接英文字母，避免 TED 誤判 STEDY 之類的字
+        self._regex = re.compile(rf'(?<![A-Za-z])(?:{pattern})(?![A-Za-z])', re.IGNORECASE) if pattern else None
+
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, title: str, description: str = '') -> str:
+        """先比對標題，找不到時再比對描述"""
+        if self._regex is None:
+            return UNKNOWN_INSTRUCTOR
+        for text in (title, description):
+            if text:
+                found = self._regex.search(text)
+                if found:
+                    return self._canonical[found.group(0).upper()]
+        return UNKNOWN_INSTRUCTOR
+
+    def cache_info(self) -> Dict:
+        info = self.match.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
+
+
+_matcher = None
+_matcher_source = None
+
+
+def get_instructor_matcher(teachers: List[Dict]) -> InstructorMatcher:
+    """取得講師比對器（講師名單變更時重新編譯）"""
+    global _matcher, _matcher_source
+    matcher = _matcher
+    # 同一份名單直接沿用，不必每次重新比對名稱
+    if matcher is not None and teachers is _matcher_source and len(teachers) == len(matcher.names):
+        return matcher
+
+    names = tuple(teacher['name'] for teacher in teachers if teacher.get('name'))
+    if matcher is None or matcher.names != names:
+        matcher = InstructorMatcher(names)
+        _matcher = matcher
+    _matcher_source = teachers
+    return matcher